@@ -5,4 +5,6 @@ class AccountConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'account'
     def ready(self) -> None:
+        from . import fx  # noqa: F401 Connects the exchange rate cache invalidation signals
+        from . import sqlite  # noqa: F401 Connects the SQLite connection tuning
         return super().ready()
@@ -0,0 +1,124 @@
+import json
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from users.authentication import AsyncJWTAuthentication
+from .idempotency import idempotent
+from .mixins import AccountMixin, TransactionFilterMixin
+from .models import BankAccount, Transaction
+from .pagination import TransactionCursorPagination
+from .serializers import TransactionSerializer
+from .views import DepositMixin, TransferMixin, WithdrawMixin
+
+class AsyncAPIView(View):
+    # Base for the native async endpoints. DRF views are synchronous, so under ASGI every request
+    # to them holds a worker thread from start to finish. These views authenticate, parse the body
+    # and read through the async ORM on the event loop, and answer with the same JSON bodies,
+    # status codes and error format as the DRF views they mirror.
+    authentication = AsyncJWTAuthentication()
+    authentication_required = False
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # Bearer tokens, not session cookies, authenticate these views, so like DRF's they skip CSRF
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request.user = await self.authenticate(request)
+            request.query_params = request.GET
+            request.data = self.parse(request)
+            response = await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            response = self.handle_exception(request, exc)
+        return self.finalize_response(request, response)
+
+    async def authenticate(self, request):
+        result = await self.authentication.aauthenticate(request)
+        if result is None:
+            if self.authentication_required:
+                raise NotAuthenticated()
+            return AnonymousUser()
+        return result[0]
+
+    def parse(self, request):
+        if request.method not in ('POST', 'PUT', 'PATCH'):
+            return {}
+        if request.content_type != 'application/json':
+            return request.POST
+        try:
+            return json.loads(request.body) if request.body else {}
+        except ValueError as e:
+            raise ParseError(f'JSON parse error - {e}')
+
+    # Same response as DRF's default exception handler
+    def handle_exception(self, request, exc):
+        headers = {}
+        if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+            headers['WWW-Authenticate'] = self.authentication.authenticate_header(request)
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        return Response(data, status=exc.status_code, headers=headers)
+
+    def finalize_response(self, request, response):
+        if isinstance(response, Response):
+            response.accepted_renderer = JSONRenderer()
+            response.accepted_media_type = response.accepted_renderer.media_type
+            response.renderer_context = {'view': self, 'request': request, 'response': response}
+        return response
+
+# Django's async ORM can't open a transaction, so each view below does its reads on the event loop
+# and hands only the atomic write, with its idempotency key, to a worker thread.
+
+class AsyncDepositView(DepositMixin, AccountMixin, AsyncAPIView):
+    async def post(self, request, pk):
+        account = await self.aget_account(pk)
+        amount = Decimal(request.data.get('amount', 0))
+        currency = request.data.get('currency', account.currency)  # Use account currency if not provided
+        return await sync_to_async(self.apply)(request, account, amount, currency)
+
+    @idempotent
+    def apply(self, request, account, amount, currency):
+        balance = self.deposit(account, amount, currency)
+        return Response({'balance': balance, 'message': 'Deposit successful!'})
+
+class AsyncWithdrawView(WithdrawMixin, AccountMixin, AsyncAPIView):
+    async def post(self, request, pk):
+        account = await self.aget_account(pk)
+        amount = Decimal(request.data.get('amount', 0))
+        currency = request.data.get('currency', account.currency)  # Use account currency if not provided
+        return await sync_to_async(self.apply)(request, account, amount, currency)
+
+    @idempotent
+    def apply(self, request, account, amount, currency):
+        return Response({'balance': self.withdraw(account, amount, currency)})
+
+class AsyncTransferView(TransferMixin, AccountMixin, AsyncAPIView):
+    async def post(self, request):
+        amount = Decimal(request.data.get('amount', 0))
+        currency = request.data.get('currency')  # Specify the currency for the transfer
+
+        from_account = await self.aget_account(request.data.get('from_account_id'))
+        to_account = await self.aget_account(request.data.get('to_account_id'))
+        return await sync_to_async(self.apply)(request, from_account, to_account, amount, currency)
+
+    @idempotent
+    def apply(self, request, from_account, to_account, amount, currency):
+        from_balance, to_balance = self.transfer(from_account, to_account, amount, currency)
+        return Response({'from_balance': from_balance, 'to_balance': to_balance})
+
+class AsyncUserTransactionsView(TransactionFilterMixin, AsyncAPIView):
+    authentication_required = True
+    pagination_class = TransactionCursorPagination
+
+    async def get(self, request):
+        user_accounts = BankAccount.objects.filter(user=request.user)
+        queryset = self.filter_transactions(Transaction.objects.filter(account__in=user_accounts))
+        paginator = self.pagination_class()
+        page = await paginator.apaginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(TransactionSerializer(page, many=True).data)
@@ -0,0 +1,55 @@
+import hashlib
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import parse_etags, patch_cache_control
+from rest_framework.response import Response
+from .cache import LRUCache
+from .models import DataVersion
+from .renderers import FastJSONRenderer
+
+# Rendered responses by (user, data version, absolute URI, media type). Pagination links are absolute,
+# so the scheme and host are part of the key. Once a user's version moves, their older
+# entries are never looked up again and age out of the cache.
+_responses = LRUCache(settings.RESPONSE_CACHE_SIZE)
+
+class ConditionalListMixin:
+    # For a GET of lists made only of the user's transactions or loans. The user's data version is
+    # read first, with one primary key lookup. A request whose If-None-Match holds the ETag of that
+    # version gets a 304, and a response already rendered at that version is sent again, both without
+    # reading the list. The version is bumped in the same DB transaction as every write to the list's
+    # rows, so neither can be stale. Only JSON is cached; the browsable API renders as usual.
+    cache_key = None
+
+    def get(self, request, *args, **kwargs):
+        if not isinstance(request.accepted_renderer, FastJSONRenderer):
+            return super().get(request, *args, **kwargs)
+        version = DataVersion.objects.current(request.user.pk)
+        self.cache_key = (request.user.pk, version, request.build_absolute_uri(), request.accepted_media_type)
+        etags = get_if_none_match(request)
+        if '*' in etags or get_etag(self.cache_key) in etags:
+            return HttpResponseNotModified()
+        cached = _responses.get(self.cache_key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+        return super().get(request, *args, **kwargs)
+
+    # The version was read before the list, so a write committed in between can only make the
+    # cached response newer than its version, never older
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.cache_key is not None and response.status_code in (200, 304):
+            if isinstance(response, Response):
+                response.render()
+                _responses.set(self.cache_key, (response.content, response['Content-Type']))
+            response['ETag'] = get_etag(self.cache_key)
+            patch_cache_control(response, private=True, no_cache=True)  # Revalidated on every use
+        return response
+
+def get_etag(cache_key):
+    return '"%s"' % hashlib.blake2b(repr(cache_key).encode(), digest_size=16).hexdigest()
+
+# The ETags in the If-None-Match header, compared weakly as RFC 9110 asks
+def get_if_none_match(request):
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    return {etag.removeprefix('W/') for etag in etags}
@@ -0,0 +1,67 @@
+import threading
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.exceptions import ValidationError
+from .models import ExchangeRate
+
+_lock = threading.Lock()
+_table = None
+
+class RateTable:
+    # An immutable snapshot of every cross rate.
+    # Rates are stored against one base currency and triangulated here once, so a conversion
+    # between any two currencies is a single dict lookup with no arithmetic on the rates.
+    def __init__(self, version, rates):
+        self.version = version
+        self.checked_at = time.monotonic()
+        rates = dict(rates)
+        rates.setdefault(settings.FX_BASE_CURRENCY, Decimal(1))
+        self.matrix = {
+            (from_currency, to_currency): to_rate / from_rate
+            for from_currency, from_rate in rates.items()
+            for to_currency, to_rate in rates.items()
+        }
+
+    def rate(self, from_currency, to_currency):
+        try:
+            return self.matrix[from_currency, to_currency]
+        except KeyError:
+            raise ValidationError("Currency conversion not supported.")
+
+# The version changes whenever a rate is added, changed or removed
+def _current_version():
+    stats = ExchangeRate.objects.aggregate(updated=Max('updated_at'), count=Count('id'))
+    return stats['updated'], stats['count']
+
+# Return the cached rate table. After FX_CACHE_TTL seconds the version is re-checked with one
+# aggregate query, and the table is only rebuilt if another process changed the rates meanwhile.
+def get_rate_table():
+    global _table
+    table = _table
+    if table is not None and time.monotonic() - table.checked_at < settings.FX_CACHE_TTL:
+        return table
+
+    with _lock:
+        # Another thread may have refreshed the table while we waited for the lock
+        if _table is not None and _table is not table:
+            return _table
+        version = _current_version()
+        if table is not None and table.version == version:
+            table.checked_at = time.monotonic()
+        else:
+            table = RateTable(version, ExchangeRate.objects.values_list('currency', 'rate'))
+        _table = table
+        return table
+
+# Drop the cached table so the next lookup reloads it
+def invalidate():
+    global _table
+    _table = None
+
+@receiver([post_save, post_delete], sender=ExchangeRate)
+def invalidate_on_change(sender, **kwargs):
+    invalidate()
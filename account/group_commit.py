@@ -0,0 +1,106 @@
+import queue
+import random
+import threading
+import time
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+class _Write:
+    # One request's write, waiting for the batch it joins to commit
+    def __init__(self, func, args, kwargs):
+        self.func, self.args, self.kwargs = func, args, kwargs
+        self.done = threading.Event()
+        self.result = self.error = None
+
+class GroupCommitWriter:
+    # Runs writes handed over by request threads on one writer thread, committing up to
+    # GROUP_COMMIT_BATCH_SIZE of them together once the first has waited GROUP_COMMIT_MAX_WAIT
+    # seconds, so one commit and its fsync serve the whole batch. Each write runs in its own savepoint:
+    # a write that raises is rolled back alone, and its error is raised in the request that handed it
+    # over. A request gets its result only after its batch has committed.
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0  # Batches committed, and the writes they held
+        self.writes = 0
+
+    # Retries follow the policy of the atomic_with_retry call that handed the write over
+    def run(self, func, args, kwargs, attempts, backoff):
+        write = _Write(func, args, kwargs)
+        self.start()
+        self._queue.put((write, attempts, backoff))
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='group-commit-writer', daemon=True)
+                self._thread.start()
+
+    # Commit what was handed over so far, then end the writer thread and close its connection
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def _loop(self):
+        try:
+            stopping = False
+            while not stopping:
+                batch = []
+                item = self._queue.get()
+                deadline = time.monotonic() + settings.GROUP_COMMIT_MAX_WAIT
+                while item is not None:
+                    batch.append(item)
+                    if len(batch) >= settings.GROUP_COMMIT_BATCH_SIZE:
+                        break
+                    try:
+                        item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                stopping = item is None
+                if batch:
+                    self._flush(batch)
+        finally:
+            connection.close()
+
+    def _flush(self, batch):
+        writes = [write for write, _, _ in batch]
+        try:
+            self._commit(writes, min(attempts for _, attempts, _ in batch), max(backoff for _, _, backoff in batch))
+        except Exception as e:
+            for write in writes:
+                write.result, write.error = None, e
+        for write in writes:
+            write.done.set()
+
+    # The batch is retried as a whole when taking the lock or committing fails: then none of its writes were kept
+    def _commit(self, writes, attempts, backoff):
+        for attempt in range(attempts):
+            try:
+                with transaction.atomic():
+                    for write in writes:
+                        try:
+                            with transaction.atomic():
+                                write.result, write.error = write.func(*write.args, **write.kwargs), None
+                        except OperationalError:
+                            raise  # A lock or serialization failure: the whole batch is retried
+                        except Exception as e:
+                            write.result, write.error = None, e
+                self.batches += 1
+                self.writes += len(writes)
+                return
+            except OperationalError:
+                connection.close()
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(random.uniform(0, backoff * 2 ** attempt))
+
+group_writer = GroupCommitWriter()
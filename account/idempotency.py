@@ -0,0 +1,124 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from .cache import LRUCache
+from .models import IdempotencyKey
+from .transfers import atomic_with_retry
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# Hot replays are answered from here without touching the database
+_recent = LRUCache(settings.IDEMPOTENCY_CACHE_SIZE)
+
+class KeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "Idempotency-Key was already used for a different request."
+    default_code = 'idempotency_key_reused'
+
+class _KeyTaken(Exception):
+    # Another request claimed the key first
+    pass
+
+class _Discard(Exception):
+    # The request did not succeed, so neither it nor its key are kept
+    def __init__(self, response):
+        self.response = response
+
+# Make a money-moving POST handler idempotent.
+# A request carrying an Idempotency-Key header claims the key in the same DB transaction as its
+# balance change and stores its response there. A retry with the same key gets the stored response
+# back and moves no money. Only successful responses are kept, so a request that failed (for example
+# for insufficient funds) can be retried with its key. Requests without the header are unaffected.
+def idempotent(post):
+    @wraps(post)
+    def wrapper(self, request, *args, **kwargs):
+        client_key = request.headers.get(HEADER)
+        if not client_key:
+            return post(self, request, *args, **kwargs)
+        if len(client_key) > MAX_KEY_LENGTH:
+            raise ValidationError({HEADER: f"Must be at most {MAX_KEY_LENGTH} characters."})
+
+        key = f'{request.user.pk or "-"}:{client_key}'
+        fingerprint = get_fingerprint(request)
+        stored = lookup(key)
+        if stored is not None:
+            return replay(stored, fingerprint)
+
+        try:
+            return atomic_with_retry(execute, post, self, request, args, kwargs, key, fingerprint)
+        except _Discard as e:
+            return e.response
+        except _KeyTaken:
+            # A concurrent request with the same key committed first, so answer with its response
+            return replay(lookup(key), fingerprint)
+    return wrapper
+
+def execute(post, view, request, args, kwargs, key, fingerprint):
+    try:
+        # Claiming the key first makes a concurrent duplicate wait on the unique index until we finish
+        record = IdempotencyKey.objects.create(
+            key=key,
+            fingerprint=fingerprint,
+            expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        )
+    except IntegrityError:
+        raise _KeyTaken()
+
+    response = post(view, request, *args, **kwargs)
+    if not status.is_success(response.status_code):
+        raise _Discard(response)
+
+    record.status_code = response.status_code
+    record.response = response.data
+    record.save(update_fields=['status_code', 'response'])
+    # Cache the response the way it reads back from the table, encoded like DRF renders it
+    record.response = json.loads(json.dumps(response.data, cls=JSONEncoder))
+    transaction.on_commit(lambda: remember(record))
+    return response
+
+def get_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+def lookup(key):
+    stored = _recent.get(key)
+    if stored is None:
+        record = IdempotencyKey.objects.filter(key=key, status_code__isnull=False).first()
+        if record is None:
+            return None
+        stored = remember(record)
+
+    if stored['expires_at'] <= timezone.now():
+        _recent.delete(key)
+        IdempotencyKey.objects.filter(key=key, expires_at__lte=timezone.now()).delete()
+        return None
+    return stored
+
+def remember(record):
+    stored = {
+        'fingerprint': record.fingerprint,
+        'status_code': record.status_code,
+        'response': record.response,
+        'expires_at': record.expires_at,
+    }
+    _recent.set(record.key, stored)
+    return stored
+
+def replay(stored, fingerprint):
+    if stored is None or stored['fingerprint'] != fingerprint:
+        raise KeyReused()
+    response = Response(stored['response'], status=stored['status_code'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+def forget_all():
+    _recent.clear()
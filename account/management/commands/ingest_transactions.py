@@ -0,0 +1,148 @@
+import csv
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from account.models import CENT, BankAccount, IngestCheckpoint, Transaction
+from account.transfers import lock_accounts
+from account.views import deposit_net_amount
+
+class Command(BaseCommand):
+    help = (
+        "Stream deposit records from a CSV or NDJSON file into the ledger. "
+        "Each record needs 'account_id' and 'amount', and may give a 'currency'. "
+        "Progress is checkpointed with every chunk, so a rerun resumes where the last one stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV (with a header row) or NDJSON file to ingest")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help="Input format, guessed from the file extension by default")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Records written per DB transaction")
+        parser.add_argument('--checkpoint', help="Checkpoint name, defaults to the absolute file path")
+        parser.add_argument('--restart', action='store_true', help="Ignore any saved checkpoint and start from the beginning")
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['path'])
+        if not os.path.isfile(path):
+            raise CommandError(f"File not found: {path}")
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        checkpoint, _ = IngestCheckpoint.objects.get_or_create(source=options['checkpoint'] or path)
+        if options['restart']:
+            checkpoint.offset = checkpoint.records = 0
+            checkpoint.save()
+        elif checkpoint.offset:
+            self.stdout.write(f"Resuming after {checkpoint.records} records (byte offset {checkpoint.offset})")
+
+        self.verbosity = options['verbosity']
+        self.ingested = self.rejected = 0
+        started = time.perf_counter()
+        with open(path, 'rb') as source:
+            chunk = []
+            for offset, line_number, record in self.read_records(source, file_format, checkpoint.offset):
+                chunk.append((line_number, record))
+                if len(chunk) >= options['chunk_size']:
+                    self.write_chunk(chunk, checkpoint, offset)
+                    chunk = []
+                    self.report_progress(started)
+            if chunk:
+                self.write_chunk(chunk, checkpoint, offset)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Ingested {self.ingested} records ({self.rejected} rejected) in {elapsed:.2f}s, "
+            f"{(self.ingested + self.rejected) / elapsed if elapsed else 0:.0f} records/s"
+        ))
+
+    # Yield (offset after the line, line number, record dict), starting at byte 'start'.
+    # Reading line by line keeps memory flat regardless of file size.
+    def read_records(self, source, file_format, start):
+        header = None
+        line_number = 0
+        offset = 0
+        if file_format == 'csv':
+            first_line = source.readline()
+            header = next(csv.reader([first_line.decode()]))
+            line_number = 1
+            offset = len(first_line)
+
+        if start > offset:
+            source.seek(start)
+            offset = start
+            line_number = None  # Unknown without rereading the skipped part of the file
+
+        for line in source:
+            offset += len(line)
+            if line_number is not None:
+                line_number += 1
+            text = line.decode().strip()
+            if not text:
+                continue
+            if header is not None:
+                record = dict(zip(header, next(csv.reader([text]))))
+            else:
+                try:
+                    record = json.loads(text)
+                except ValueError:
+                    record = {}
+            yield offset, line_number, record
+
+    # Apply one chunk of records and advance the checkpoint in the same DB transaction
+    def write_chunk(self, chunk, checkpoint, offset):
+        account_ids = set()
+        for _, record in chunk:
+            try:
+                account_ids.add(int(record.get('account_id')))
+            except (TypeError, ValueError):
+                pass
+
+        with transaction.atomic():
+            # Running balances need the current balances, locked until the chunk commits
+            accounts = lock_accounts(account_ids)
+            ledger = []
+            deltas = {}
+            for line_number, record in chunk:
+                try:
+                    account = accounts.get(int(record.get('account_id')))
+                    if account is None:
+                        raise ValidationError("Account not found.")
+                    net_amount = self.get_net_amount(record, account.currency)
+                except (TypeError, ValueError, InvalidOperation, ValidationError) as e:
+                    self.rejected += 1
+                    detail = e.detail[0] if isinstance(e, ValidationError) else "Malformed record."
+                    self.stderr.write(f"Rejected record{f' on line {line_number}' if line_number else ''}: {detail}")
+                    continue
+
+                account.balance += net_amount
+                ledger.append(Transaction(
+                    account=account,
+                    amount=net_amount,
+                    transaction_type='deposit',
+                    currency=account.currency,
+                    signed_amount=net_amount,
+                    balance_after=account.balance
+                ))
+                deltas[account.pk] = deltas.get(account.pk, 0) + net_amount
+
+            Transaction.objects.bulk_create(ledger)
+            BankAccount.objects.adjust_balances(deltas)
+            checkpoint.offset = offset
+            checkpoint.records += len(chunk)
+            checkpoint.save()
+        self.ingested += len(ledger)
+
+    # Same fee and conversion rules as DepositView
+    def get_net_amount(self, record, account_currency):
+        amount = Decimal(str(record.get('amount')))
+        currency = record.get('currency') or account_currency
+        return Decimal(deposit_net_amount(amount, currency, account_currency)).quantize(CENT)
+
+    def report_progress(self, started):
+        if self.verbosity > 1:
+            processed = self.ingested + self.rejected
+            self.stdout.write(f"{processed} records, {processed / (time.perf_counter() - started):.0f} records/s")
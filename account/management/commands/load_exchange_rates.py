@@ -0,0 +1,62 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from account import fx
+from account.models import ExchangeRate
+
+class Command(BaseCommand):
+    help = (
+        "Load exchange rates from a CSV file with 'currency,rate' columns or a JSON object of "
+        "{currency: rate}. Rates are units of the currency per one unit of FX_BASE_CURRENCY."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSON rates file")
+        parser.add_argument('--replace', action='store_true', help="Delete stored rates for currencies missing from the file")
+
+    def handle(self, *args, **options):
+        rates = self.read_rates(options['path'])
+        if not rates:
+            raise CommandError("No rates found in the file.")
+
+        with transaction.atomic():
+            ExchangeRate.objects.bulk_create(
+                [ExchangeRate(currency=currency, rate=rate) for currency, rate in rates.items()],
+                update_conflicts=True,
+                unique_fields=['currency'],
+                update_fields=['rate', 'updated_at']
+            )
+            if options['replace']:
+                ExchangeRate.objects.exclude(currency__in=rates).delete()
+
+        # bulk_create sends no post_save signal, so drop this process's cache by hand.
+        # Other processes notice the new version once their FX_CACHE_TTL runs out.
+        fx.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Loaded {len(rates)} exchange rates against {settings.FX_BASE_CURRENCY}"))
+
+    def read_rates(self, path):
+        try:
+            with open(path, newline='') as f:
+                if path.lower().endswith('.json'):
+                    rows = json.load(f).items()
+                else:
+                    rows = [(row['currency'], row['rate']) for row in csv.DictReader(f)]
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Could not read {path}: {e}")
+
+        rates = {}
+        for currency, rate in rows:
+            currency = currency.strip().upper()
+            try:
+                rate = Decimal(str(rate))
+            except InvalidOperation:
+                raise CommandError(f"Invalid rate for {currency}: {rate}")
+            if len(currency) != 3 or rate <= 0:
+                raise CommandError(f"Invalid rate for {currency}: {rate}")
+            if currency == settings.FX_BASE_CURRENCY and rate != 1:
+                raise CommandError(f"The base currency {currency} must have a rate of 1.")
+            rates[currency] = rate
+        return rates
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from account.models import MonthlyActivity
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the monthly activity summary from the transaction ledger, in one DB transaction. "
+        "Run it after changing or deleting transactions outside the app, or to check nothing drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, action='append', dest='accounts', help="Only this account (repeatable)")
+
+    def handle(self, *args, **options):
+        rows = MonthlyActivity.objects.rebuild(options['accounts'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} monthly activity rows"))
@@ -0,0 +1,23 @@
+from decimal import Decimal
+from django.db import migrations
+
+# The example rates convert_currency used to hard-code, expressed per one USD
+INITIAL_RATES = {'USD': Decimal('1'), 'EUR': Decimal('0.85'), 'ILS': Decimal('3.5')}
+
+
+def seed_exchange_rates(apps, schema_editor):
+    ExchangeRate = apps.get_model('account', 'ExchangeRate')
+    db = schema_editor.connection.alias
+    for currency, rate in INITIAL_RATES.items():
+        ExchangeRate.objects.using(db).get_or_create(currency=currency, defaults={'rate': rate})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0003_exchangerate'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_exchange_rates, migrations.RunPython.noop),
+    ]
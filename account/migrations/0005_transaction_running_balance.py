@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_seed_exchange_rates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='balance_after',
+            field=models.DecimalField(decimal_places=2, max_digits=15, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='signed_amount',
+            field=models.DecimalField(decimal_places=2, max_digits=15, null=True),
+        ),
+    ]
@@ -0,0 +1,150 @@
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from django.db import migrations, transaction
+from django.db.models import Case, F, Q, When
+
+CHUNK_SIZE = 1000
+PAIR_WINDOW = timedelta(seconds=1)  # Longest gap between the two rows of one transfer
+TRANSFER_FEE = Decimal('0.01')  # Fee transfers charged on top of the amount credited, as a fraction
+CENT = Decimal('0.01')
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_signed_amounts(Transaction, db):
+    # Deposits are credits and withdrawals debits
+    last_id = 0
+    while True:
+        ids = list(
+            Transaction.objects.using(db)
+            .filter(pk__gt=last_id, signed_amount__isnull=True)
+            .exclude(transaction_type='transfer')
+            .order_by('pk').values_list('pk', flat=True)[:CHUNK_SIZE]
+        )
+        if not ids:
+            break
+        with transaction.atomic(using=db):
+            Transaction.objects.using(db).filter(pk__in=ids).update(signed_amount=Case(
+                When(transaction_type='withdraw', then=-F('amount')),
+                default=F('amount')
+            ))
+        last_id = ids[-1]
+
+    backfill_transfer_signs(Transaction, db)
+
+
+# Transfers wrote their debit row, then their credit row, as two separate statements outside any
+# DB transaction. Concurrent transfers could interleave their rows and a crash between the two could
+# leave one alone, so legs are paired on what they hold rather than on their position: the debit
+# comes first, within PAIR_WINDOW of the credit, on another account, and when both are in the same
+# currency it is the credit plus the fee.
+def is_transfer_pair(debit, credit):
+    if debit.account_id == credit.account_id or not timedelta(0) <= credit.timestamp - debit.timestamp <= PAIR_WINDOW:
+        return False
+    if debit.currency != credit.currency:
+        return True  # Converted at a rate that is no longer known
+    return abs(debit.amount - credit.amount * (1 + TRANSFER_FEE)) <= CENT
+
+
+# Rows without a partner keep a NULL signed_amount and are reported
+def backfill_transfer_signs(Transaction, db):
+    unpaired = []
+    waiting = []  # Rows not paired yet that a later credit may still pair with, oldest first
+    last_id = 0
+    while True:
+        rows = list(
+            Transaction.objects.using(db)
+            .filter(pk__gt=last_id, signed_amount__isnull=True, transaction_type='transfer')
+            .order_by('pk').only('pk', 'account', 'amount', 'currency', 'timestamp')[:CHUNK_SIZE]
+        )
+        if not rows:
+            break
+        paired = []
+        for row in rows:
+            # Rows too old to be the debit of this row or any later one stay unpaired
+            while waiting and row.timestamp - waiting[0].timestamp > PAIR_WINDOW:
+                unpaired.append(waiting.pop(0).pk)
+            # The nearest earlier row wins when several would match
+            debit = next((candidate for candidate in reversed(waiting) if is_transfer_pair(candidate, row)), None)
+            if debit is None:
+                waiting.append(row)
+                continue
+            waiting.remove(debit)
+            debit.signed_amount = -debit.amount
+            row.signed_amount = row.amount
+            paired += [debit, row]
+        with transaction.atomic(using=db):
+            Transaction.objects.using(db).bulk_update(paired, ['signed_amount'])
+        last_id = rows[-1].pk
+    unpaired += [row.pk for row in waiting]
+
+    if unpaired:
+        logger.warning(
+            "%d transfer rows have no matching leg and were left without a signed amount; "
+            "their accounts' running balances stop at them. Ids: %s",
+            len(unpaired), ', '.join(map(str, sorted(unpaired)))
+        )
+
+
+def backfill_balances(BankAccount, Transaction, db):
+    # Replay each account's history backwards from its current balance, which is the balance after
+    # its newest transaction. A row whose sign is unknown ends the replay: it gets its balance, but
+    # the rows before it can't, and keep a NULL one.
+    last_account_id = 0
+    while True:
+        accounts = list(
+            BankAccount.objects.using(db).filter(pk__gt=last_account_id)
+            .order_by('pk').values_list('pk', 'balance')[:CHUNK_SIZE]
+        )
+        if not accounts:
+            break
+
+        for account_id, balance in accounts:
+            history = Transaction.objects.using(db).filter(account_id=account_id)
+            if not history.filter(balance_after__isnull=True).exists():
+                continue
+            running = balance
+
+            position = None
+            while running is not None:
+                page = history.order_by('-timestamp', '-pk').only('pk', 'timestamp', 'signed_amount')
+                if position is not None:
+                    page = page.filter(Q(timestamp__lt=position[0]) | Q(timestamp=position[0], pk__lt=position[1]))
+                rows = list(page[:CHUNK_SIZE])
+                if not rows:
+                    break
+                replayed = []
+                for row in rows:
+                    row.balance_after = running
+                    replayed.append(row)
+                    if row.signed_amount is None:
+                        running = None
+                        break
+                    running -= row.signed_amount
+                with transaction.atomic(using=db):
+                    Transaction.objects.using(db).bulk_update(replayed, ['balance_after'])
+                position = (rows[-1].timestamp, rows[-1].pk)
+
+        last_account_id = accounts[-1][0]
+
+
+def backfill_running_balance(apps, schema_editor):
+    BankAccount = apps.get_model('account', 'BankAccount')
+    Transaction = apps.get_model('account', 'Transaction')
+    db = schema_editor.connection.alias
+    backfill_signed_amounts(Transaction, db)
+    backfill_balances(BankAccount, Transaction, db)
+
+
+class Migration(migrations.Migration):
+    # Each chunk commits on its own so the backfill never holds one huge transaction
+    atomic = False
+
+    dependencies = [
+        ('account', '0005_transaction_running_balance'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_running_balance, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+from decimal import Decimal
+from itertools import islice
+from django.db import migrations, models
+from django.db.models import Count, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+
+CHUNK_SIZE = 1000
+
+
+def backfill_monthly_activity(apps, schema_editor):
+    MonthlyActivity = apps.get_model('account', 'MonthlyActivity')
+    Transaction = apps.get_model('account', 'Transaction')
+    db = schema_editor.connection.alias
+    totals = (
+        Transaction.objects.using(db)
+        .annotate(month=TruncMonth('timestamp', output_field=models.DateField()))
+        .values('account_id', 'month', 'transaction_type')
+        .annotate(
+            count=Count('id'),
+            total=Sum('amount'),
+            net=Coalesce(Sum('signed_amount'), Value(Decimal(0)), output_field=models.DecimalField(max_digits=20, decimal_places=2)),
+        )
+        .order_by()
+    )
+    # Streamed from the cursor and written CHUNK_SIZE rows at a time, so memory stays bounded
+    rows = totals.iterator(chunk_size=CHUNK_SIZE)
+    while chunk := [MonthlyActivity(**row) for row in islice(rows, CHUNK_SIZE)]:
+        MonthlyActivity.objects.using(db).bulk_create(chunk, batch_size=CHUNK_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0008_monthlyactivity'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_monthly_activity, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,6 @@
+from datetime import datetime, time
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework.exceptions import ValidationError
 from .models import BankAccount
 
@@ -6,4 +9,43 @@ class AccountMixin:
         try:
             return BankAccount.objects.get(pk=pk)
         except BankAccount.DoesNotExist:
-            raise ValidationError("Account not found.")
\ No newline at end of file
+            raise ValidationError("Account not found.")
+
+    async def aget_account(self, pk):
+        try:
+            return await BankAccount.objects.aget(pk=pk)
+        except BankAccount.DoesNotExist:
+            raise ValidationError("Account not found.")
+
+class TransactionFilterMixin:
+    # Narrow a Transaction queryset with the optional 'account', 'transaction_type',
+    # 'start' (inclusive) and 'end' (exclusive) query parameters.
+    # Every filter is an equality or range on indexed columns, so keyset pagination still applies.
+    def filter_transactions(self, queryset):
+        params = self.request.query_params
+        if params.get('account'):
+            try:
+                queryset = queryset.filter(account_id=int(params['account']))
+            except ValueError:
+                raise ValidationError({'account': "Must be an account id."})
+        if params.get('transaction_type'):
+            queryset = queryset.filter(transaction_type=params['transaction_type'])
+        if params.get('start'):
+            queryset = queryset.filter(timestamp__gte=self.parse_timestamp('start', params['start']))
+        if params.get('end'):
+            queryset = queryset.filter(timestamp__lt=self.parse_timestamp('end', params['end']))
+        return queryset
+
+    # Accepts an ISO 8601 date or datetime. A bare date means midnight at the start of that day.
+    def parse_timestamp(self, name, value):
+        try:
+            timestamp = parse_datetime(value)
+            if timestamp is None and parse_date(value) is not None:
+                timestamp = datetime.combine(parse_date(value), time.min)
+        except ValueError:
+            timestamp = None
+        if timestamp is None:
+            raise ValidationError({name: "Must be an ISO 8601 date or datetime."})
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+        return timestamp
@@ -1,18 +1,332 @@
-from django.db import models
+import secrets
+from decimal import Decimal
+from django.conf import settings
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
 from users.models import User
 
+class BankAccountManager(models.Manager):
+    # Atomically add 'delta' to an account balance with a single conditional UPDATE.
+    # When 'floor' is given the update only applies if the new balance stays at or above it.
+    # Returns the new balance, or None if the account does not exist or the floor would be crossed.
+    def adjust_balance(self, pk, delta, floor=None):
+        field = self.model._meta.get_field('balance')
+        cent = Decimal(1).scaleb(-field.decimal_places)
+        delta = Decimal(delta).quantize(cent)
+        connection = connections[self.db]
+
+        # PostgreSQL and SQLite >= 3.35 can hand back the new balance from the UPDATE itself
+        if connection.vendor in ('postgresql', 'sqlite') and connection.features.can_return_columns_from_insert:
+            qn = connection.ops.quote_name
+            balance = qn(field.column)
+            sql = 'UPDATE %s SET %s = %s + %%s WHERE %s = %%s' % (
+                qn(self.model._meta.db_table), balance, balance, qn(self.model._meta.pk.column)
+            )
+            params = [delta, pk]
+            if floor is not None:
+                # Compare the column against a constant so SQLite applies numeric affinity
+                sql += ' AND %s >= %%s' % balance
+                params.append(Decimal(floor) - delta)
+            sql += ' RETURNING %s' % balance
+
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                row = cursor.fetchone()
+            if row is None:
+                return None
+            return field.to_python(row[0]).quantize(cent)
+
+        queryset = self.filter(pk=pk)
+        if floor is not None:
+            queryset = queryset.filter(balance__gte=Decimal(floor) - delta)
+        if not queryset.update(balance=F('balance') + delta):
+            return None
+        # The row lock taken by the UPDATE is held until commit, so this read sees our own write
+        return self.filter(pk=pk).values_list('balance', flat=True).get()
+
+    # Add many deltas ({account pk: delta}) to their balances with a single UPDATE ... CASE statement.
+    # Returns the number of accounts updated.
+    def adjust_balances(self, deltas):
+        if not deltas:
+            return 0
+        field = self.model._meta.get_field('balance')
+        whens = [When(pk=pk, then=F('balance') + Value(delta, output_field=field)) for pk, delta in deltas.items()]
+        return self.filter(pk__in=list(deltas)).update(balance=Case(*whens, output_field=field))
+
 class BankAccount(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     balance = models.DecimalField(max_digits=15, decimal_places=2, default=0.00)
     currency = models.CharField(max_length=3)  # ISO 4217 currency code
     is_active = models.BooleanField(default=True)
+    objects = BankAccountManager()
 
     def __str__(self):
         return f"{self.user.username}'s account - {self.currency}"
 
+    # The account's transactions are deleted with it, which changes the owner's data
+    def delete(self, using=None, keep_parents=False):
+        using = using or self._state.db
+        with transaction.atomic(using=using, savepoint=False):
+            DataVersion.objects.bump([self.user_id], using=using)
+            return super().delete(using=using, keep_parents=keep_parents)
+
+    # Balance as of 'timestamp', read from the running balance of the last transaction at or before it.
+    # This is one lookup on the (account, timestamp, id) index however long the history is.
+    # None for a time in legacy history the running balance backfill couldn't recover.
+    def balance_at(self, timestamp):
+        transactions = self.transaction_set.order_by('-timestamp', '-id')
+        last = transactions.filter(timestamp__lte=timestamp).values_list('balance_after', flat=True)[:1]
+        if last:
+            return last[0]
+
+        # Before the first transaction the account held its opening balance
+        first = transactions.reverse().values_list('balance_after', 'signed_amount').first()
+        if first is None:
+            return self.balance
+        if None in first:
+            return None
+        return first[0] - first[1]
+
+CENT = Decimal(1).scaleb(-BankAccount._meta.get_field('balance').decimal_places) # Smallest unit of a balance
+
+class TransactionManager(models.Manager):
+    # Rows written in bulk are counted in the monthly activity summary, and their owners' data
+    # versions bumped, in the same DB transaction
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db, savepoint=False):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            MonthlyActivity.objects.add_transactions(objs, using=self.db)
+            DataVersion.objects.bump_for_transactions(objs, using=self.db)
+        return objs
+
 class Transaction(models.Model):
     account = models.ForeignKey(BankAccount, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=15, decimal_places=2)
     transaction_type = models.CharField(max_length=10)  # deposit, withdraw, transfer
     currency = models.CharField(max_length=3)  # Store currency of the transaction
-    timestamp = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    timestamp = models.DateTimeField(auto_now_add=True)
+    # Credits are positive and debits negative. Both are null only on rows written before the ledger backfill,
+    # which leaves the sign of a transfer leg it couldn't pair unknown, and the balances of the rows before it.
+    signed_amount = models.DecimalField(max_digits=15, decimal_places=2, null=True)
+    balance_after = models.DecimalField(max_digits=15, decimal_places=2, null=True)  # Account balance right after this transaction
+    objects = TransactionManager()
+
+    class Meta:
+        indexes = [
+            # An account's history newest first, and the (timestamp, id) keyset used for pagination
+            models.Index(fields=['account', '-timestamp', '-id'], name='transaction_account_time_idx'),
+        ]
+
+    # A new row is counted in the monthly activity summary, and any write bumps the owner's data
+    # version, in the same DB transaction
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+            if adding:
+                MonthlyActivity.objects.add_transactions([self], using=self._state.db)
+            DataVersion.objects.bump_for_transactions([self], using=self._state.db)
+
+# First day of the timestamp's month in the current time zone, the way TruncMonth buckets it
+def month_of(timestamp):
+    if settings.USE_TZ:
+        timestamp = timezone.localtime(timestamp)
+    return timestamp.date().replace(day=1)
+
+class MonthlyActivityManager(models.Manager):
+    UPSERT_CHUNK_SIZE = 100  # Groups per statement, within SQLite's limit on query parameters
+
+    # Add ledger rows to their (account, month, transaction type) totals. Written transactions are
+    # never updated or deleted by the app; anything that does so should run rebuild_activity_summary.
+    def add_transactions(self, transactions, using=None):
+        groups = {}
+        for row in transactions:
+            key = (row.account_id, month_of(row.timestamp), row.transaction_type)
+            count, total, net = groups.get(key, (0, 0, 0))
+            groups[key] = (count + 1, total + row.amount, net + (row.signed_amount or 0))
+
+        rows = [(*key, *totals) for key, totals in groups.items()]
+        connection = connections[using or self.db]
+        for start in range(0, len(rows), self.UPSERT_CHUNK_SIZE):
+            chunk = rows[start:start + self.UPSERT_CHUNK_SIZE]
+            if connection.vendor in ('postgresql', 'sqlite'):
+                self._upsert(connection, chunk)
+            else:
+                for row in chunk:
+                    self._add(connection.alias, *row)
+
+    # One INSERT ... ON CONFLICT statement that adds to existing totals
+    def _upsert(self, connection, rows):
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        columns = [qn(self.model._meta.get_field(name).column) for name in ['account', 'month', 'transaction_type']]
+        totals = [qn(name) for name in ['count', 'total', 'net']]
+        placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(rows))
+        updates = ', '.join(f'{column} = {table}.{column} + excluded.{column}' for column in totals)
+        sql = (
+            f'INSERT INTO {table} ({", ".join(columns + totals)}) VALUES {placeholders} '
+            f'ON CONFLICT ({", ".join(columns)}) DO UPDATE SET {updates}'
+        )
+        params = [
+            connection.ops.adapt_decimalfield_value(value) if isinstance(value, Decimal) else value
+            for row in rows for value in row
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def _add(self, using, account_id, month, transaction_type, count, total, net):
+        queryset = self.using(using).filter(account_id=account_id, month=month, transaction_type=transaction_type)
+        increments = {'count': F('count') + count, 'total': F('total') + total, 'net': F('net') + net}
+        if queryset.update(**increments):
+            return
+        try:
+            with transaction.atomic(using=using):
+                self.using(using).create(
+                    account_id=account_id, month=month, transaction_type=transaction_type,
+                    count=count, total=total, net=net
+                )
+        except IntegrityError:
+            queryset.update(**increments)  # A concurrent writer created the row first
+
+    # Recompute the summary from the ledger, for every account or only the given ones.
+    # Returns the number of summary rows written.
+    def rebuild(self, account_ids=None):
+        transactions = Transaction.objects.using(self.db)
+        summary = self.using(self.db)
+        if account_ids is not None:
+            transactions = transactions.filter(account_id__in=account_ids)
+            summary = summary.filter(account_id__in=account_ids)
+        with transaction.atomic(using=self.db):
+            summary.delete()
+            rows = [self.model(**row) for row in self.aggregate_ledger(transactions).iterator()]
+            self.using(self.db).bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+    # The same totals computed from the ledger itself, as dicts with the summary's field names
+    def aggregate_ledger(self, transactions):
+        return (
+            transactions.annotate(month=TruncMonth('timestamp', output_field=models.DateField()))
+            .values('account_id', 'month', 'transaction_type')
+            .annotate(
+                count=Count('id'),
+                total=Sum('amount'),
+                net=Coalesce(Sum('signed_amount'), Value(Decimal(0)), output_field=models.DecimalField(max_digits=20, decimal_places=2)),
+            )
+            .order_by('account_id', 'month', 'transaction_type')
+        )
+
+class MonthlyActivity(models.Model):
+    # Count and totals of an account's transactions of one type in one month, kept up to date as
+    # transactions are written, so a summary reads one row per month and type however long the history
+    account = models.ForeignKey(BankAccount, on_delete=models.CASCADE)
+    month = models.DateField()  # First day of the month
+    transaction_type = models.CharField(max_length=10)
+    count = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=20, decimal_places=2, default=0)  # Sum of amounts
+    net = models.DecimalField(max_digits=20, decimal_places=2, default=0)  # Sum of signed amounts: credits less debits
+    objects = MonthlyActivityManager()
+
+    class Meta:
+        constraints = [
+            # Also the index summary reads go through
+            models.UniqueConstraint(fields=['account', 'month', 'transaction_type'], name='monthly_activity_unique'),
+        ]
+
+# A user's first version. Random, so a user id used again after a rollback or a restore from backup
+# doesn't meet the responses cached for its earlier owner.
+def initial_version():
+    return secrets.randbits(62) + 1
+
+class DataVersionManager(models.Manager):
+    UPSERT_CHUNK_SIZE = 500  # Users per statement, within SQLite's limit on query parameters
+
+    # The user's version, 0 until any of their data is written. One primary key lookup.
+    def current(self, user_id):
+        return self.filter(pk=user_id).values_list('version', flat=True).first() or 0
+
+    # Bump the versions of the users owning these ledger rows. The owner is read from a row's
+    # account when it is loaded, and looked up in one query for the rest.
+    def bump_for_transactions(self, transactions, using=None):
+        user_ids, account_ids = set(), set()
+        for row in transactions:
+            if Transaction.account.is_cached(row):
+                user_ids.add(row.account.user_id)
+            else:
+                account_ids.add(row.account_id)
+        if account_ids:
+            accounts = BankAccount.objects.using(using or self.db).filter(pk__in=account_ids)
+            user_ids.update(accounts.values_list('user_id', flat=True))
+        self.bump(user_ids, using=using)
+
+    # Add one to each user's version. Users are bumped in id order, so writers that bump several
+    # users at once lock their rows in the same order.
+    def bump(self, user_ids, using=None):
+        user_ids = sorted(user_ids)
+        connection = connections[using or self.db]
+        for start in range(0, len(user_ids), self.UPSERT_CHUNK_SIZE):
+            chunk = user_ids[start:start + self.UPSERT_CHUNK_SIZE]
+            if connection.vendor in ('postgresql', 'sqlite'):
+                self._upsert(connection, chunk)
+            else:
+                for user_id in chunk:
+                    self._bump(connection.alias, user_id)
+
+    # One INSERT ... ON CONFLICT statement that starts missing users at a random version
+    def _upsert(self, connection, user_ids):
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        user, version = qn(self.model._meta.pk.column), qn('version')
+        placeholders = ', '.join(['(%s, %s)'] * len(user_ids))
+        sql = (
+            f'INSERT INTO {table} ({user}, {version}) VALUES {placeholders} '
+            f'ON CONFLICT ({user}) DO UPDATE SET {version} = {table}.{version} + 1'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [value for user_id in user_ids for value in (user_id, initial_version())])
+
+    def _bump(self, using, user_id):
+        queryset = self.using(using).filter(pk=user_id)
+        if queryset.update(version=F('version') + 1):
+            return
+        try:
+            with transaction.atomic(using=using):
+                self.using(using).create(user_id=user_id, version=initial_version())
+        except IntegrityError:
+            queryset.update(version=F('version') + 1)  # A concurrent writer created the row first
+
+class DataVersion(models.Model):
+    # Counts the writes to a user's transactions and loans. It is bumped in the same DB transaction
+    # as each of them, so while it stays put, so do the user's lists, and a response rendered from
+    # them can be served again. A user without a row has written nothing yet.
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    version = models.PositiveBigIntegerField(default=0)
+    objects = DataVersionManager()
+
+class IngestCheckpoint(models.Model):
+    # Progress of a bulk ingest, committed in the same DB transaction as each chunk it covers
+    source = models.CharField(max_length=255, unique=True)
+    offset = models.BigIntegerField(default=0)  # Byte offset of the first unprocessed line
+    records = models.BigIntegerField(default=0)  # Records processed so far
+    updated_at = models.DateTimeField(auto_now=True)
+
+class ExchangeRate(models.Model):
+    # Units of 'currency' per one unit of settings.FX_BASE_CURRENCY
+    currency = models.CharField(max_length=3, unique=True)  # ISO 4217 currency code
+    rate = models.DecimalField(max_digits=20, decimal_places=10)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.currency} {self.rate}"
+
+class IdempotencyKey(models.Model):
+    # A money-moving request that was applied, and the response it produced.
+    # Written in the same DB transaction as the balance change, so a key exists only if the change does.
+    key = models.CharField(max_length=300, unique=True)  # '<user id>:<Idempotency-Key header>'
+    fingerprint = models.CharField(max_length=64)  # SHA-256 of the method, path and body
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=JSONEncoder)  # Encoded the way DRF renders it
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
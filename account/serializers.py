@@ -1,5 +1,63 @@
+from decimal import Decimal
+from functools import cached_property
 from rest_framework import serializers
-from .models import BankAccount, Transaction
+from rest_framework.fields import ISO_8601
+from rest_framework.settings import api_settings
+from .models import BankAccount, MonthlyActivity, Transaction
+
+# Fields whose representation of a value read from the DB is the value itself
+PLAIN_FIELDS = (
+    serializers.IntegerField, serializers.CharField, serializers.BooleanField, serializers.PrimaryKeyRelatedField,
+)
+
+class ValuesSerializer:
+    # Read-only fast path for lists: renders rows of queryset.values() exactly as 'serializer_class'
+    # renders model instances, without building an instance and calling every field for each row.
+    # How to format each column is worked out once per list; relations must be primary key fields.
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+
+    @cached_property
+    def fields(self):
+        return list(self.serializer_class().fields.values())
+
+    def values(self, queryset):
+        return queryset.values(*[field.source for field in self.fields])
+
+    def to_representation(self, rows):
+        columns = [(field.field_name, field.source, self.formatter(field)) for field in self.fields]
+        return [
+            {
+                name: row[source] if format_value is None or row[source] is None else format_value(row[source])
+                for name, source, format_value in columns
+            }
+            for row in rows
+        ]
+
+    # None when a column's values are sent as they are, or a function of one value
+    def formatter(self, field):
+        if isinstance(field, PLAIN_FIELDS):
+            return None
+        if isinstance(field, serializers.DecimalField):
+            plain = (
+                getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+                and field.decimal_places is not None and field.rounding is None
+                and not field.localize and not field.normalize_output
+            )
+            if plain:
+                spec = f'.{field.decimal_places}f'
+                return lambda value: format(value, spec)
+        if isinstance(field, serializers.DateTimeField):
+            output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+            field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+            if output_format is not None and output_format.lower() == ISO_8601 and field_timezone is not None:
+                def format_datetime(value):
+                    if value.tzinfo is None:
+                        return field.to_representation(value)
+                    text = value.astimezone(field_timezone).isoformat()
+                    return text[:-6] + 'Z' if text.endswith('+00:00') else text
+                return format_datetime
+        return field.to_representation
 
 class BankAccountSerializer(serializers.ModelSerializer):
     class Meta:
@@ -12,4 +70,22 @@ class BankAccountSerializer(serializers.ModelSerializer):
 class TransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
-        fields = ['id', 'account', 'amount', 'transaction_type', 'timestamp']
\ No newline at end of file
+        fields = ['id', 'account', 'amount', 'transaction_type', 'timestamp']
+
+transaction_rows = ValuesSerializer(TransactionSerializer)
+
+class MonthlyActivitySerializer(serializers.ModelSerializer):
+    month = serializers.DateField(format='%Y-%m')
+
+    class Meta:
+        model = MonthlyActivity
+        fields = ['account', 'month', 'transaction_type', 'count', 'total', 'net']
+
+class TransferItemSerializer(serializers.Serializer):
+    from_account_id = serializers.IntegerField()
+    to_account_id = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=15, decimal_places=2, min_value=Decimal('0.01'))
+    currency = serializers.CharField(max_length=3, required=False)  # Defaults to the source account currency
+
+class BatchTransferSerializer(serializers.Serializer):
+    transfers = TransferItemSerializer(many=True, allow_empty=False, max_length=50000)
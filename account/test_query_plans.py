@@ -0,0 +1,57 @@
+from datetime import timedelta
+from unittest import skipUnless
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase
+from django.utils import timezone
+from bank.models import Loan
+from .models import BankAccount, Transaction, User
+
+@skipUnless(connection.vendor == 'sqlite', "Query plans are checked against SQLite")
+class QueryPlanTests(TestCase):
+    # Guards the hot queries against losing their index: a plan that scans a whole table
+    # or sorts through a temporary B-tree fails the test.
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='plans@example.com',
+            password='testpassword'
+        )
+        self.account = BankAccount.objects.create(user=self.user, balance=0, currency='ILS')
+        Transaction.objects.create(account=self.account, amount=100, transaction_type='deposit', currency='ILS')
+        Loan.objects.create(user=self.user, amount=1000)
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertNotIn('SCAN', plan, f"Full scan in plan:\n{plan}")
+        self.assertNotIn('TEMP B-TREE', plan, f"Sort in plan:\n{plan}")
+        self.assertIn(index_name, plan)
+
+    def test_account_transactions_newest_first(self):
+        queryset = Transaction.objects.filter(account=self.account).order_by('-timestamp', '-id')[:50]
+        self.assertUsesIndex(queryset, 'transaction_account_time_idx')
+
+    def test_account_transactions_keyset_page(self):
+        now = timezone.now()
+        queryset = Transaction.objects.filter(account=self.account).filter(
+            Q(timestamp__lt=now) | Q(timestamp=now, pk__lt=1000)
+        ).order_by('-timestamp', '-id')[:50]
+        self.assertUsesIndex(queryset, 'transaction_account_time_idx')
+
+    def test_account_transactions_date_range(self):
+        now = timezone.now()
+        queryset = Transaction.objects.filter(
+            account=self.account, timestamp__gte=now - timedelta(days=30), timestamp__lt=now
+        ).order_by('-timestamp', '-id')
+        self.assertUsesIndex(queryset, 'transaction_account_time_idx')
+
+    def test_balance_at(self):
+        queryset = self.account.transaction_set.filter(timestamp__lte=timezone.now()).order_by('-timestamp', '-id')[:1]
+        self.assertUsesIndex(queryset, 'transaction_account_time_idx')
+
+    def test_user_accounts(self):
+        # The foreign key index already covers this lookup and the id-only subquery
+        self.assertUsesIndex(BankAccount.objects.filter(user=self.user), 'account_bankaccount_user_id')
+        self.assertUsesIndex(BankAccount.objects.filter(user=self.user).values('id'), 'COVERING INDEX')
+
+    def test_user_loans_by_status(self):
+        self.assertUsesIndex(Loan.objects.filter(user=self.user, is_paid=False), 'loan_user_paid_idx')
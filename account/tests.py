@@ -1,8 +1,41 @@
+import csv
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from django.apps import apps as django_apps
+from django.core.management import call_command
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import OperationalError, connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework import status
-from rest_framework.test import APITestCase
-from .models import BankAccount, User, Transaction
+from django.utils import timezone
+from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase, force_authenticate
+from . import conditional, fx, idempotency, renderers, sqlite
+from .cache import LRUCache
+from .group_commit import GroupCommitWriter, _Write
+from .models import CENT, BankAccount, DataVersion, ExchangeRate, IdempotencyKey, IngestCheckpoint, MonthlyActivity, User, Transaction
+from .renderers import FastJSONRenderer
+from .serializers import TransactionSerializer, transaction_rows
+from .sqlite import WriteQueue
+from .transfers import transfer
+from .utils import convert_currency
+from .views import FEE_PERCENTAGE, UserTransactionsView, deposit_net_amount
 from rest_framework_simplejwt.tokens import RefreshToken
+from benchmarks import driver
 
 class AccountTests(APITestCase):
     def setUp(self):
@@ -137,7 +170,1343 @@ class AccountTests(APITestCase):
         # Check that the response status code is 200 OK
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         
-        # Check that the response data contains the correct transactions
-        self.assertEqual(len(response.data), 2)
-        self.assertEqual(response.data[0]['transaction_type'], 'deposit')
-        self.assertEqual(response.data[1]['transaction_type'], 'withdraw')
\ No newline at end of file
+        # Check that the response data contains the correct transactions, newest first
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['results'][0]['transaction_type'], 'withdraw')
+        self.assertEqual(response.data['results'][1]['transaction_type'], 'deposit')
+        self.assertIsNone(response.data['next'])
+
+    def test_get_user_transactions_filters(self):
+        url = reverse('user-transactions')
+        response = self.client.get(url, {'transaction_type': 'deposit', 'account': self.account.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['transaction_type'] for item in response.data['results']], ['deposit'])
+
+        response = self.client.get(url, {'start': '2000-01-01', 'end': '2000-01-02'})
+        self.assertEqual(response.data['results'], [])
+
+        response = self.client.get(url, {'start': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class AccountConcurrencyTests(TransactionTestCase):
+    # Fires parallel deposits and withdrawals at a single account and checks no update is lost
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='concurrent@example.com',
+            password='testpassword'
+        )
+
+        self.token = RefreshToken.for_user(self.user)
+        self.account = BankAccount.objects.create(
+            user=self.user,
+            balance=1000,
+            currency='ILS'
+        )
+
+    def post_in_thread(self, url, data):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(self.token.access_token))
+        try:
+            return client.post(url, data, format='json').status_code
+        finally:
+            connection.close()
+
+    def test_parallel_deposits_and_withdrawals(self):
+        deposit_url = reverse('account-deposit', args=[self.account.id])
+        withdraw_url = reverse('account-withdraw', args=[self.account.id])
+        requests = [(deposit_url, {'amount': 100})] * 200 + [(withdraw_url, {'amount': 50})] * 200
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            statuses = list(executor.map(lambda args: self.post_in_thread(*args), requests))
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(statuses, [status.HTTP_200_OK] * len(requests))
+        self.account.refresh_from_db()
+        # Each deposit adds 99.00 and each withdrawal removes 50.50
+        self.assertEqual(self.account.balance, Decimal('1000') + 200 * Decimal('99.00') - 200 * Decimal('50.50'))
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), len(requests))
+        driver.report('parallel_deposits_and_withdrawals', requests=len(requests), requests_per_second=round(len(requests) / elapsed, 1))
+
+    def test_random_transfers_preserve_total(self):
+        threads, accounts_count, transfers_per_thread = 8, 10, 50
+        accounts = [
+            BankAccount.objects.create(user=self.user, balance=1000, currency='ILS').pk
+            for _ in range(accounts_count)
+        ]
+        total_before = sum(BankAccount.objects.filter(pk__in=accounts).values_list('balance', flat=True))
+
+        def run_transfers(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(transfers_per_thread):
+                    from_id, to_id = rng.sample(accounts, 2)
+                    amount = Decimal(rng.randint(1, 20000)) / 100
+                    try:
+                        transfer(from_id, to_id, amount, amount, overdraft_limit=Decimal('-1000'))
+                    except ValidationError:
+                        pass  # Insufficient funds is an expected outcome
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(run_transfers, range(threads)))
+        elapsed = time.perf_counter() - started
+
+        total_after = sum(BankAccount.objects.filter(pk__in=accounts).values_list('balance', flat=True))
+        self.assertEqual(total_after, total_before)
+        self.assertFalse(BankAccount.objects.filter(pk__in=accounts, balance__lt=-1000).exists())
+        driver.report(
+            'random_transfers', transfers=threads * transfers_per_thread, accounts=accounts_count,
+            transfers_per_second=round(threads * transfers_per_thread / elapsed, 1),
+        )
+
+class BatchTransferTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='batch@example.com',
+            password='testpassword'
+        )
+
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(self.token.access_token))
+        self.batch_url = reverse('account-transfer-batch')
+        self.payer = BankAccount.objects.create(user=self.user, balance=1000, currency='ILS')
+        self.payee = BankAccount.objects.create(user=self.user, balance=0, currency='ILS')
+
+    def test_batch_transfer(self):
+        data = {'transfers': [
+            {'from_account_id': self.payer.id, 'to_account_id': self.payee.id, 'amount': 100},
+            {'from_account_id': self.payer.id, 'to_account_id': 999999, 'amount': 100},  # Unknown account
+            {'from_account_id': self.payer.id, 'to_account_id': self.payee.id, 'amount': 5000},  # Over the overdraft limit
+            {'from_account_id': self.payee.id, 'to_account_id': self.payer.id, 'amount': 50, 'currency': 'ILS'},
+        ]}
+
+        response = self.client.post(self.batch_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['completed', 'failed', 'failed', 'completed']
+        )
+        self.assertEqual(response.data['results'][1]['detail'], 'Account not found.')
+        self.assertEqual(response.data['results'][2]['detail'], 'Insufficient funds for transfer.')
+
+        self.payer.refresh_from_db()
+        self.payee.refresh_from_db()
+        self.assertEqual(self.payer.balance, Decimal('1000') - Decimal('101.00') + Decimal('50'))
+        self.assertEqual(self.payee.balance, Decimal('100') - Decimal('50.50'))
+        self.assertEqual(Transaction.objects.filter(transaction_type='transfer').count(), 4)
+
+    def test_batch_transfer_invalid_item(self):
+        data = {'transfers': [
+            {'from_account_id': self.payer.id, 'to_account_id': self.payee.id, 'amount': 100},
+            {'from_account_id': self.payer.id, 'to_account_id': self.payee.id, 'amount': -5},
+        ]}
+
+        response = self.client.post(self.batch_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.payer.refresh_from_db()
+        self.assertEqual(self.payer.balance, 1000)  # Nothing applied when any item is malformed
+
+    @tag('benchmark')
+    def test_batch_transfer_benchmark(self):
+        batch_size, per_request_sample = 10000, 500
+        accounts = BankAccount.objects.bulk_create([
+            BankAccount(user=self.user, balance=1000000, currency='ILS') for _ in range(100)
+        ])
+        rng = random.Random(0)
+        transfers = []
+        for _ in range(batch_size):
+            payer, payee = rng.sample(accounts, 2)
+            transfers.append({'from_account_id': payer.id, 'to_account_id': payee.id, 'amount': rng.randint(1, 100)})
+
+        started = time.perf_counter()
+        response = self.client.post(self.batch_url, {'transfers': transfers}, format='json')
+        batch_elapsed = time.perf_counter() - started
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(all(result['status'] == 'completed' for result in response.data['results']))
+
+        started = time.perf_counter()
+        for item in transfers[:per_request_sample]:
+            response = self.client.post(reverse('account-transfer'), dict(item, currency='ILS'), format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        per_request_elapsed = time.perf_counter() - started
+
+        # Only the 1% fees leave the accounts, and each balance is its opening balance plus its ledger
+        applied = transfers + transfers[:per_request_sample]
+        balances = BankAccount.objects.filter(pk__in=[account.pk for account in accounts])
+        fees = sum(Decimal(item['amount']) for item in applied) * FEE_PERCENTAGE
+        self.assertEqual(sum(balances.values_list('balance', flat=True)), 100 * Decimal('1000000') - fees)
+        self.assertEqual(Transaction.objects.filter(transaction_type='transfer').count(), 2 * len(applied))
+        ledger = {}
+        for pk, signed_amount in Transaction.objects.values_list('account', 'signed_amount'):
+            ledger[pk] = ledger.get(pk, 0) + signed_amount
+        for pk, balance in balances.values_list('pk', 'balance'):
+            self.assertEqual(balance, Decimal('1000000') + ledger.get(pk, 0))
+        driver.report(
+            'batch_transfer', batch_transfers_per_second=round(batch_size / batch_elapsed, 1),
+            per_request_transfers_per_second=round(per_request_sample / per_request_elapsed, 1),
+        )
+
+class IngestTransactionsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='ingest@example.com',
+            password='testpassword'
+        )
+        self.account = BankAccount.objects.create(user=self.user, balance=0, currency='ILS')
+        self.other_account = BankAccount.objects.create(user=self.user, balance=100, currency='ILS')
+
+    def write_file(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_ingest_csv(self):
+        path = self.write_file('.csv', (
+            "account_id,amount,currency\n"
+            f"{self.account.id},100,ILS\n"
+            f"{self.other_account.id},200,\n"
+            f"{self.account.id},-5,ILS\n"  # Rejected
+            "999999,100,ILS\n"  # Rejected
+            f"{self.account.id},50,ILS\n"
+        ))
+
+        out = StringIO()
+        call_command('ingest_transactions', path, chunk_size=2, stdout=out, stderr=StringIO())
+        self.account.refresh_from_db()
+        self.other_account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('99.00') + Decimal('49.50'))
+        self.assertEqual(self.other_account.balance, Decimal('100') + Decimal('198.00'))
+        self.assertEqual(Transaction.objects.filter(transaction_type='deposit').count(), 3)
+        self.assertIn('Ingested 3 records (2 rejected)', out.getvalue())
+
+    def test_ingest_resumes_from_checkpoint(self):
+        lines = [json.dumps({'account_id': self.account.id, 'amount': 100}) + '\n' for _ in range(5)]
+        path = self.write_file('.ndjson', ''.join(lines))
+
+        # Pretend an earlier run committed the first two records before crashing
+        IngestCheckpoint.objects.create(source=path, offset=len(lines[0]) * 2, records=2)
+        call_command('ingest_transactions', path, stdout=StringIO())
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 3 * Decimal('99.00'))
+
+        # A finished file has nothing left to ingest
+        call_command('ingest_transactions', path, stdout=StringIO())
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 3 * Decimal('99.00'))
+        self.assertEqual(IngestCheckpoint.objects.get(source=path).records, 5)
+
+    def test_ingest_credits_what_a_deposit_would(self):
+        ExchangeRate.objects.update_or_create(currency='ILS', defaults={'rate': Decimal('3.5')})
+        fx.invalidate()
+        self.addCleanup(fx.invalidate)
+        path = self.write_file('.ndjson', json.dumps({'account_id': self.account.id, 'amount': 100, 'currency': 'USD'}) + '\n')
+
+        call_command('ingest_transactions', path, stdout=StringIO())
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('346.50'))  # 100 less the 1% fee, at 3.5 ILS per USD
+        self.assertEqual(self.account.balance, deposit_net_amount(Decimal('100'), 'USD', 'ILS'))
+
+class TransactionPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='pagination@example.com',
+            password='testpassword'
+        )
+
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(self.token.access_token))
+        self.url = reverse('user-transactions')
+        self.account = BankAccount.objects.create(user=self.user, balance=0, currency='ILS')
+        # Pages are timed as the list query runs them, not as the response cache sends them again
+        responses = mock.patch.object(conditional, '_responses', LRUCache(0))
+        responses.start()
+        self.addCleanup(responses.stop)
+
+        # Many rows share a timestamp, which is the case that breaks timestamp-only cursors
+        now = timezone.now()
+        Transaction.objects.bulk_create([
+            Transaction(account=self.account, amount=i, transaction_type='deposit', currency='ILS')
+            for i in range(1, 20001)
+        ], batch_size=1000)
+        Transaction.objects.update(timestamp=now)
+        Transaction.objects.filter(id__lte=10000).update(timestamp=now - timedelta(minutes=1))
+
+    def test_pages_walk_every_row_once(self):
+        seen = []
+        url = self.url + '?page_size=500'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(seen), 20000)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_previous_link(self):
+        first = self.client.get(self.url, {'page_size': 10})
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_deep_page_costs_the_same_as_first_page(self):
+        def timed_page(url):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = self.client.get(url)
+                elapsed = time.perf_counter() - started
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response, elapsed, [query['sql'] for query in queries]
+
+        self.client.get(self.url)  # Resolve the user once, so both timed pages authenticate from the cache
+        first, first_elapsed, first_queries = timed_page(self.url + '?page_size=500')
+
+        # Walk to the last page, then time it
+        url, last_url = first.data['next'], None
+        while url:
+            last_url, url = url, self.client.get(url).data['next']
+        last, last_elapsed, last_queries = timed_page(last_url)
+
+        self.assertEqual(len(first.data['results']), len(last.data['results']))
+        self.assertEqual(len(first_queries), len(last_queries))
+        self.assertFalse(any('OFFSET' in sql.upper() for sql in first_queries + last_queries))
+        self.assertEqual(last.data['results'][-1]['id'], Transaction.objects.order_by('timestamp', 'id').first().id)
+        driver.report('transaction_pages', first_page_ms=round(first_elapsed * 1000, 2), deep_page_ms=round(last_elapsed * 1000, 2))
+
+class SerializerTransactionsView(UserTransactionsView):
+    # The transaction listing as it was before the values() fast path
+    renderer_classes = [JSONRenderer]
+
+    def list(self, request, *args, **kwargs):
+        return generics.ListAPIView.list(self, request, *args, **kwargs)
+
+class FastSerializationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='fast@example.com', password='testpassword')
+        self.account = BankAccount.objects.create(user=self.user, balance=0, currency='ILS')
+        rng = random.Random(5)
+        Transaction.objects.bulk_create([
+            Transaction(
+                account=self.account, amount=Decimal(rng.randint(1, 10 ** 8)) / 100,
+                transaction_type=rng.choice(['deposit', 'withdraw', 'transfer']), currency='ILS'
+            )
+            for _ in range(300)
+        ])
+        # Timestamps with and without microseconds
+        for transaction in Transaction.objects.all():
+            transaction.timestamp = datetime(2026, 1, 1, tzinfo=dt_timezone.utc) + timedelta(
+                seconds=rng.randint(0, 10 ** 7), microseconds=rng.choice([0, rng.randint(1, 999999)])
+            )
+            transaction.save(update_fields=['timestamp'])
+
+    def get(self, view_class, query=''):
+        request = APIRequestFactory().get('/api/account/transactions/' + query)
+        force_authenticate(request, user=self.user)
+        response = view_class.as_view()(request)
+        response.render()
+        return response
+
+    def test_same_bytes_as_serializer(self):
+        for query in ['', '?page_size=500', '?transaction_type=deposit&page_size=7']:
+            fast = self.get(UserTransactionsView, query)
+            self.assertEqual(fast.content, self.get(SerializerTransactionsView, query).content, query)
+            # The next page's cursor comes from the last row either way
+            if fast.data['next']:
+                next_query = '?' + fast.data['next'].partition('?')[2]
+                self.assertEqual(self.get(UserTransactionsView, next_query).content, self.get(SerializerTransactionsView, next_query).content)
+
+    @override_settings(TIME_ZONE='Asia/Jerusalem')
+    def test_same_bytes_in_another_time_zone(self):
+        fast = self.get(UserTransactionsView)
+        self.assertEqual(fast.content, self.get(SerializerTransactionsView).content)
+        self.assertRegex(fast.data['results'][0]['timestamp'], r'\+0[23]:00$')
+
+    def test_renderer_matches_drf(self):
+        data = {
+            'text': 'café \u2028 \u2029 "quoted"', 'amount': Decimal('1.50'), 'when': timezone.now(),
+            'date': timezone.now().date(), 'items': [1, None, True, 2 ** 63 - 1, -0.5], 3: 'integer key',
+            'nested': {'empty': [], 'unicode': '\u05e9\u05dc\u05d5\u05dd \U0001f600'},
+        }
+        with mock.patch.object(renderers.orjson, 'dumps', wraps=renderers.orjson.dumps) as dumps:
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        dumps.assert_called_once()  # Rendered by orjson, not by the fallback
+
+        # Integers wider than 64 bits are left to DRF
+        self.assertEqual(FastJSONRenderer().render({'wide': 2 ** 70}), JSONRenderer().render({'wide': 2 ** 70}))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    @tag('benchmark')
+    def test_benchmark_rows_per_second(self):
+        rng = random.Random(9)
+        Transaction.objects.bulk_create([
+            Transaction(account=self.account, amount=Decimal(rng.randint(1, 10 ** 8)) / 100, transaction_type='deposit', currency='ILS')
+            for _ in range(100000 - 300)
+        ], batch_size=5000)
+        queryset = Transaction.objects.filter(account=self.account).order_by('-timestamp', '-id')
+
+        # Rows per second, query included
+        for rows in [10000, 100000]:
+            started = time.perf_counter()
+            slow = JSONRenderer().render(TransactionSerializer(queryset[:rows], many=True).data)
+            slow_elapsed = time.perf_counter() - started
+            started = time.perf_counter()
+            fast = FastJSONRenderer().render(transaction_rows.to_representation(transaction_rows.values(queryset)[:rows]))
+            fast_elapsed = time.perf_counter() - started
+            self.assertEqual(fast, slow)
+            self.assertEqual(len(json.loads(fast)), rows)
+            driver.report(
+                'transaction_serialization', rows=rows, model_serializer_rows_per_second=round(rows / slow_elapsed, 1),
+                fast_path_rows_per_second=round(rows / fast_elapsed, 1), speedup=round(slow_elapsed / fast_elapsed, 1),
+            )
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='poll@example.com', password='testpassword')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.user).access_token))
+        self.account = BankAccount.objects.create(user=self.user, balance=1000, currency='ILS')
+        self.other_user = User.objects.create_user(email='poll-other@example.com', username='poll-other', password='testpassword')
+        self.other_account = BankAccount.objects.create(user=self.other_user, balance=1000, currency='ILS')
+        Transaction.objects.bulk_create([
+            Transaction(account=self.account, amount=amount, transaction_type='deposit', currency='ILS') for amount in [10, 20, 30]
+        ])
+        self.url = reverse('user-transactions')
+
+    def get(self, params=None, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params, headers=headers)
+        return response, [query['sql'] for query in queries]
+
+    def test_unchanged_poll_costs_one_query(self):
+        first, _ = self.get()
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first['Cache-Control'], 'private, no-cache')
+
+        response, queries = self.get(if_none_match=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.content, b'')
+        self.assertEqual(len(queries), 1)
+        self.assertIn('account_dataversion', queries[0])
+
+        # A client without the ETag gets the cached bytes for the same query
+        response, queries = self.get()
+        self.assertEqual(response.content, first.content)
+        self.assertEqual(response['Content-Type'], first['Content-Type'])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('account_transaction', queries[0])
+
+    def test_every_write_path_changes_the_etag(self):
+        etag = self.get()[0]['ETag']
+        writes = [
+            lambda: self.client.post(reverse('account-deposit', args=[self.account.id]), {'amount': 100}, format='json'),
+            lambda: self.client.post(reverse('account-withdraw', args=[self.account.id]), {'amount': 100}, format='json'),
+            # Money coming in from another user's account
+            lambda: transfer(self.other_account.id, self.account.id, Decimal(5), Decimal(5)),
+            lambda: Transaction.objects.create(account_id=self.account.id, amount=1, transaction_type='deposit', currency='ILS'),
+        ]
+        for write in writes:
+            write()
+            response, _ = self.get(if_none_match=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response['ETag'], etag)
+            self.assertEqual(len(response.json()['results']), Transaction.objects.filter(account=self.account).count())
+            etag = response['ETag']
+
+        # Closing an account deletes its transactions
+        BankAccount.objects.filter(pk=self.account.pk).update(balance=0)
+        self.client.delete(reverse('account-close', args=[self.account.id]))
+        response, _ = self.get(if_none_match=etag)
+        self.assertEqual(response.json()['results'], [])
+
+    def test_other_users_writes_keep_the_etag(self):
+        etag = self.get()[0]['ETag']
+        Transaction.objects.create(account=self.other_account, amount=1, transaction_type='deposit', currency='ILS')
+        self.assertEqual(self.get(if_none_match=f'"other", W/{etag}')[0].status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_query_params_are_cached_apart(self):
+        Transaction.objects.create(account=self.account, amount=5, transaction_type='withdraw', currency='ILS')
+        deposits, _ = self.get({'transaction_type': 'deposit'})
+        withdrawals, _ = self.get({'transaction_type': 'withdraw'})
+        self.assertEqual(len(deposits.json()['results']), 3)
+        self.assertEqual(len(withdrawals.json()['results']), 1)
+        self.assertNotEqual(deposits['ETag'], withdrawals['ETag'])
+        self.assertEqual(self.get({'transaction_type': 'withdraw'}, if_none_match=deposits['ETag'])[0].status_code, status.HTTP_200_OK)
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'api.example.com'])
+    def test_hosts_are_cached_apart(self):
+        Transaction.objects.bulk_create([
+            Transaction(account=self.account, amount=1, transaction_type='deposit', currency='ILS') for _ in range(3)
+        ])
+        local = self.client.get(self.url, {'page_size': 2})
+        public = self.client.get(self.url, {'page_size': 2}, headers={'host': 'api.example.com'})
+        self.assertTrue(local.json()['next'].startswith('http://testserver/'))
+        self.assertTrue(public.json()['next'].startswith('http://api.example.com/'))
+        self.assertNotEqual(local['ETag'], public['ETag'])
+
+    def test_least_recently_used_responses_are_evicted(self):
+        with mock.patch.object(conditional, '_responses', LRUCache(2)):
+            for amount in ['1', '2', '3']:
+                self.get({'page_size': amount})
+            self.assertEqual(len(conditional._responses), 2)
+            _, queries = self.get({'page_size': '3'})
+            self.assertEqual(len(queries), 1)
+            _, queries = self.get({'page_size': '1'})
+            self.assertTrue(any('account_transaction' in sql for sql in queries))
+
+    def test_errors_and_browsable_api_are_not_cached(self):
+        response, _ = self.get({'start': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn('ETag', response)
+        response, _ = self.get(accept='text/html')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('ETag', response)
+
+    def test_backends_without_upsert(self):
+        with mock.patch.object(connection, 'vendor', 'other'):
+            DataVersion.objects.bump([self.user.pk, self.other_user.pk])
+        version = DataVersion.objects.current(self.user.pk)
+        with mock.patch.object(connection, 'vendor', 'other'):
+            DataVersion.objects.bump([self.user.pk])
+        self.assertEqual(DataVersion.objects.current(self.user.pk), version + 1)
+        self.assertNotEqual(DataVersion.objects.current(self.other_user.pk), 0)
+
+    @tag('benchmark')
+    def test_benchmark_polling(self):
+        Transaction.objects.bulk_create([
+            Transaction(account=self.account, amount=1, transaction_type='deposit', currency='ILS') for _ in range(1000)
+        ])
+        polls = 200
+        first = self.get()[0]
+        milliseconds = {}
+        for name, headers, responses, expected_status, expected_content in [
+            ('uncached_ms', {}, LRUCache(0), status.HTTP_200_OK, first.content),
+            ('cached_response_ms', {}, conditional._responses, status.HTTP_200_OK, first.content),
+            ('if_none_match_ms', {'if_none_match': first['ETag']}, conditional._responses, status.HTTP_304_NOT_MODIFIED, b''),
+        ]:
+            with mock.patch.object(conditional, '_responses', responses):
+                started = time.perf_counter()
+                polled = [self.client.get(self.url, headers=headers) for _ in range(polls)]
+                milliseconds[name] = round((time.perf_counter() - started) / polls * 1000, 3)
+            for response in polled:
+                self.assertEqual((response.status_code, response.content), (expected_status, expected_content))
+                self.assertEqual(response['ETag'], first['ETag'])
+        driver.report('polling', rows=len(json.loads(first.content)['results']), **milliseconds)
+
+class StatementExportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='statement@example.com',
+            password='testpassword'
+        )
+
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(self.token.access_token))
+        self.account = BankAccount.objects.create(user=self.user, balance=0, currency='ILS')
+        self.other_account = BankAccount.objects.create(user=self.user, balance=0, currency='ILS')
+        Transaction.objects.create(account=self.account, amount=100, transaction_type='deposit', currency='ILS')
+        Transaction.objects.create(account=self.other_account, amount=25.5, transaction_type='withdraw', currency='ILS')
+
+    def get_statement(self, export_format, **params):
+        response = self.client.get(reverse('account-statement', args=[export_format]), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_statement(self):
+        rows = list(csv.reader(StringIO(self.get_statement('csv'))))
+        self.assertEqual(rows[0], ['id', 'account', 'amount', 'transaction_type', 'currency', 'timestamp'])
+        self.assertEqual([row[2] for row in rows[1:]], ['100.00', '25.50'])
+
+    def test_ndjson_statement_filtered_by_account(self):
+        lines = self.get_statement('ndjson', account=self.other_account.id).splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['transaction_type'], 'withdraw')
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse('account-statement', args=['xlsx']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @tag('benchmark')
+    def test_statement_memory_stays_flat(self):
+        def peak_memory(row_count):
+            Transaction.objects.all().delete()
+            Transaction.objects.bulk_create([
+                Transaction(account=self.account, amount=i, transaction_type='deposit', currency='ILS')
+                for i in range(row_count)
+            ], batch_size=2000)
+
+            response = self.client.get(reverse('account-statement', args=['csv']))
+            tracemalloc.start()
+            started = time.perf_counter()
+            lines = sum(chunk.count(b'\n') for chunk in response.streaming_content)
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.assertEqual(lines, row_count + 1)
+            driver.report('statement', rows=row_count, peak_kib=round(peak / 1024), rows_per_second=round(row_count / elapsed, 1))
+            return peak
+
+        # Past the first DB fetch (STATEMENT_CHUNK_SIZE rows) memory should not grow with the statement
+        small, large = peak_memory(5000), peak_memory(100000)
+        self.assertLess(large, small * 1.25)
+
+class ExchangeRateTests(APITestCase):
+    def setUp(self):
+        ExchangeRate.objects.update_or_create(currency='EUR', defaults={'rate': Decimal('0.85')})
+        ExchangeRate.objects.update_or_create(currency='ILS', defaults={'rate': Decimal('3.5')})
+        fx.invalidate()
+        self.addCleanup(fx.invalidate)
+
+    def test_convert_currency(self):
+        self.assertEqual(convert_currency(Decimal('100'), 'USD', 'ILS'), Decimal('350.00'))
+        self.assertEqual(convert_currency(Decimal('85'), 'EUR', 'ILS'), Decimal('350.00'))  # Triangulated through USD
+        self.assertEqual(convert_currency(Decimal('10'), 'ILS', 'USD'), Decimal('2.86'))
+        with self.assertRaises(ValidationError):
+            convert_currency(Decimal('10'), 'ILS', 'JPY')
+
+    def test_cached_lookups_skip_the_database(self):
+        convert_currency(Decimal('1'), 'USD', 'EUR')
+        with self.assertNumQueries(0):
+            convert_currency(Decimal('1'), 'EUR', 'ILS')
+
+    def test_rate_change_invalidates_cache(self):
+        convert_currency(Decimal('1'), 'USD', 'EUR')
+        rate = ExchangeRate.objects.get(currency='EUR')
+        rate.rate = Decimal('0.9')
+        rate.save()
+        self.assertEqual(convert_currency(Decimal('100'), 'USD', 'EUR'), Decimal('90.00'))
+
+    def test_load_exchange_rates(self):
+        handle, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(handle, 'w') as f:
+            json.dump({'EUR': '0.9', 'JPY': '150'}, f)
+        self.addCleanup(os.remove, path)
+
+        call_command('load_exchange_rates', path, stdout=StringIO())
+        self.assertEqual(convert_currency(Decimal('100'), 'EUR', 'JPY'), Decimal('16666.67'))
+
+    def test_deposit_in_foreign_currency(self):
+        user = User.objects.create_user(email='fx@example.com', password='testpassword')
+        account = BankAccount.objects.create(user=user, balance=0, currency='ILS')
+        token = RefreshToken.for_user(user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(token.access_token))
+
+        response = self.client.post(reverse('account-deposit', args=[account.id]), {'amount': 100, 'currency': 'USD'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Decimal('346.50'))  # 99 USD after fee
+
+    @tag('benchmark')
+    def test_conversion_benchmark(self):
+        pairs = [('USD', 'EUR'), ('EUR', 'ILS'), ('ILS', 'USD')]
+        amount = Decimal('123.45')
+        expected = [Decimal('104.93'), Decimal('508.32'), Decimal('35.27')]
+        iterations = 100000
+        convert_currency(amount, 'USD', 'EUR')  # Loads the rates
+        results = []
+        started = time.perf_counter()
+        for i in range(iterations):
+            results.append(convert_currency(amount, *pairs[i % 3]))
+        elapsed = time.perf_counter() - started
+        self.assertEqual(results, expected * (iterations // 3) + expected[:iterations % 3])
+        driver.report('currency_conversion', conversions_per_second=round(iterations / elapsed, 1))
+
+class RunningBalanceTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='ledger@example.com',
+            password='testpassword'
+        )
+
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(self.token.access_token))
+        self.account = BankAccount.objects.create(user=self.user, balance=500, currency='ILS')
+        self.other_account = BankAccount.objects.create(user=self.user, balance=0, currency='ILS')
+
+    def test_money_paths_write_running_balance(self):
+        self.client.post(reverse('account-deposit', args=[self.account.id]), {'amount': 200}, format='json')
+        self.client.post(reverse('account-withdraw', args=[self.account.id]), {'amount': 100}, format='json')
+        self.client.post(reverse('account-transfer'), {
+            'from_account_id': self.account.id,
+            'to_account_id': self.other_account.id,
+            'amount': 50,
+            'currency': 'ILS'
+        }, format='json')
+
+        rows = list(Transaction.objects.order_by('id').values_list('account_id', 'signed_amount', 'balance_after'))
+        self.assertEqual(rows, [
+            (self.account.id, Decimal('198.00'), Decimal('698.00')),
+            (self.account.id, Decimal('-101.00'), Decimal('597.00')),
+            (self.account.id, Decimal('-50.50'), Decimal('546.50')),
+            (self.other_account.id, Decimal('50.00'), Decimal('50.00')),
+        ])
+
+    def test_balance_at(self):
+        now = timezone.now()
+        for minutes, amount, balance in [(30, 100, 600), (20, -50, 550), (10, 25, 575)]:
+            row = Transaction.objects.create(
+                account=self.account, amount=abs(amount), transaction_type='deposit' if amount > 0 else 'withdraw',
+                currency='ILS', signed_amount=amount, balance_after=balance
+            )
+            Transaction.objects.filter(pk=row.pk).update(timestamp=now - timedelta(minutes=minutes))
+
+        url = reverse('account-balance-at', args=[self.account.id])
+        expected = {40: '500.00', 25: '600.00', 15: '550.00', 0: '575.00'}
+        for minutes_ago, balance in expected.items():
+            at = (now - timedelta(minutes=minutes_ago)).isoformat()
+            response = self.client.get(url, {'at': at})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(Decimal(response.data['balance']), Decimal(balance))
+
+    def test_backfill_legacy_history(self):
+        backfill = import_module('account.migrations.0006_backfill_running_balance').backfill_running_balance
+        # Rows as the old views wrote them: unsigned amounts, transfer debit before credit, final balances saved
+        Transaction.objects.create(account=self.account, amount=200, transaction_type='deposit', currency='ILS')
+        Transaction.objects.create(account=self.account, amount=101, transaction_type='transfer', currency='ILS')
+        Transaction.objects.create(account=self.other_account, amount=100, transaction_type='transfer', currency='ILS')
+        Transaction.objects.create(account=self.account, amount=50, transaction_type='withdraw', currency='ILS')
+        BankAccount.objects.filter(pk=self.account.pk).update(balance=549)
+        BankAccount.objects.filter(pk=self.other_account.pk).update(balance=100)
+
+        backfill(django_apps, SimpleNamespace(connection=connection))
+        rows = list(Transaction.objects.order_by('id').values_list('signed_amount', 'balance_after'))
+        self.assertEqual(rows, [
+            (Decimal('200.00'), Decimal('700.00')),
+            (Decimal('-101.00'), Decimal('599.00')),
+            (Decimal('100.00'), Decimal('100.00')),
+            (Decimal('-50.00'), Decimal('549.00')),
+        ])
+
+    def test_backfill_pairs_interleaved_transfers_and_reports_orphans(self):
+        backfill = import_module('account.migrations.0006_backfill_running_balance').backfill_running_balance
+        def legacy(account, amount, transaction_type='transfer'):
+            return Transaction.objects.create(account=account, amount=amount, transaction_type=transaction_type, currency='ILS').pk
+        legacy(self.account, 1000, 'deposit')
+        orphan = legacy(self.account, Decimal('50.50'))  # A transfer whose credit was never written
+        # Two concurrent transfers, A -> B for 100 and B -> A for 200, with their rows interleaved
+        legacy(self.account, 101)
+        legacy(self.other_account, 202)
+        legacy(self.other_account, 100)
+        legacy(self.account, 200)
+        BankAccount.objects.filter(pk=self.account.pk).update(balance=Decimal('1048.50'))
+        BankAccount.objects.filter(pk=self.other_account.pk).update(balance=-102)
+
+        with self.assertLogs('account.migrations.0006_backfill_running_balance', 'WARNING') as logs:
+            backfill(django_apps, SimpleNamespace(connection=connection))
+        self.assertIn(f'1 transfer rows have no matching leg and were left without a signed amount; '
+                      f'their accounts\' running balances stop at them. Ids: {orphan}', logs.output[0])
+
+        rows = list(Transaction.objects.order_by('id').values_list('signed_amount', 'balance_after'))
+        self.assertEqual(rows, [
+            (Decimal('1000.00'), None),  # Before the orphan, so not recoverable
+            (None, Decimal('949.50')),
+            (Decimal('-101.00'), Decimal('848.50')),
+            (Decimal('-202.00'), Decimal('-202.00')),
+            (Decimal('100.00'), Decimal('-102.00')),
+            (Decimal('200.00'), Decimal('1048.50')),
+        ])
+        self.assertIsNone(self.account.balance_at(Transaction.objects.get(pk=orphan).timestamp - timedelta(microseconds=1)))
+        self.assertEqual(self.other_account.balance_at(timezone.now()), Decimal('-102.00'))
+
+class ActivitySummaryTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='summary@example.com',
+            password='testpassword'
+        )
+
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(self.token.access_token))
+        self.account = BankAccount.objects.create(user=self.user, balance=500, currency='ILS')
+        self.other_account = BankAccount.objects.create(user=self.user, balance=0, currency='ILS')
+        self.url = reverse('account-activity-summary')
+
+    # Runs the request as if it were made at noon on the 15th of 'month' ('YYYY-MM')
+    def post_in(self, month, url, data):
+        now = timezone.make_aware(datetime.strptime(f'{month}-15 12:00', '%Y-%m-%d %H:%M'))
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def summary_rows(self):
+        return list(MonthlyActivity.objects.order_by('account_id', 'month', 'transaction_type').values(
+            'account_id', 'month', 'transaction_type', 'count', 'total', 'net'
+        ))
+
+    # SQLite sums decimals as floats, so the raw totals are compared to the cent
+    def assert_consistent(self):
+        raw = [
+            {**row, 'total': row['total'].quantize(CENT), 'net': row['net'].quantize(CENT)}
+            for row in MonthlyActivity.objects.aggregate_ledger(Transaction.objects.all())
+        ]
+        self.assertEqual(self.summary_rows(), raw)
+
+    def test_every_write_path_matches_raw_aggregation(self):
+        rng = random.Random(18)
+        accounts = [self.account.id, self.other_account.id]
+        for _ in range(60):
+            month = rng.choice(['2026-01', '2026-02', '2026-03'])
+            operation = rng.choice(['deposit', 'withdraw', 'transfer', 'batch'])
+            account = rng.choice(accounts)
+            amount = rng.randint(1, 50)
+            if operation in ('deposit', 'withdraw'):
+                self.post_in(month, reverse(f'account-{operation}', args=[account]), {'amount': amount})
+            elif operation == 'transfer':
+                self.post_in(month, reverse('account-transfer'), {
+                    'from_account_id': account, 'to_account_id': accounts[account == accounts[0]],
+                    'amount': amount, 'currency': 'ILS'
+                })
+            else:
+                self.post_in(month, reverse('account-transfer-batch'), {'transfers': [
+                    {'from_account_id': accounts[0], 'to_account_id': accounts[1], 'amount': amount},
+                    {'from_account_id': accounts[1], 'to_account_id': accounts[0], 'amount': amount + 1},
+                ]})
+
+        self.assertEqual(MonthlyActivity.objects.values('month').distinct().count(), 3)
+        self.assert_consistent()
+
+    def test_endpoint_groups_types_by_month(self):
+        self.post_in('2026-01', reverse('account-deposit', args=[self.account.id]), {'amount': 100})
+        self.post_in('2026-01', reverse('account-deposit', args=[self.account.id]), {'amount': 200})
+        self.post_in('2026-02', reverse('account-transfer'), {
+            'from_account_id': self.account.id, 'to_account_id': self.other_account.id, 'amount': 50, 'currency': 'ILS'
+        })
+
+        response = self.client.get(self.url, {'account': self.account.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [
+            {'account': self.account.id, 'month': '2026-01', 'deposit': {'count': 2, 'total': '297.00', 'net': '297.00'}},
+            {'account': self.account.id, 'month': '2026-02', 'transfer': {'count': 1, 'total': '50.50', 'net': '-50.50'}},
+        ])
+
+        response = self.client.get(self.url, {'start': '2026-02', 'end': '2026-02'})
+        self.assertEqual([(row['account'], row['month']) for row in response.json()], [
+            (self.account.id, '2026-02'), (self.other_account.id, '2026-02')
+        ])
+        self.assertEqual(self.client.get(self.url, {'start': '2026-13'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_other_users_accounts_are_excluded(self):
+        other_user = User.objects.create_user(email='summary-other@example.com', username='summary-other', password='testpassword')
+        other_users_account = BankAccount.objects.create(user=other_user, balance=0, currency='ILS')
+        Transaction.objects.create(account=other_users_account, amount=5, transaction_type='deposit', currency='ILS', signed_amount=5)
+        self.assertEqual(self.client.get(self.url).json(), [])
+
+    def test_read_cost_does_not_grow_with_history(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        Transaction.objects.create(account=self.account, amount=5, transaction_type='deposit', currency='ILS', signed_amount=5)
+        count_queries()  # Warm the authentication cache
+        before = count_queries()
+        Transaction.objects.bulk_create([
+            Transaction(account=self.account, amount=5, transaction_type='deposit', currency='ILS', signed_amount=5)
+            for _ in range(500)
+        ])
+        self.assertEqual(count_queries(), before)
+        self.assertEqual(MonthlyActivity.objects.get().count, 501)
+
+    def test_backends_without_upsert(self):
+        with mock.patch.object(connection, 'vendor', 'other'):
+            for amount in [5, 7]:
+                Transaction.objects.create(account=self.account, amount=amount, transaction_type='deposit', currency='ILS', signed_amount=amount)
+        self.assert_consistent()
+        self.assertEqual(MonthlyActivity.objects.get().count, 2)
+
+    def test_rebuild_command(self):
+        self.post_in('2026-01', reverse('account-deposit', args=[self.account.id]), {'amount': 100})
+        self.post_in('2026-02', reverse('account-withdraw', args=[self.other_account.id]), {'amount': 10})
+        # Changes made behind the summary's back: a moved transaction and a lost summary row
+        Transaction.objects.filter(account=self.account).update(timestamp=timezone.now() - timedelta(days=400))
+        MonthlyActivity.objects.filter(account=self.other_account).delete()
+
+        out = StringIO()
+        call_command('rebuild_activity_summary', account=[self.account.id], stdout=out)
+        self.assertIn('Rebuilt 1 monthly activity rows', out.getvalue())
+        self.assertEqual(MonthlyActivity.objects.count(), 1)
+
+        call_command('rebuild_activity_summary', stdout=StringIO())
+        self.assert_consistent()
+
+    def test_backfill_migration_writes_in_chunks(self):
+        migration = import_module('account.migrations.0009_backfill_monthly_activity')
+        for month in ['2026-01', '2026-02', '2026-03']:
+            self.post_in(month, reverse('account-deposit', args=[self.account.id]), {'amount': 100})
+            self.post_in(month, reverse('account-withdraw', args=[self.other_account.id]), {'amount': 10})
+        MonthlyActivity.objects.all().delete()
+
+        with mock.patch.object(migration, 'CHUNK_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            migration.backfill_monthly_activity(django_apps, SimpleNamespace(connection=connection))
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "account_monthlyactivity"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(MonthlyActivity.objects.count(), 6)
+        self.assert_consistent()
+
+class IdempotencyTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='idempotent@example.com',
+            password='testpassword'
+        )
+
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(self.token.access_token))
+        self.account = BankAccount.objects.create(user=self.user, balance=500, currency='ILS')
+        self.deposit_url = reverse('account-deposit', args=[self.account.id])
+        idempotency.forget_all()
+        self.addCleanup(idempotency.forget_all)
+
+    def test_replay_returns_stored_response(self):
+        first = self.client.post(self.deposit_url, {'amount': 200}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        second = self.client.post(self.deposit_url, {'amount': 200}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('698.00'))
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 1)
+
+    def test_replay_from_table_after_cache_is_lost(self):
+        first = self.client.post(self.deposit_url, {'amount': 200}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        idempotency.forget_all()
+        second = self.client.post(self.deposit_url, {'amount': 200}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 1)
+
+    def test_hot_replay_skips_the_key_table(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.deposit_url, {'amount': 200}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.deposit_url, {'amount': 200}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertFalse(any('idempotencykey' in query['sql'] for query in queries))
+
+    def test_key_reused_for_different_request(self):
+        self.client.post(self.deposit_url, {'amount': 200}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        response = self.client.post(self.deposit_url, {'amount': 300}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_failed_request_keeps_no_key(self):
+        withdraw_url = reverse('account-withdraw', args=[self.account.id])
+        response = self.client.post(withdraw_url, {'amount': 5000}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        response = self.client.post(withdraw_url, {'amount': 100}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_purge_expired_keys(self):
+        self.client.post(self.deposit_url, {'amount': 200}, format='json', HTTP_IDEMPOTENCY_KEY='old')
+        self.client.post(self.deposit_url, {'amount': 200}, format='json', HTTP_IDEMPOTENCY_KEY='new')
+        IdempotencyKey.objects.filter(key__endswith=':old').update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        call_command('purge_idempotency_keys', stdout=StringIO())
+        self.assertEqual([key.split(':')[1] for key in IdempotencyKey.objects.values_list('key', flat=True)], ['new'])
+
+class IdempotencyConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='idempotent-concurrent@example.com',
+            password='testpassword'
+        )
+        self.token = RefreshToken.for_user(self.user)
+        self.account = BankAccount.objects.create(user=self.user, balance=0, currency='ILS')
+        idempotency.forget_all()
+        self.addCleanup(idempotency.forget_all)
+
+    def test_concurrent_duplicates_apply_once(self):
+        url = reverse('account-deposit', args=[self.account.id])
+
+        def submit(_):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(self.token.access_token))
+            try:
+                response = client.post(url, {'amount': 100}, format='json', HTTP_IDEMPOTENCY_KEY='same-key')
+                return response.status_code, response.content
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(submit, range(40)))
+
+        self.assertEqual({status_code for status_code, _ in responses}, {status.HTTP_200_OK})
+        self.assertEqual(len({content for _, content in responses}), 1)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('99.00'))
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 1)
+
+class AsyncViewTests(APITestCase):
+    # The async endpoints must answer exactly like their DRF counterparts
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='async@example.com',
+            password='testpassword'
+        )
+
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(self.token.access_token))
+        self.account = BankAccount.objects.create(user=self.user, balance=500, currency='ILS')
+        self.other = BankAccount.objects.create(user=self.user, balance=500, currency='ILS')
+        idempotency.forget_all()
+        self.addCleanup(idempotency.forget_all)
+
+    def test_deposit(self):
+        response = self.client.post(
+            reverse('account-deposit-async', args=[self.account.id]), {'amount': 200, 'currency': 'ILS'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'balance': 698.0, 'message': 'Deposit successful!'})
+        self.assertEqual(Transaction.objects.get(account=self.account).balance_after, Decimal('698.00'))
+
+    def test_withdraw_insufficient_funds_matches_sync_view(self):
+        data = {'amount': 2000}
+        sync_response = self.client.post(reverse('account-withdraw', args=[self.account.id]), data, format='json')
+        async_response = self.client.post(reverse('account-withdraw-async', args=[self.account.id]), data, format='json')
+        self.assertEqual(async_response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(async_response.content, sync_response.content)
+
+    def test_transfer(self):
+        data = {'from_account_id': self.account.id, 'to_account_id': self.other.id, 'amount': 100, 'currency': 'ILS'}
+        response = self.client.post(reverse('account-transfer-async'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'from_balance': 399.0, 'to_balance': 600.0})
+
+        data['to_account_id'] = 999999
+        response = self.client.post(reverse('account-transfer-async'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), ['Account not found.'])
+
+    def test_transactions_match_sync_view(self):
+        for amount in range(1, 8):
+            Transaction.objects.create(account=self.account, amount=amount, transaction_type='deposit', currency='ILS')
+
+        sync_page = self.client.get(reverse('user-transactions'), {'page_size': 3})
+        async_page = self.client.get(reverse('user-transactions-async'), {'page_size': 3})
+        self.assertEqual(async_page.status_code, status.HTTP_200_OK)
+        self.assertEqual(async_page.json()['results'], sync_page.json()['results'])
+
+        next_page = self.client.get(async_page.json()['next'])
+        self.assertEqual(next_page.json()['results'], self.client.get(sync_page.json()['next']).json()['results'])
+
+    def test_idempotent_replay(self):
+        url = reverse('account-deposit-async', args=[self.account.id])
+        first = self.client.post(url, {'amount': 200}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        second = self.client.post(url, {'amount': 200}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 1)
+
+    def test_authentication(self):
+        self.client.credentials()
+        response = self.client.get(reverse('user-transactions-async'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer not-a-token')
+        response = self.client.get(reverse('user-transactions-async'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.json()['code'], 'token_not_valid')
+
+@tag('benchmark')
+class AsyncLoadBenchmarkTests(TransactionTestCase):
+    # Compares WSGI and ASGI at high concurrency: the same requests go through Django's WSGI handler
+    # from one thread per client, and through its ASGI handler as concurrent tasks on one event loop,
+    # first to the DRF views and then to their native async versions.
+    concurrency = 64
+    requests_count = 512
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='async-load@example.com',
+            password='testpassword'
+        )
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        self.account = BankAccount.objects.create(user=self.user, balance=0, currency='ILS')
+        Transaction.objects.bulk_create([
+            Transaction(account=self.account, amount=1, transaction_type='deposit', currency='ILS')
+            for _ in range(1000)
+        ])
+
+    # Drives the requests through benchmarks.driver, all sessions as the one user, and logs the summary
+    def drive(self, name, run, method, path, body=None):
+        sessions = [SimpleNamespace(token=self.token, ip='127.0.0.1')] * self.concurrency
+        results, elapsed = run(sessions, lambda session, n: (method, path, body), self.requests_count // self.concurrency)
+        summary = driver.summarize(results, elapsed)
+        self.assertEqual((summary['requests'], summary['errors']), (self.requests_count, 0))
+        self.assertEqual({status_code for status_code, _, _ in results}, {status.HTTP_200_OK})
+        driver.report(name, concurrency=self.concurrency, **summary)
+
+    def test_wsgi_vs_asgi(self):
+        transactions = reverse('user-transactions'), reverse('user-transactions-async')
+        deposits = reverse('account-deposit', args=[self.account.id]), reverse('account-deposit-async', args=[self.account.id])
+        for endpoint, (sync_path, async_path), method, body in [
+            ('transactions', transactions, 'get', None),
+            ('deposit', deposits, 'post', {'amount': 100}),
+        ]:
+            self.drive(f'{endpoint}_wsgi_drf_views', driver.run_wsgi, method, sync_path, body)
+            self.drive(f'{endpoint}_asgi_drf_views', driver.run_asgi, method, sync_path, body)
+            self.drive(f'{endpoint}_asgi_async_views', driver.run_asgi, method, async_path, body)
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, 3 * self.requests_count * Decimal('99.00'))
+        self.assertEqual(Transaction.objects.filter(transaction_type='deposit').count(), 1000 + 3 * self.requests_count)
+
+@skipUnless(connection.vendor == 'sqlite', "Measures the SQLite tuning profile")
+class SQLiteTuningTests(TransactionTestCase):
+    threads = 16
+    operations_per_thread = 25
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='sqlite-tuning@example.com',
+            password='testpassword'
+        )
+        self.token = RefreshToken.for_user(self.user)
+        self.accounts = [
+            BankAccount.objects.create(user=self.user, balance=1000000, currency='ILS').pk for _ in range(10)
+        ]
+
+    def tearDown(self):
+        connection.close()  # The next connection picks up the profile again
+
+    def test_profile_applied_to_new_connections(self):
+        connection.close()
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_write_queue_admits_writers_in_arrival_order(self):
+        queue, admitted, writers = WriteQueue(), [], []
+
+        def write(number):
+            with queue.turn():
+                admitted.append(number)
+
+        with queue.turn():  # Hold the queue while the writers line up behind it
+            for number in range(5):
+                writers.append(threading.Thread(target=write, args=[number]))
+                writers[-1].start()
+                while queue._next_ticket < number + 2:  # Wait until this writer holds its ticket
+                    time.sleep(0.001)
+            self.assertEqual(admitted, [])
+        for writer in writers:
+            writer.join()
+        self.assertEqual(admitted, [0, 1, 2, 3, 4])
+
+    def run_in_threads(self, work):
+        def run(seed):
+            try:
+                return work(random.Random(seed))
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            results = list(executor.map(run, range(self.threads)))
+        return sum(ok for ok, _ in results), sum(failed for _, failed in results), time.perf_counter() - started
+
+    def deposit(self, rng):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(self.token.access_token))
+        ok = failed = 0
+        for _ in range(self.operations_per_thread):
+            url = reverse('account-deposit', args=[rng.choice(self.accounts)])
+            try:
+                response = client.post(url, {'amount': 100}, format='json')
+            except OperationalError:
+                response = None
+            if response is not None and response.status_code == status.HTTP_200_OK:
+                ok += 1
+            else:
+                failed += 1
+        return ok, failed
+
+    def transfer(self, rng):
+        ok = failed = 0
+        for _ in range(self.operations_per_thread):
+            from_id, to_id = rng.sample(self.accounts, 2)
+            try:
+                transfer(from_id, to_id, 10, 10)
+                ok += 1
+            except OperationalError:
+                failed += 1
+        return ok, failed
+
+    @tag('benchmark')
+    def test_deposit_and_transfer_throughput(self):
+        deposited = transferred = 0
+        for name, tuning, write_queue in [
+            ('sqlite_defaults', False, False),
+            ('sqlite_tuning_profile', True, False),
+            ('sqlite_tuning_profile_write_queue', True, True),
+        ]:
+            with self.settings(SQLITE_TUNING=tuning, SQLITE_WRITE_QUEUE=write_queue):
+                connection.close()
+                if not tuning:
+                    # WAL is stored in the database file, so the untuned run has to switch it back
+                    with connection.cursor() as cursor:
+                        cursor.execute('PRAGMA journal_mode = DELETE')
+                    connection.close()
+
+                deposits_ok, deposits_failed, deposits_elapsed = self.run_in_threads(self.deposit)
+                transfers_ok, transfers_failed, transfers_elapsed = self.run_in_threads(self.transfer)
+                connection.close()
+
+            deposited += deposits_ok
+            transferred += transfers_ok
+            if tuning:
+                self.assertEqual((deposits_failed, transfers_failed), (0, 0))
+            driver.report(
+                name, threads=self.threads,
+                deposits_per_second=round(deposits_ok / deposits_elapsed, 1), deposits_failed=deposits_failed,
+                transfers_per_second=round(transfers_ok / transfers_elapsed, 1), transfers_failed=transfers_failed,
+            )
+
+        # Failed writes were rolled back whole: every completed one is in the ledger, and nothing else
+        total = sum(BankAccount.objects.filter(pk__in=self.accounts).values_list('balance', flat=True))
+        self.assertEqual(total, len(self.accounts) * Decimal('1000000') + deposited * Decimal('99.00'))
+        self.assertEqual(Transaction.objects.filter(transaction_type='deposit').count(), deposited)
+        self.assertEqual(Transaction.objects.filter(transaction_type='transfer').count(), 2 * transferred)
+
+@override_settings(GROUP_COMMIT=True, GROUP_COMMIT_MAX_WAIT=0.02)
+class GroupCommitTests(TransactionTestCase):
+    threads = 16
+    deposits_per_thread = 25
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='group-commit@example.com',
+            password='testpassword'
+        )
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        self.accounts = [
+            BankAccount.objects.create(user=self.user, balance=1000, currency='ILS').pk for _ in range(10)
+        ]
+        # A writer of its own for each test, whose thread opens its connection under the test's settings
+        self.writer = GroupCommitWriter()
+        patcher = mock.patch('account.transfers.group_writer', self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: self.writer.stop())
+
+    def tearDown(self):
+        connection.close()
+
+    def run_deposits(self):
+        def deposits(seed):
+            rng = random.Random(seed)
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+            try:
+                return [
+                    client.post(reverse('account-deposit', args=[rng.choice(self.accounts)]), {'amount': 100}, format='json').status_code
+                    for _ in range(self.deposits_per_thread)
+                ]
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            statuses = [code for codes in executor.map(deposits, range(self.threads)) for code in codes]
+        return statuses, time.perf_counter() - started
+
+    def test_concurrent_deposits_share_commits(self):
+        statuses, _ = self.run_deposits()
+        deposits = self.threads * self.deposits_per_thread
+        self.assertEqual(statuses, [status.HTTP_200_OK] * deposits)
+        self.assertEqual(self.writer.writes, deposits)
+        self.assertLess(self.writer.batches, deposits / 2)
+
+        total = sum(BankAccount.objects.filter(pk__in=self.accounts).values_list('balance', flat=True))
+        self.assertEqual(total, len(self.accounts) * Decimal('1000') + deposits * Decimal('99.00'))
+        self.assertEqual(Transaction.objects.count(), deposits)
+
+    def test_failed_write_is_rolled_back_alone(self):
+        def deposit(amount):
+            BankAccount.objects.adjust_balance(self.accounts[0], amount)
+            Transaction.objects.create(account_id=self.accounts[0], amount=amount, transaction_type='deposit', currency='ILS')
+            return amount
+
+        def fail():
+            deposit(Decimal(1000))
+            raise ValidationError("Insufficient funds for withdrawal.")
+
+        writes = [_Write(deposit, [Decimal(5)], {}), _Write(fail, [], {}), _Write(deposit, [Decimal(7)], {})]
+        self.writer._commit(writes, attempts=1, backoff=0)
+
+        self.assertEqual([write.result for write in writes], [5, None, 7])
+        self.assertIsInstance(writes[1].error, ValidationError)
+        self.assertEqual(BankAccount.objects.get(pk=self.accounts[0]).balance, Decimal('1012.00'))
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_lock_errors_retry_the_batch(self):
+        calls = []
+        def deposit(amount):
+            calls.append(amount)
+            if len(calls) == 2:
+                raise OperationalError("database is locked")
+            BankAccount.objects.adjust_balance(self.accounts[0], amount)
+            return amount
+
+        writes = [_Write(deposit, [Decimal(5)], {}), _Write(deposit, [Decimal(7)], {})]
+        self.writer._commit(writes, attempts=3, backoff=0)
+
+        self.assertEqual(calls, [5, 7, 5, 7])
+        self.assertEqual([(write.result, write.error) for write in writes], [(5, None), (7, None)])
+        self.assertEqual(BankAccount.objects.get(pk=self.accounts[0]).balance, Decimal('1012.00'))
+
+    def test_errors_and_idempotency_keys_reach_the_request(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+        url = reverse('account-withdraw', args=[self.accounts[0]])
+
+        response = client.post(url, {'amount': 5000}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        first = client.post(url, {'amount': 100}, format='json', HTTP_IDEMPOTENCY_KEY='group')
+        second = client.post(url, {'amount': 100}, format='json', HTTP_IDEMPOTENCY_KEY='group')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(BankAccount.objects.get(pk=self.accounts[0]).balance, Decimal('899.00'))
+        self.assertEqual(self.writer.writes, 2)
+
+    @tag('benchmark')
+    @skipUnless(connection.vendor == 'sqlite', "Measures commits against SQLite")
+    def test_commit_throughput(self):
+        runs = 0
+        for synchronous in ['FULL', 'NORMAL']:
+            for group_commit in [False, True]:
+                self.writer.stop()
+                self.writer = GroupCommitWriter()
+                with mock.patch.dict(sqlite.PRAGMAS, synchronous=synchronous), \
+                        mock.patch('account.transfers.group_writer', self.writer), \
+                        self.settings(GROUP_COMMIT=group_commit, GROUP_COMMIT_MAX_WAIT=0.005):
+                    connection.close()
+                    statuses, elapsed = self.run_deposits()
+                runs += 1
+                self.assertEqual(statuses, [status.HTTP_200_OK] * self.threads * self.deposits_per_thread)
+                self.assertEqual(self.writer.writes, len(statuses) if group_commit else 0)
+                driver.report(
+                    'group_commit' if group_commit else 'commit_per_request', synchronous=synchronous, threads=self.threads,
+                    deposits_per_second=round(len(statuses) / elapsed, 1),
+                    writes_per_commit=round(self.writer.writes / self.writer.batches, 1) if group_commit else 1,
+                )
+
+        deposits = runs * self.threads * self.deposits_per_thread
+        total = sum(BankAccount.objects.filter(pk__in=self.accounts).values_list('balance', flat=True))
+        self.assertEqual(total, len(self.accounts) * Decimal('1000') + deposits * Decimal('99.00'))
+        self.assertEqual(Transaction.objects.count(), deposits)
@@ -0,0 +1,90 @@
+import random
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from rest_framework.exceptions import ValidationError
+from .group_commit import group_writer
+from .models import CENT, BankAccount, Transaction
+from .sqlite import queued_write
+
+MAX_ATTEMPTS = 5 # How many times a transfer is tried before the error is raised
+BACKOFF_SECONDS = 0.01 # Base delay between attempts, doubled on every retry
+
+# Run func in its own atomic block, retrying with exponential backoff on OperationalError,
+# which is how serialization failures, lock timeouts and SQLite's "database is locked" surface.
+# With the SQLite write queue on, the block first waits its turn behind this process's other writers.
+# With GROUP_COMMIT on, func runs on the group-commit writer and is committed together with other requests' writes.
+def atomic_with_retry(func, *args, attempts=MAX_ATTEMPTS, **kwargs):
+    # A retry can only restart the transaction if we own it. Inside someone else's transaction
+    # func gets a savepoint, so a failure still undoes just its own work.
+    if connection.in_atomic_block:
+        with transaction.atomic():
+            return func(*args, **kwargs)
+
+    if settings.GROUP_COMMIT:
+        return group_writer.run(func, args, kwargs, attempts, BACKOFF_SECONDS)
+
+    for attempt in range(attempts):
+        try:
+            with queued_write(), transaction.atomic():
+                return func(*args, **kwargs)
+        except OperationalError:
+            if attempt == attempts - 1:
+                raise
+            # Full jitter keeps retrying transfers from colliding again in lockstep
+            time.sleep(random.uniform(0, BACKOFF_SECONDS * 2 ** attempt))
+
+# Load and lock the given accounts in primary key order. Must be called inside an atomic block.
+# Always taking locks in the same order means two transfers touching the same accounts queue on
+# the same row first and can't deadlock. Returns a dict of accounts keyed by primary key.
+def lock_accounts(account_ids):
+    queryset = BankAccount.objects.filter(pk__in=account_ids).order_by('pk')
+    if connection.features.has_select_for_update:
+        queryset = queryset.select_for_update()
+    else:
+        # SQLite has no row locks. A no-op UPDATE takes the write lock up front, waiting on busy_timeout,
+        # instead of failing the read-to-write lock upgrade later in the transaction.
+        queryset.update(balance=F('balance'))
+    return {account.pk: account for account in queryset}
+
+# Move money between two accounts.
+# 'debit' is taken from the source account and 'credit' is added to the destination, both in the
+# account's own currency. Both rows are locked inside one atomic block and the transfer is retried
+# on lock errors. Returns the new (from_balance, to_balance).
+def transfer(from_account_id, to_account_id, debit, credit, overdraft_limit=None, attempts=MAX_ATTEMPTS):
+    debit = Decimal(debit).quantize(CENT)
+    credit = Decimal(credit).quantize(CENT)
+    return atomic_with_retry(
+        _transfer, from_account_id, to_account_id, debit, credit, overdraft_limit, attempts=attempts
+    )
+
+def _transfer(from_account_id, to_account_id, debit, credit, overdraft_limit):
+    accounts = lock_accounts([from_account_id, to_account_id])
+
+    try:
+        from_account = accounts[int(from_account_id)]
+        to_account = accounts[int(to_account_id)]
+    except (KeyError, TypeError, ValueError):
+        raise ValidationError("Account not found.")
+
+    if overdraft_limit is not None and from_account.balance - debit < overdraft_limit:
+        raise ValidationError("Insufficient funds for transfer.")
+
+    # Each ledger row records the balance right after its own leg of the transfer
+    from_account.balance -= debit
+    debit_row = Transaction(
+        account=from_account, amount=debit, transaction_type='transfer', currency=from_account.currency,
+        signed_amount=-debit, balance_after=from_account.balance
+    )
+    to_account.balance += credit
+    credit_row = Transaction(
+        account=to_account, amount=credit, transaction_type='transfer', currency=to_account.currency,
+        signed_amount=credit, balance_after=to_account.balance
+    )
+
+    BankAccount.objects.bulk_update(accounts.values(), ['balance'])
+    Transaction.objects.bulk_create([debit_row, credit_row])
+
+    return from_account.balance, to_account.balance
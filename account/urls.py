@@ -6,8 +6,13 @@ from .views import (
     SuspendAccountView,
     CloseAccountView,
     TransferView,
-    UserTransactionsView
+    BatchTransferView,
+    UserTransactionsView,
+    StatementExportView,
+    BalanceAtView,
+    ActivitySummaryView
 )
+from .async_views import AsyncDepositView, AsyncWithdrawView, AsyncTransferView, AsyncUserTransactionsView
 
 urlpatterns = [
     path('create/', CreateAccountView.as_view(), name='account-create'),
@@ -16,5 +21,15 @@ urlpatterns = [
     path('suspend/<int:pk>/', SuspendAccountView.as_view(), name='account-suspend'),
     path('close/<int:pk>/', CloseAccountView.as_view(), name='account-close'),
     path('transfer/', TransferView.as_view(), name='account-transfer'),
-    path('transactions/', UserTransactionsView.as_view(), name='user-transactions')
+    path('transfer/batch/', BatchTransferView.as_view(), name='account-transfer-batch'),
+    path('transactions/', UserTransactionsView.as_view(), name='user-transactions'),
+    path('statement/<str:export_format>/', StatementExportView.as_view(), name='account-statement'),
+    path('balance/<int:pk>/', BalanceAtView.as_view(), name='account-balance-at'),
+    path('summary/', ActivitySummaryView.as_view(), name='account-activity-summary'),
+
+    # Native async versions for ASGI deployments
+    path('async/deposit/<int:pk>/', AsyncDepositView.as_view(), name='account-deposit-async'),
+    path('async/withdraw/<int:pk>/', AsyncWithdrawView.as_view(), name='account-withdraw-async'),
+    path('async/transfer/', AsyncTransferView.as_view(), name='account-transfer-async'),
+    path('async/transactions/', AsyncUserTransactionsView.as_view(), name='user-transactions-async')
 ]
@@ -1,15 +1,38 @@
+import csv
+import json
 from rest_framework import generics, status
 from rest_framework.response import Response
 from account.utils import convert_currency
-from .models import Transaction, BankAccount
-from .serializers import BankAccountSerializer, TransactionSerializer
-from .mixins import AccountMixin
-from rest_framework.exceptions import ValidationError
+from account.transfers import atomic_with_retry, lock_accounts, transfer
+from .models import CENT, MonthlyActivity, Transaction, BankAccount
+from .serializers import BankAccountSerializer, BatchTransferSerializer, MonthlyActivitySerializer, TransactionSerializer, transaction_rows
+from .mixins import AccountMixin, TransactionFilterMixin
+from .conditional import ConditionalListMixin
+from .pagination import TransactionCursorPagination
+from .renderers import FastJSONRenderer
+from .idempotency import idempotent
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
+from datetime import datetime
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from decimal import Decimal
-from drf_spectacular.utils import extend_schema
+from drf_spectacular.utils import OpenApiParameter, extend_schema
+from metrics import instruments
 
 FEE_PERCENTAGE = Decimal('0.01') # Example fee percentage
+OVERDRAFT_LIMIT = Decimal('-1000') # Lowest balance an account may reach
+BATCH_WRITE_SIZE = 1000 # Rows per statement when a batch transfer writes balances and transactions
+STATEMENT_CHUNK_SIZE = 2000 # Rows fetched from the DB cursor at a time when streaming a statement
+STATEMENT_FIELDS = ['id', 'account', 'amount', 'transaction_type', 'currency', 'timestamp']
+TRANSACTION_FILTER_PARAMETERS = [
+    OpenApiParameter('account', int, description='Only transactions of this account'),
+    OpenApiParameter('transaction_type', str, description='deposit, withdraw or transfer'),
+    OpenApiParameter('start', str, description='ISO 8601 date or datetime, inclusive'),
+    OpenApiParameter('end', str, description='ISO 8601 date or datetime, exclusive'),
+]
 
 @extend_schema(tags=['Bank account'])
 class CreateAccountView(generics.CreateAPIView):
@@ -20,67 +43,137 @@ class CreateAccountView(generics.CreateAPIView):
         # Automatically set the user to the currently authenticated user
         serializer.save(user=self.request.user)
 
+# The amount a deposit credits: the amount less the fee, converted to the account's currency.
+# Shared by DepositMixin and the ingest_transactions command.
+def deposit_net_amount(amount, currency, account_currency):
+    if amount <= 0:
+        raise ValidationError("Deposit amount must be greater than zero.")
+
+    fee = amount * FEE_PERCENTAGE
+    net_amount = amount - fee  # Amount after deducting the fee
+    if net_amount <= 0:
+        raise ValidationError("Deposit amount after fee must be greater than zero.")
+
+    if currency != account_currency:
+        net_amount = convert_currency(net_amount, currency, account_currency)
+    return net_amount
+
+class DepositMixin:
+    # Credits the account with the amount less the fee, converted to the account's currency,
+    # and records the transaction. Returns the new balance.
+    def deposit(self, account, amount, currency):
+        net_amount = deposit_net_amount(amount, currency, account.currency)
+
+        # Apply the balance change and record the transaction in one DB transaction, retried on lock errors
+        balance = atomic_with_retry(self.record_deposit, account, net_amount)
+        instruments.deposits.inc(account.currency)
+        instruments.deposited.inc(account.currency, amount=float(net_amount))
+        return balance
+
+    def record_deposit(self, account, net_amount):
+        balance = BankAccount.objects.adjust_balance(account.pk, net_amount)
+        if balance is None:
+            raise ValidationError("Account not found.")
+
+        # Create the transaction record
+        Transaction.objects.create(
+            account=account,
+            amount=net_amount,
+            transaction_type='deposit',
+            currency=account.currency,
+            signed_amount=net_amount,
+            balance_after=balance
+        )
+        return balance
+
 @extend_schema(tags=['Bank account'])
-class DepositView(AccountMixin, generics.UpdateAPIView):
+class DepositView(DepositMixin, AccountMixin, generics.UpdateAPIView):
     serializer_class = TransactionSerializer
 
+    @idempotent
     def post(self, request, pk):
         account = self.get_account(pk)
         amount = Decimal(request.data.get('amount', 0))
         currency = request.data.get('currency', account.currency)  # Use account currency if not provided
+        balance = self.deposit(account, amount, currency)
+        return Response({'balance': balance, 'message': 'Deposit successful!'})
+
+class WithdrawMixin:
+    # Debits the account with the amount plus the fee, converted to the account's currency,
+    # and records the transaction. Returns the new balance.
+    def withdraw(self, account, amount, currency):
         if amount <= 0:
-            raise ValidationError("Deposit amount must be greater than zero.")
+            raise ValidationError("Withdrawal amount must be greater than zero.")
         
         fee = amount * FEE_PERCENTAGE
-        net_amount = amount - fee  # Amount after deducting the fee
+        net_amount = amount + fee  # Amount after deducting the fee
         if net_amount <= 0:
-            raise ValidationError("Deposit amount after fee must be greater than zero.")
+            raise ValidationError("Withdrawal amount after fee must be greater than zero.")
 
         if currency != account.currency:
             net_amount = convert_currency(net_amount, currency, account.currency)
 
-        account.balance += net_amount
-        account.save()
+        balance = atomic_with_retry(self.record_withdrawal, account, net_amount)
+        instruments.withdrawals.inc(account.currency)
+        instruments.withdrawn.inc(account.currency, amount=float(net_amount))
+        return balance
 
-        # Create the transaction record
+    # The overdraft limit is enforced by the UPDATE itself, so concurrent withdrawals can't overshoot it
+    def record_withdrawal(self, account, net_amount):
+        balance = BankAccount.objects.adjust_balance(account.pk, -net_amount, floor=OVERDRAFT_LIMIT)
+        if balance is None:
+            raise ValidationError("Insufficient funds for withdrawal.")
         Transaction.objects.create(
             account=account,
             amount=net_amount,
-            transaction_type='deposit',
-            currency=account.currency
+            transaction_type='withdraw',
+            currency=account.currency,
+            signed_amount=-net_amount,
+            balance_after=balance
         )
-
-        return Response({'balance': account.balance, 'message': 'Deposit successful!'})
+        return balance
 
 @extend_schema(tags=['Bank account'])
-class WithdrawView(AccountMixin, generics.UpdateAPIView):
+class WithdrawView(WithdrawMixin, AccountMixin, generics.UpdateAPIView):
     serializer_class = TransactionSerializer
 
+    @idempotent
     def post(self, request, pk):
         account = self.get_account(pk)
         amount = Decimal(request.data.get('amount', 0))
         currency = request.data.get('currency', account.currency)  # Use account currency if not provided
+        balance = self.withdraw(account, amount, currency)
+        return Response({'balance': balance})
+
+class TransferMixin:
+    # Moves the amount between the accounts, charging the fee to the source account.
+    # Returns both new balances.
+    def transfer(self, from_account, to_account, amount, currency):
         if amount <= 0:
-            raise ValidationError("Withdrawal amount must be greater than zero.")
-        
-        fee = amount * FEE_PERCENTAGE
-        net_amount = amount + fee  # Amount after deducting the fee
-        if net_amount <= 0:
-            raise ValidationError("Withdrawal amount after fee must be greater than zero.")
+            raise ValidationError("Transfer amount must be greater than zero.")
 
-        if currency != account.currency:
-            net_amount = convert_currency(net_amount, currency, account.currency)
+        net_amount = self.get_debit_amount(amount, currency, from_account)
 
-        if account.balance - net_amount < -1000:  # Change -1000 to your desired overdraft limit
-            raise ValidationError("Insufficient funds for withdrawal.")
+        # Both rows are locked and the overdraft limit re-checked against the locked balance
+        balances = transfer(from_account.pk, to_account.pk, net_amount, amount, overdraft_limit=OVERDRAFT_LIMIT)
+        instruments.transfers.inc(to_account.currency)
+        instruments.transferred.inc(to_account.currency, amount=float(amount))
+        return balances
 
-        account.balance -= net_amount
-        account.save()
-        Transaction.objects.create(account=account, amount=net_amount, transaction_type='withdraw', currency=account.currency)
-        return Response({'balance': account.balance})
+    # Amount taken from the source account: the transfer amount plus fee, in the account's currency
+    def get_debit_amount(self, amount, currency, from_account):
+        fee = amount * FEE_PERCENTAGE
+        net_amount = amount + fee
+        if net_amount <= 0:
+            raise ValidationError("Transfer amount after fee must be greater than zero.")
+
+        if currency != from_account.currency:
+            net_amount = convert_currency(net_amount, currency, from_account.currency)
+        return net_amount
 
 @extend_schema(tags=['Bank account'])
-class TransferView(AccountMixin, generics.GenericAPIView):
+class TransferView(TransferMixin, AccountMixin, generics.GenericAPIView):
+    @idempotent
     def post(self, request):
         from_account_id = request.data.get('from_account_id')
         to_account_id = request.data.get('to_account_id')
@@ -90,30 +183,75 @@ class TransferView(AccountMixin, generics.GenericAPIView):
         from_account = self.get_account(from_account_id)
         to_account = self.get_account(to_account_id)
 
-        if amount <= 0:
-            raise ValidationError("Transfer amount must be greater than zero.")
-        
-        fee = amount * FEE_PERCENTAGE
-        net_amount = amount + fee
-        if net_amount <= 0:
-            raise ValidationError("Transfer amount after fee must be greater than zero.")
+        from_balance, to_balance = self.transfer(from_account, to_account, amount, currency)
+        return Response({'from_balance': from_balance, 'to_balance': to_balance})
 
-        if currency != from_account.currency:
-            net_amount = convert_currency(net_amount, currency, from_account.currency)
+@extend_schema(tags=['Bank account'])
+class BatchTransferView(TransferView):
+    serializer_class = BatchTransferSerializer
 
-        if from_account.balance - amount < -1000:  # Change -1000 to your desired overdraft limit
-            raise ValidationError("Insufficient funds for transfer.")
+    # Validates the whole batch up front, then applies every transfer in one DB transaction.
+    # Transfers that fail (unknown account, insufficient funds) are reported and skipped, the rest are applied.
+    @idempotent
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = atomic_with_retry(self.apply_batch, serializer.validated_data['transfers'])
+        return Response({'results': results})
 
-        from_account.balance -= net_amount
-        to_account.balance += amount
+    def apply_batch(self, transfers):
+        account_ids = {item['from_account_id'] for item in transfers} | {item['to_account_id'] for item in transfers}
+        accounts = lock_accounts(account_ids)  # One query for every account in the batch
+        starting_balances = {pk: account.balance for pk, account in accounts.items()}
+        ledger = []
+        results = []
 
-        from_account.save()
-        to_account.save()
+        for index, item in enumerate(transfers):
+            from_account = accounts.get(item['from_account_id'])
+            to_account = accounts.get(item['to_account_id'])
+            try:
+                if from_account is None or to_account is None:
+                    raise ValidationError("Account not found.")
 
-        Transaction.objects.create(account=from_account, amount=net_amount, transaction_type='transfer', currency=from_account.currency)
-        Transaction.objects.create(account=to_account, amount=amount, transaction_type='transfer', currency=to_account.currency)
+                amount = item['amount']
+                net_amount = self.get_debit_amount(amount, item.get('currency', from_account.currency), from_account)
+                net_amount = net_amount.quantize(CENT)
+                if from_account.balance - net_amount < OVERDRAFT_LIMIT:
+                    raise ValidationError("Insufficient funds for transfer.")
+            except ValidationError as e:
+                results.append({'index': index, 'status': 'failed', 'detail': e.detail[0]})
+                continue
 
-        return Response({'from_balance': from_account.balance, 'to_balance': to_account.balance})
+            from_account.balance -= net_amount
+            ledger.append(Transaction(
+                account=from_account, amount=net_amount, transaction_type='transfer', currency=from_account.currency,
+                signed_amount=-net_amount, balance_after=from_account.balance
+            ))
+            to_account.balance += amount
+            ledger.append(Transaction(
+                account=to_account, amount=amount, transaction_type='transfer', currency=to_account.currency,
+                signed_amount=amount, balance_after=to_account.balance
+            ))
+            results.append({
+                'index': index,
+                'status': 'completed',
+                'from_balance': from_account.balance,
+                'to_balance': to_account.balance
+            })
+
+        # Write each account's net change once, however many transfers touched it
+        changed = [account for pk, account in accounts.items() if account.balance != starting_balances[pk]]
+        BankAccount.objects.bulk_update(changed, ['balance'], batch_size=BATCH_WRITE_SIZE)
+        Transaction.objects.bulk_create(ledger, batch_size=BATCH_WRITE_SIZE)
+        # Counted once the batch commits: an attempt that is rolled back and retried drops its callback
+        credits = [(entry.currency, float(entry.amount)) for entry in ledger if entry.signed_amount > 0]
+        transaction.on_commit(lambda: record_transfers(credits))
+        return results
+
+def record_transfers(credits):
+    for currency, amount in credits:
+        instruments.transfers.inc(currency)
+        instruments.transferred.inc(currency, amount=amount)
 
 @extend_schema(tags=['Bank account']) 
 class SuspendAccountView(AccountMixin, generics.UpdateAPIView):
@@ -136,12 +274,129 @@ class CloseAccountView(generics.DestroyAPIView):
         account.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-@extend_schema(tags=['Bank account'])    
-class UserTransactionsView(generics.ListAPIView):
+@extend_schema(tags=['Bank account'], parameters=TRANSACTION_FILTER_PARAMETERS)
+class UserTransactionsView(ConditionalListMixin, TransactionFilterMixin, generics.ListAPIView):
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = TransactionCursorPagination
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
 
     def get_queryset(self):
         # Get the user's bank accounts and then filter transactions
         user_accounts = BankAccount.objects.filter(user=self.request.user)
-        return Transaction.objects.filter(account__in=user_accounts).order_by('-timestamp')
\ No newline at end of file
+        queryset = Transaction.objects.filter(account__in=user_accounts)
+        return self.filter_transactions(queryset).order_by('-timestamp', '-id')
+
+    # The page is read as plain rows and rendered by transaction_rows, to the same JSON as TransactionSerializer
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(transaction_rows.values(self.get_queryset()))
+        return self.get_paginated_response(transaction_rows.to_representation(page))
+
+@extend_schema(tags=['Bank account'], parameters=[
+    OpenApiParameter('account', int, description='Only this account'),
+    OpenApiParameter('start', str, description='First month, YYYY-MM, inclusive'),
+    OpenApiParameter('end', str, description='Last month, YYYY-MM, inclusive'),
+])
+class ActivitySummaryView(generics.ListAPIView):
+    serializer_class = MonthlyActivitySerializer
+    permission_classes = [IsAuthenticated]
+
+    # Reads the summary table, so the cost grows with the number of months, not of transactions
+    def get_queryset(self):
+        queryset = MonthlyActivity.objects.filter(account__user=self.request.user)
+        params = self.request.query_params
+        if params.get('account'):
+            try:
+                queryset = queryset.filter(account_id=int(params['account']))
+            except ValueError:
+                raise ValidationError({'account': "Must be an account id."})
+        if params.get('start'):
+            queryset = queryset.filter(month__gte=self.parse_month('start', params['start']))
+        if params.get('end'):
+            queryset = queryset.filter(month__lte=self.parse_month('end', params['end']))
+        return queryset.order_by('account', 'month', 'transaction_type')
+
+    def parse_month(self, name, value):
+        try:
+            return datetime.strptime(value, '%Y-%m').date()
+        except ValueError:
+            raise ValidationError({name: "Must be a month, YYYY-MM."})
+
+    # One entry per account and month, with the count and totals of each transaction type in it
+    def list(self, request):
+        summary = {}
+        for row in self.get_serializer(self.get_queryset(), many=True).data:
+            entry = summary.setdefault((row['account'], row['month']), {'account': row['account'], 'month': row['month']})
+            entry[row['transaction_type']] = {'count': row['count'], 'total': row['total'], 'net': row['net']}
+        return Response(list(summary.values()))
+
+@extend_schema(tags=['Bank account'], parameters=[
+    OpenApiParameter('at', str, description='ISO 8601 date or datetime, defaults to now'),
+])
+class BalanceAtView(TransactionFilterMixin, generics.GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        try:
+            account = BankAccount.objects.get(pk=pk, user=request.user)
+        except BankAccount.DoesNotExist:
+            raise NotFound("Account not found.")
+
+        at = request.query_params.get('at')
+        timestamp = self.parse_timestamp('at', at) if at else timezone.now()
+        return Response({'account': account.pk, 'at': timestamp, 'balance': account.balance_at(timestamp)})
+
+# Lets csv.writer format one row at a time into a string instead of a file
+class Echo:
+    def write(self, value):
+        return value
+
+@extend_schema(tags=['Bank account'], parameters=TRANSACTION_FILTER_PARAMETERS)
+class StatementExportView(TransactionFilterMixin, generics.GenericAPIView):
+    permission_classes = [IsAuthenticated]
+    content_types = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+    # Streams the statement oldest first. Rows are read as tuples straight off the DB cursor and
+    # written out in small batches, so memory stays flat however long the statement is.
+    def get(self, request, export_format):
+        if export_format not in self.content_types:
+            raise NotFound("Statement format must be csv or ndjson.")
+
+        user_accounts = BankAccount.objects.filter(user=request.user)
+        queryset = self.filter_transactions(Transaction.objects.filter(account__in=user_accounts))
+        rows = queryset.order_by('timestamp', 'id').values_list(
+            'id', 'account_id', 'amount', 'transaction_type', 'currency', 'timestamp'
+        ).iterator(chunk_size=STATEMENT_CHUNK_SIZE)
+
+        render = self.render_csv if export_format == 'csv' else self.render_ndjson
+        response = StreamingHttpResponse(render(rows), content_type=self.content_types[export_format])
+        response['Content-Disposition'] = f'attachment; filename="statement.{export_format}"'
+        return response
+
+    def render_csv(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(STATEMENT_FIELDS)
+        for batch in self.batched(rows):
+            yield ''.join(
+                writer.writerow([pk, account, amount, transaction_type, currency, timestamp.isoformat()])
+                for pk, account, amount, transaction_type, currency, timestamp in batch
+            )
+
+    def render_ndjson(self, rows):
+        for batch in self.batched(rows):
+            yield ''.join(
+                json.dumps(dict(zip(STATEMENT_FIELDS, (
+                    pk, account, str(amount), transaction_type, currency, timestamp.isoformat()
+                )))) + '\n'
+                for pk, account, amount, transaction_type, currency, timestamp in batch
+            )
+
+    def batched(self, rows, size=500):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
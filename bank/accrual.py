@@ -0,0 +1,52 @@
+from django.db import connection
+from account.models import IngestCheckpoint
+from account.transfers import atomic_with_retry
+from .amortization import daily_interest
+from .models import Loan
+
+ACCRUAL_FIELDS = ['amount', 'accrued_interest', 'interest_accrued_through']
+
+# Accrue interest through the given date on the outstanding loans with ids in [first_id, last_id],
+# 'chunk_size' loans per DB transaction. Progress is checkpointed in the same transaction as each
+# chunk, so a run that stopped resumes after the last committed chunk. A loan already accrued
+# through the date is skipped, so running the same date twice never charges twice.
+# Returns the number of loans that accrued interest.
+def accrue_range(through, first_id, last_id, chunk_size):
+    source = f'accrue_interest:{through.isoformat()}:{first_id}-{last_id}'
+    checkpoint, _ = IngestCheckpoint.objects.get_or_create(source=source)
+    position = max(checkpoint.offset, first_id - 1)  # Id of the last loan looked at
+    accrued = 0
+    while position < last_id:
+        count, position = atomic_with_retry(accrue_chunk, through, position, last_id, chunk_size, checkpoint)
+        accrued += count
+    return accrued
+
+def accrue_chunk(through, after_id, last_id, chunk_size, checkpoint):
+    queryset = (
+        Loan.objects.filter(pk__gt=after_id, pk__lte=last_id, is_paid=False, amount__gt=0)
+        .only('pk', 'user', 'amount', 'annual_rate', 'granted_at', 'accrued_interest', 'interest_accrued_through')
+        .order_by('pk')
+    )
+    if connection.features.has_select_for_update:
+        queryset = queryset.select_for_update()  # A repayment can't slip in between the read and bulk_update
+    loans = list(queryset[:chunk_size])
+    position = loans[-1].pk if len(loans) == chunk_size else last_id
+
+    # Days owed by each loan: since the last accrual, or since the day it was granted
+    due = []
+    for loan in loans:
+        since = loan.interest_accrued_through or loan.granted_at.date()
+        if since < through:
+            due.append((loan, (through - since).days))
+
+    interest = daily_interest([loan.amount for loan, _ in due], [loan.annual_rate for loan, _ in due], [days for _, days in due])
+    for (loan, _), charge in zip(due, interest):
+        loan.amount += charge
+        loan.accrued_interest += charge
+        loan.interest_accrued_through = through
+    Loan.objects.bulk_update([loan for loan, _ in due], ACCRUAL_FIELDS, batch_size=1000)
+
+    checkpoint.offset = position
+    checkpoint.records += len(due)
+    checkpoint.save(update_fields=['offset', 'records', 'updated_at'])
+    return len(due), position
@@ -0,0 +1,145 @@
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+
+CENT = Decimal('0.01')
+DAYS_PER_YEAR = 365
+ROUNDING = ROUND_HALF_UP  # Used for every rounding to the cent, by both the NumPy and the Decimal path
+RATE_UNIT = Decimal('0.0001')  # Loan.annual_rate has 4 decimal places, so rates are whole numbers of this
+RATE_SCALE = 10000  # RATE_UNIT per 1
+INT64_MAX = 2 ** 63 - 1
+
+class Schedules:
+    # Amortization schedules of many loans, as loan x month tables of payment, interest, principal
+    # and the balance left after each payment. Months past a loan's term hold zeros.
+    def __init__(self, payment, interest, principal, balance, terms):
+        self.payment, self.interest, self.principal, self.balance = payment, interest, principal, balance
+        self.terms = terms
+
+    # The schedule of the loan at 'index', as one dict per monthly payment
+    def rows(self, index):
+        return [
+            {
+                'month': month + 1,
+                'payment': to_decimal(self.payment[index][month]),
+                'interest': to_decimal(self.interest[index][month]),
+                'principal': to_decimal(self.principal[index][month]),
+                'balance': to_decimal(self.balance[index][month]),
+            }
+            for month in range(int(self.terms[index]))
+        ]
+
+# Array values are whole cents
+def to_decimal(value):
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(int(value)).scaleb(-2)
+
+# Fixed monthly payment schedules for many loans at once. Each month's interest is rounded half up
+# to the cent and the last payment clears what is left, so every row adds up exactly. The work loops
+# over months, at most the longest term, with each step done for every loan together.
+def amortize(principals, annual_rates, terms):
+    schedules = _amortize_arrays(principals, annual_rates, terms)
+    if schedules is not None:
+        return schedules
+    return _amortize_decimals(principals, annual_rates, terms)
+
+def monthly_payment(principal, annual_rate, term):
+    rate = annual_rate / 12
+    if rate == 0:
+        return (principal / max(term, 1)).quantize(CENT, rounding=ROUNDING)
+    return (principal * rate / (1 - (1 + rate) ** -term)).quantize(CENT, rounding=ROUNDING)
+
+# The arrays hold whole cents and rates in units of RATE_UNIT, so interest is an exact integer
+# fraction rounded the same way as the Decimal path. Returns None for inputs that don't fit,
+# which are left to the Decimal path.
+def _amortize_arrays(principals, annual_rates, terms):
+    principals = [Decimal(p) for p in principals]
+    annual_rates = [Decimal(r) for r in annual_rates]
+    cents, rate_units = whole_units(principals, CENT), whole_units(annual_rates, RATE_UNIT)
+    if cents is None or rate_units is None or not fits_int64(cents, rate_units):
+        return None
+
+    terms = np.asarray(terms, dtype=np.int64)
+    months = int(terms.max(initial=0))
+    payment = np.array(
+        [int(monthly_payment(p, r, int(n)) / CENT) for p, r, n in zip(principals, annual_rates, terms)],
+        dtype=np.int64,
+    )
+    rate = np.array(rate_units, dtype=np.int64)
+    denominator = 12 * RATE_SCALE
+
+    tables = {name: np.zeros((len(cents), months), dtype=np.int64) for name in ['payment', 'interest', 'principal', 'balance']}
+    balance = np.array(cents, dtype=np.int64)
+    for month in range(months):
+        active = month < terms
+        interest = divide_half_up(balance * rate, denominator)
+        repaid = np.where(month == terms - 1, balance, np.minimum(payment - interest, balance))
+        balance = np.where(active, balance - repaid, 0)
+        tables['interest'][:, month] = np.where(active, interest, 0)
+        tables['principal'][:, month] = np.where(active, repaid, 0)
+        tables['payment'][:, month] = np.where(active, interest + repaid, 0)
+        tables['balance'][:, month] = balance
+    return Schedules(terms=terms, **tables)
+
+def _amortize_decimals(principals, annual_rates, terms):
+    principals = [Decimal(p) for p in principals]
+    annual_rates = [Decimal(r) for r in annual_rates]
+    terms = [int(n) for n in terms]
+    months = max(terms, default=0)
+    payments = [monthly_payment(p, r, n) for p, r, n in zip(principals, annual_rates, terms)]
+
+    tables = {name: [[Decimal(0)] * months for _ in principals] for name in ['payment', 'interest', 'principal', 'balance']}
+    balances = list(principals)
+    for month in range(months):
+        for i, (annual_rate, term) in enumerate(zip(annual_rates, terms)):
+            if month >= term:
+                continue
+            # Divided last, so a result of exactly half a cent is exact before it is rounded
+            interest = (balances[i] * annual_rate / 12).quantize(CENT, rounding=ROUNDING)
+            repaid = balances[i] if month == term - 1 else min(payments[i] - interest, balances[i])
+            balances[i] -= repaid
+            tables['interest'][i][month] = interest
+            tables['principal'][i][month] = repaid
+            tables['payment'][i][month] = interest + repaid
+            tables['balance'][i][month] = balances[i]
+    return Schedules(terms=terms, **tables)
+
+# Simple daily interest on many balances at once: amount * annual rate * days / 365, rounded half up to the cent
+def daily_interest(amounts, annual_rates, days):
+    interest = _daily_interest_arrays(amounts, annual_rates, days)
+    if interest is not None:
+        return interest
+    return _daily_interest_decimals(amounts, annual_rates, days)
+
+# Returns None for inputs that don't fit, like _amortize_arrays
+def _daily_interest_arrays(amounts, annual_rates, days):
+    cents, rate_units = whole_units(amounts, CENT), whole_units(annual_rates, RATE_UNIT)
+    if cents is None or rate_units is None or not fits_int64(cents, rate_units, days):
+        return None
+    numerator = np.array(cents, dtype=np.int64) * np.array(rate_units, dtype=np.int64) * np.asarray(days, dtype=np.int64)
+    return [to_decimal(value) for value in divide_half_up(numerator, DAYS_PER_YEAR * RATE_SCALE)]
+
+def _daily_interest_decimals(amounts, annual_rates, days):
+    return [
+        (Decimal(amount) * Decimal(rate) * day / DAYS_PER_YEAR).quantize(CENT, rounding=ROUNDING)
+        for amount, rate, day in zip(amounts, annual_rates, days)
+    ]
+
+# The values as whole numbers of 'unit', or None if any of them isn't one
+def whole_units(values, unit):
+    scaled = [Decimal(value) / unit for value in values]
+    if any(value != value.to_integral_value() for value in scaled):
+        return None
+    return [int(value) for value in scaled]
+
+# Whether the product of the largest factors stays within int64, with room to double it for the rounding
+def fits_int64(*factors):
+    product = 1
+    for values in factors:
+        product *= max((abs(int(value)) for value in values), default=0)
+    return product <= INT64_MAX // 4
+
+# numerator / denominator rounded half up, away from zero for negative values like Decimal's ROUND_HALF_UP
+def divide_half_up(numerator, denominator):
+    magnitude = (2 * np.abs(numerator) + denominator) // (2 * denominator)
+    return np.where(numerator < 0, -magnitude, magnitude)
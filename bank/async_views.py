@@ -0,0 +1,11 @@
+from rest_framework.response import Response
+from account.async_views import AsyncAPIView
+from .models import Loan
+from .serializers import LoanSerializer
+
+class AsyncCustomerLoansView(AsyncAPIView):
+    authentication_required = True
+
+    async def get(self, request):
+        loans = [loan async for loan in Loan.objects.filter(user=request.user)]
+        return Response(LoanSerializer(loans, many=True).data)
@@ -0,0 +1,62 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max, Min
+from django.utils import timezone
+from bank.accrual import accrue_range
+from bank.pool import init_worker
+from bank.models import Loan
+
+class Command(BaseCommand):
+    help = (
+        "Accrue daily interest on outstanding loans through a date, in chunks, optionally split by id "
+        "range across a process pool. Progress is checkpointed per chunk, so an interrupted run picks up "
+        "where it stopped when run again for the same date. Meant to run nightly, for example from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Accrue through this day, YYYY-MM-DD (default: today)")
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Loans per DB transaction")
+        parser.add_argument('--workers', type=int, default=1, help="Processes, each taking an equal range of loan ids")
+
+    def handle(self, *args, **options):
+        try:
+            through = date.fromisoformat(options['date']) if options['date'] else timezone.localdate()
+        except ValueError:
+            raise CommandError("--date must be YYYY-MM-DD.")
+        if options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError("--chunk-size and --workers must be at least 1.")
+
+        bounds = Loan.objects.filter(is_paid=False).aggregate(first=Min('pk'), last=Max('pk'))
+        if bounds['first'] is None:
+            self.stdout.write(self.style.SUCCESS("No outstanding loans"))
+            return
+
+        started = time.perf_counter()
+        ranges = self.split(bounds['first'], bounds['last'], options['workers'])
+        if len(ranges) == 1:
+            accrued = accrue_range(through, *ranges[0], options['chunk_size'])
+        else:
+            # Spawned rather than forked, so no worker inherits this process's open DB connections
+            names = {alias: connections[alias].settings_dict['NAME'] for alias in connections}
+            with ProcessPoolExecutor(
+                max_workers=len(ranges),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(names,),
+            ) as executor:
+                futures = [executor.submit(accrue_range, through, first, last, options['chunk_size']) for first, last in ranges]
+                accrued = sum(future.result() for future in futures)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Accrued interest through {through} on {accrued} loans in {elapsed:.1f}s"
+        ))
+
+    # Split [first, last] into up to 'parts' contiguous id ranges of about the same size
+    def split(self, first, last, parts):
+        size = -(-(last - first + 1) // parts)
+        return [(start, min(start + size - 1, last)) for start in range(first, last + 1, size)]
@@ -0,0 +1,29 @@
+from decimal import Decimal
+from django.db import migrations
+from django.db.models import Sum
+
+RESERVE_ID = 1
+# The balance GrantLoanView used to assume, before loans were taken from a stored reserve
+STARTING_RESERVE = Decimal('10000000')
+
+
+def seed_reserve(apps, schema_editor):
+    BankReserve = apps.get_model('bank', 'BankReserve')
+    Loan = apps.get_model('bank', 'Loan')
+    db = schema_editor.connection.alias
+    # Loans granted so far were never taken from the reserve, so take what is still owed on them now
+    outstanding = Loan.objects.using(db).aggregate(total=Sum('amount'))['total'] or 0
+    BankReserve.objects.using(db).get_or_create(
+        pk=RESERVE_ID, defaults={'balance': max(STARTING_RESERVE - outstanding, 0)}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank', '0003_bankreserve'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_reserve, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def set_principal(apps, schema_editor):
+    # The amount still owed is the best record left of what earlier loans were granted for
+    Loan = apps.get_model('bank', 'Loan')
+    Loan.objects.using(schema_editor.connection.alias).update(principal=F('amount'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank', '0004_seed_bank_reserve'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loan',
+            name='principal',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(set_principal, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='loan',
+            name='principal',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+        # Loans granted before rates existed carry none
+        migrations.AddField(
+            model_name='loan',
+            name='annual_rate',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=6),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='term_months',
+            field=models.PositiveSmallIntegerField(default=12),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='granted_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='accrued_interest',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='interest_accrued_through',
+            field=models.DateField(null=True),
+        ),
+        # loan_user_paid_idx starts with user_id, so it serves the user lookups on its own
+        migrations.AlterField(
+            model_name='loan',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
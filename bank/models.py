@@ -1,8 +1,82 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
 from users.models import User
-from account.models import BankAccount
+from account.models import BankAccount, DataVersion
+
+RESERVE_ID = 1 # Primary key of the single BankReserve row
+
+class BankReserveManager(models.Manager):
+    # Take 'amount' from the reserve with a single conditional UPDATE, which only applies if the
+    # reserve covers it. Concurrent callers can't overdraw it. Returns whether the amount was taken.
+    def take(self, amount):
+        return bool(self.filter(pk=RESERVE_ID, balance__gte=amount).update(balance=F('balance') - amount))
+
+    def put_back(self, amount):
+        self.filter(pk=RESERVE_ID).update(balance=F('balance') + amount)
+
+class BankReserve(models.Model):
+    # The funds the bank has left to lend, kept in a single row. Granted loans are taken from it
+    # and repayments go back into it.
+    balance = models.DecimalField(max_digits=15, decimal_places=2)
+    objects = BankReserveManager()
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(condition=models.Q(balance__gte=0), name='bank_reserve_not_negative'),
+        ]
+
+class LoanManager(models.Manager):
+    # Decrease the outstanding amount of the user's loan with a single conditional UPDATE, which
+    # only applies if the amount doesn't exceed what is owed, and marks the loan paid when it
+    # reaches zero. Returns whether the loan was updated.
+    def repay(self, pk, user, amount):
+        with transaction.atomic(using=self.db, savepoint=False):
+            updated = bool(self.filter(pk=pk, user=user, amount__gte=amount).update(
+                amount=F('amount') - amount,
+                # Compared with the amount before this repayment
+                is_paid=Case(When(amount=amount, then=Value(True)), default=F('is_paid')),
+            ))
+            if updated:
+                DataVersion.objects.bump([user.pk], using=self.db)
+        return updated
+
+    # Loans written in bulk bump their owners' data versions in the same DB transaction
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db, savepoint=False):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            DataVersion.objects.bump({loan.user_id for loan in objs}, using=self.db)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        with transaction.atomic(using=self.db, savepoint=False):
+            updated = super().bulk_update(objs, fields, *args, **kwargs)
+            DataVersion.objects.bump({loan.user_id for loan in objs}, using=self.db)
+        return updated
 
 class Loan(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    amount = models.DecimalField(max_digits=10, decimal_places=2)
-    is_paid = models.BooleanField(default=False)
\ No newline at end of file
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)  # Indexed by loan_user_paid_idx
+    amount = models.DecimalField(max_digits=10, decimal_places=2)  # Still owed, accrued interest included
+    is_paid = models.BooleanField(default=False)
+    principal = models.DecimalField(max_digits=10, decimal_places=2)  # Amount granted
+    annual_rate = models.DecimalField(max_digits=6, decimal_places=4, default=0)  # 0.0500 is 5% a year
+    term_months = models.PositiveSmallIntegerField(default=12)
+    granted_at = models.DateTimeField(default=timezone.now)
+    accrued_interest = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # Interest added to 'amount' so far
+    interest_accrued_through = models.DateField(null=True)  # Last day interest was accrued for, if any
+    objects = LoanManager()
+
+    class Meta:
+        indexes = [
+            # A customer's loans, optionally narrowed to paid or outstanding ones
+            models.Index(fields=['user', 'is_paid'], name='loan_user_paid_idx'),
+        ]
+
+    # A new loan is for the amount it starts owing, unless told otherwise. Any write bumps the
+    # owner's data version in the same DB transaction.
+    def save(self, *args, **kwargs):
+        if self.principal is None:
+            self.principal = self.amount
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+            DataVersion.objects.bump([self.user_id], using=self._state.db)
@@ -0,0 +1,10 @@
+import django
+from django.db import connections
+
+# Runs first in each worker of the accrue_interest process pool. Workers are spawned, so they set
+# up Django afresh, and then use the databases the command was using, test databases included.
+# Kept apart from the modules that import models, which can only be loaded once Django is set up.
+def init_worker(database_names):
+    django.setup()
+    for alias, name in database_names.items():
+        connections[alias].settings_dict['NAME'] = name
@@ -1,7 +1,18 @@
 from rest_framework import serializers
+from account.serializers import ValuesSerializer
 from .models import Loan
 
 class LoanSerializer(serializers.ModelSerializer):
     class Meta:
         model = Loan
-        fields = ['id', 'user', 'amount', 'is_paid']
\ No newline at end of file
+        fields = ['id', 'user', 'amount', 'is_paid', 'principal', 'annual_rate', 'term_months', 'accrued_interest']
+        read_only_fields = ['principal', 'annual_rate', 'term_months', 'accrued_interest']
+
+loan_rows = ValuesSerializer(LoanSerializer)
+
+class LoanScheduleSerializer(serializers.Serializer):
+    month = serializers.IntegerField()
+    payment = serializers.DecimalField(max_digits=12, decimal_places=2)
+    interest = serializers.DecimalField(max_digits=12, decimal_places=2)
+    principal = serializers.DecimalField(max_digits=12, decimal_places=2)
+    balance = serializers.DecimalField(max_digits=12, decimal_places=2)
\ No newline at end of file
@@ -1,7 +1,25 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import TransactionTestCase, tag
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APITestCase
-from .models import Loan, User, BankAccount
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APITestCase
+from account.models import IngestCheckpoint
+from benchmarks import driver
+from . import accrual, amortization
+from .amortization import amortize, daily_interest
+from .models import RESERVE_ID, BankReserve, Loan, User, BankAccount
+from .serializers import LoanSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
 
 class BankTests(APITestCase):
@@ -52,4 +70,298 @@ class BankTests(APITestCase):
         url = reverse('get-loans')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)  # Should return the existing loan
\ No newline at end of file
+        self.assertEqual(len(response.data), 1)  # Should return the existing loan
+
+    def test_loan_list_matches_serializer(self):
+        Loan.objects.create(user=self.user, amount=Decimal('1234.50'), principal=2000, annual_rate=Decimal('0.0525'), term_months=36)
+        Loan.objects.create(user=self.user, amount=0, is_paid=True, accrued_interest=Decimal('3.07'))
+        response = self.client.get(reverse('get-loans'))
+        expected = JSONRenderer().render(LoanSerializer(Loan.objects.filter(user=self.user), many=True).data)
+        self.assertEqual(response.content, expected)
+
+    def test_loan_list_conditional_get(self):
+        url = reverse('get-loans')
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries), 1)
+
+        BankReserve.objects.filter(pk=RESERVE_ID).update(balance=100000)
+        writes = [
+            lambda: self.client.post(self.loan_url, {'amount': 1000}, format='json'),
+            lambda: self.client.post(reverse('repay-loan', args=[self.loan.id]), {'amount': 500}, format='json'),
+            lambda: accrual.accrue_range(date(2099, 1, 1), self.loan.id, self.loan.id, 10),
+        ]
+        for write in writes:
+            write()
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.content, JSONRenderer().render(LoanSerializer(Loan.objects.filter(user=self.user), many=True).data))
+            etag = response['ETag']
+
+    def test_get_customer_loans_async(self):
+        response = self.client.get(reverse('get-loans-async'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), self.client.get(reverse('get-loans')).json())
+
+    def test_grant_takes_from_reserve(self):
+        BankReserve.objects.filter(pk=RESERVE_ID).update(balance=40000)
+        response = self.client.post(self.loan_url, {'amount': 30000}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(BankReserve.objects.get().balance, 10000)
+
+        response = self.client.post(self.loan_url, {'amount': 10001}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual((BankReserve.objects.get().balance, Loan.objects.count()), (10000, 2))
+
+    def test_repay_in_full_marks_paid_and_refills_reserve(self):
+        BankReserve.objects.filter(pk=RESERVE_ID).update(balance=0)
+        url = reverse('repay-loan', args=[self.loan.id])
+        response = self.client.post(url, {'amount': 15000}, format='json')
+        self.assertFalse(response.data['is_paid'])
+
+        response = self.client.post(url, {'amount': 5000}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((Decimal(response.data['amount']), response.data['is_paid']), (0, True))
+        self.assertEqual(BankReserve.objects.get().balance, 20000)
+
+        response = self.client.post(url, {'amount': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_repay_other_users_loan(self):
+        other_user = User.objects.create_user(email='other@example.com', username='other', password='testpassword')
+        other_loan = Loan.objects.create(user=other_user, amount=100)
+        response = self.client.post(reverse('repay-loan', args=[other_loan.id]), {'amount': 50}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class LoanConcurrencyTests(TransactionTestCase):
+    # Grants loans from many threads at once until the reserve runs out, while some borrowers repay
+    threads = 16
+    reserve = Decimal('1234567.00')
+
+    def setUp(self):
+        # TransactionTestCase empties the tables between tests, including the seeded reserve row
+        BankReserve.objects.update_or_create(pk=RESERVE_ID, defaults={'balance': self.reserve})
+        self.users = [
+            User.objects.create_user(email=f'borrower{i}@example.com', username=f'borrower{i}', password='testpassword')
+            for i in range(self.threads)
+        ]
+
+    def borrow(self, index):
+        rng = random.Random(index)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.users[index]).access_token))
+        granted, denied = [], 0
+        try:
+            while denied < 5:
+                amount = rng.randint(1000, 50000)
+                response = client.post(reverse('grant-loan'), {'amount': amount}, format='json')
+                if response.status_code == status.HTTP_201_CREATED:
+                    granted.append(response.data['id'])
+                    if rng.random() < 0.2:  # Repay part of a loan now and then, refilling the reserve
+                        response = client.post(reverse('repay-loan', args=[rng.choice(granted)]), {'amount': 500}, format='json')
+                        self.assertIn(response.status_code, [status.HTTP_200_OK, status.HTTP_400_BAD_REQUEST])
+                else:
+                    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                    denied += 1
+            return len(granted)
+        finally:
+            connection.close()
+
+    def test_parallel_grants_never_overdraw_the_reserve(self):
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            granted = sum(executor.map(self.borrow, range(self.threads)))
+
+        balance = BankReserve.objects.get().balance
+        owed = Loan.objects.aggregate(total=Sum('amount'))['total']
+        self.assertGreaterEqual(balance, 0)
+        self.assertLess(balance, 50000)  # Exhausted: the last denials were for lack of funds
+        self.assertEqual(balance + owed, self.reserve)
+        self.assertEqual(Loan.objects.count(), granted)
+
+
+class AmortizationTests(APITestCase):
+    def test_fixed_payment_schedule(self):
+        rows = amortize([Decimal('1000')], [Decimal('0.12')], [12]).rows(0)
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(rows[0], {
+            'month': 1, 'payment': Decimal('88.85'), 'interest': Decimal('10.00'),
+            'principal': Decimal('78.85'), 'balance': Decimal('921.15'),
+        })
+        self.assertEqual(rows[-1]['balance'], 0)
+        self.assertEqual(sum(row['principal'] for row in rows), 1000)
+        for row in rows:
+            self.assertEqual(row['payment'], row['interest'] + row['principal'])
+
+    def test_zero_rate_splits_principal_evenly(self):
+        rows = amortize([Decimal('100')], [Decimal('0')], [3]).rows(0)
+        self.assertEqual([row['payment'] for row in rows], [Decimal('33.33'), Decimal('33.33'), Decimal('33.34')])
+        self.assertEqual(sum(row['interest'] for row in rows), 0)
+
+    def test_many_loans_at_once_match_one_at_a_time(self):
+        rng = random.Random(7)
+        loans = [
+            (Decimal(rng.randint(100, 5000000)) / 100, Decimal(rng.randint(0, 2500)) / 10000, rng.randint(1, 60))
+            for _ in range(50)
+        ]
+        schedules = amortize(*zip(*loans))
+        for index, loan in enumerate(loans):
+            self.assertEqual(schedules.rows(index), amortize(*zip(loan)).rows(0))
+
+    # Fixed values for the Decimal path, which takes the inputs the arrays can't hold
+    def test_decimal_path_rounds_half_cents_up(self):
+        schedules = amortization._amortize_decimals(
+            [Decimal('125'), Decimal('1000')], [Decimal('0.0120'), Decimal('0.1200')], [1, 12]
+        )
+        self.assertEqual(schedules.rows(0), [{
+            'month': 1, 'payment': Decimal('125.13'), 'interest': Decimal('0.13'),  # 0.125 rounds up
+            'principal': Decimal('125'), 'balance': Decimal('0'),
+        }])
+        self.assertEqual(
+            [row['interest'] for row in schedules.rows(1)],
+            [Decimal(value) for value in ['10.00', '9.21', '8.42', '7.61', '6.80', '5.98', '5.15', '4.31', '3.47', '2.61', '1.75', '0.88']],
+        )
+        self.assertEqual(schedules.rows(1)[-1]['payment'], Decimal('88.84'))
+
+        self.assertEqual(
+            amortization._daily_interest_decimals(
+                [Decimal('36.50'), Decimal('109.50')], [Decimal('0.0500'), Decimal('0.0500')], [1, 1]
+            ),
+            [Decimal('0.01'), Decimal('0.02')],  # 0.005 and 0.015 both round up
+        )
+
+    def test_arrays_agree_with_decimals(self):
+        rng = random.Random(11)
+        loans = [
+            (Decimal(rng.randint(100, 5000000)) / 100, Decimal(rng.randint(0, 2500)) / 10000, rng.randint(1, 360))
+            for _ in range(200)
+        ] + [(Decimal('125'), Decimal('0.0120'), 1)]
+        arrays = amortization._amortize_arrays(*zip(*loans))
+        decimals = amortization._amortize_decimals(*zip(*loans))
+        for index in range(len(loans)):
+            self.assertEqual(arrays.rows(index), decimals.rows(index))
+
+        amounts = [Decimal(rng.randint(0, 5000000)) / 100 for _ in range(500)] + [Decimal('36.50')]
+        rates = [Decimal(rng.randint(0, 2500)) / 10000 for _ in amounts]
+        days = [rng.randint(1, 90) for _ in amounts]
+        expected = amortization._daily_interest_decimals(amounts, rates, days)
+        self.assertEqual(amortization._daily_interest_arrays(amounts, rates, days), expected)
+        self.assertEqual(daily_interest(amounts, rates, days), expected)
+
+    # Rates finer than Loan.annual_rate can't be held as whole units, so the Decimal path takes them
+    def test_inputs_that_do_not_fit_fall_back_to_decimals(self):
+        self.assertIsNone(amortization.whole_units([Decimal('0.00005')], amortization.RATE_UNIT))
+        self.assertEqual(amortization.whole_units([Decimal('0.0525')], amortization.RATE_UNIT), [525])
+        self.assertFalse(amortization.fits_int64([10 ** 10], [10 ** 6], [10 ** 4]))
+        self.assertTrue(amortization.fits_int64([10 ** 10], [10 ** 4], [365]))
+        rows = amortize([Decimal('1000')], [Decimal('0.00005')], [2]).rows(0)
+        self.assertEqual(sum(row['principal'] for row in rows), 1000)
+
+    @tag('benchmark')
+    def test_benchmark_amortize_many_loans(self):
+        rng = random.Random(3)
+        count = 2000
+        loans = [(Decimal(rng.randint(1000, 50000)), Decimal('0.05'), rng.choice([12, 24, 36, 60])) for _ in range(count)]
+        started = time.perf_counter()
+        schedules = amortize(*zip(*loans))
+        together = time.perf_counter() - started
+        started = time.perf_counter()
+        one_at_a_time = [amortize(*zip(loan)) for loan in loans]
+        one_by_one = time.perf_counter() - started
+
+        for index, loan in enumerate(loans):
+            rows = schedules.rows(index)
+            self.assertEqual(rows, one_at_a_time[index].rows(0))
+            self.assertEqual(sum(row['principal'] for row in rows), loan[0])
+        driver.report('amortize_many_loans', loans=count, together_s=round(together, 3), one_at_a_time_s=round(one_by_one, 3))
+
+
+class LoanScheduleTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='test@example.com', password='testpassword')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.user).access_token))
+
+    def test_grant_with_term_and_get_schedule(self):
+        response = self.client.post(reverse('grant-loan'), {'amount': 12000, 'term_months': 24}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['term_months'], 24)
+        self.assertEqual(Decimal(response.data['annual_rate']), Decimal('0.05'))
+
+        response = self.client.get(reverse('loan-schedule', args=[response.data['id']]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 24)
+        self.assertEqual(Decimal(response.data[-1]['balance']), 0)
+        self.assertEqual(sum(Decimal(row['principal']) for row in response.data), 12000)
+
+    def test_invalid_term(self):
+        response = self.client.post(reverse('grant-loan'), {'amount': 1000, 'term_months': 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('term_months', response.data)
+
+    def test_other_users_schedule(self):
+        other = User.objects.create_user(email='other@example.com', username='other', password='testpassword')
+        loan = Loan.objects.create(user=other, amount=100)
+        response = self.client.get(reverse('loan-schedule', args=[loan.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AccrueInterestTests(TransactionTestCase):
+    # TransactionTestCase, so the command's process pool workers see the loans
+    granted = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+    through = date(2026, 1, 31)
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='test@example.com', password='testpassword')
+        Loan.objects.bulk_create([
+            Loan(user=self.user, amount=36500, principal=36500, annual_rate=Decimal('0.05'), granted_at=self.granted)
+            for _ in range(10)
+        ])
+        self.paid = Loan.objects.create(user=self.user, amount=0, is_paid=True, annual_rate=Decimal('0.05'), granted_at=self.granted)
+
+    def accrue(self, *args):
+        call_command('accrue_interest', '--date', self.through.isoformat(), '--chunk-size', '3', *args, stdout=StringIO())
+
+    def assertAccruedOnce(self):
+        for loan in Loan.objects.filter(is_paid=False):
+            self.assertEqual(loan.accrued_interest, Decimal('150.00'))  # 30 days of 5 a day
+            self.assertEqual(loan.amount, Decimal('36650.00'))
+            self.assertEqual(loan.interest_accrued_through, self.through)
+        self.assertEqual(Loan.objects.get(pk=self.paid.pk).accrued_interest, 0)
+
+    def test_accrues_and_is_idempotent(self):
+        self.accrue()
+        self.accrue()
+        self.assertAccruedOnce()
+
+    def test_resumes_from_checkpoint(self):
+        chunks = []
+        accrue_chunk = accrual.accrue_chunk
+        def fail_on_third(*args):
+            if len(chunks) == 2:
+                raise RuntimeError("Interrupted")
+            chunks.append(args)
+            return accrue_chunk(*args)
+
+        with mock.patch('bank.accrual.accrue_chunk', side_effect=fail_on_third):
+            with self.assertRaises(RuntimeError):
+                self.accrue()
+        self.assertEqual(Loan.objects.filter(interest_accrued_through=self.through).count(), 6)
+        self.assertEqual(IngestCheckpoint.objects.get().records, 6)
+
+        self.accrue()
+        self.assertAccruedOnce()
+        self.assertEqual(IngestCheckpoint.objects.get().records, 10)
+
+    def test_later_run_accrues_only_new_days(self):
+        self.accrue()
+        call_command('accrue_interest', '--date', '2026-02-10', stdout=StringIO())
+        loan = Loan.objects.filter(is_paid=False).first()
+        self.assertEqual(loan.interest_accrued_through, date(2026, 2, 10))
+        self.assertEqual(loan.accrued_interest, Decimal('150.00') + Decimal('50.21'))  # 10 days on 36650
+
+    def test_process_pool(self):
+        self.accrue('--workers', '2')
+        self.assertAccruedOnce()
+        self.assertEqual(IngestCheckpoint.objects.count(), 2)
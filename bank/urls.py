@@ -1,8 +1,11 @@
 from django.urls import path
-from .views import GrantLoanView, LoanRepaymentView, GetCustomerLoansView
+from .views import GrantLoanView, LoanRepaymentView, GetCustomerLoansView, LoanScheduleView
+from .async_views import AsyncCustomerLoansView
 
 urlpatterns = [
     path('loans/grant/', GrantLoanView.as_view(), name='grant-loan'),
     path('loans/repay/<int:pk>/', LoanRepaymentView.as_view(), name='repay-loan'),
+    path('loans/<int:pk>/schedule/', LoanScheduleView.as_view(), name='loan-schedule'),
     path('loans/', GetCustomerLoansView.as_view(), name='get-loans'),
+    path('loans/async/', AsyncCustomerLoansView.as_view(), name='get-loans-async'),
 ]
\ No newline at end of file
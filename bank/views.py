@@ -1,48 +1,102 @@
+from decimal import Decimal, InvalidOperation
 from rest_framework import generics, status
 from rest_framework.response import Response
-from rest_framework.exceptions import NotFound
-from .models import Loan
-from .serializers import LoanSerializer
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.renderers import BrowsableAPIRenderer
+from account.conditional import ConditionalListMixin
+from account.renderers import FastJSONRenderer
+from account.transfers import atomic_with_retry
+from .amortization import amortize
+from .models import BankReserve, Loan
+from .serializers import LoanSerializer, LoanScheduleSerializer, loan_rows
 from drf_spectacular.utils import extend_schema
+from metrics import instruments
+
+MAX_LOAN_AMOUNT = Decimal('50000') # Largest loan granted in one request
+ANNUAL_RATE = Decimal('0.05') # Yearly interest on new loans
+MAX_TERM_MONTHS = 360 # Longest repayment term offered
+
+def get_amount(request):
+    try:
+        return Decimal(str(request.data.get('amount', 0)))
+    except InvalidOperation:
+        raise ValidationError({'amount': "Must be a number."})
+
+def get_term(request):
+    try:
+        term = int(request.data.get('term_months', 12))
+    except (TypeError, ValueError):
+        raise ValidationError({'term_months': "Must be a whole number of months."})
+    if not 1 <= term <= MAX_TERM_MONTHS:
+        raise ValidationError({'term_months': f"Must be between 1 and {MAX_TERM_MONTHS}."})
+    return term
 
 @extend_schema(tags=['Bank'])
 class GrantLoanView(generics.CreateAPIView):
     serializer_class = LoanSerializer
 
     def post(self, request):
-        bank_balance = 10000000  # Starting balance (replace with actual balance retrieval)
-        amount = request.data.get('amount')
-        if amount > 50000 or bank_balance < amount:
+        amount = get_amount(request)
+        term = get_term(request)
+        if amount <= 0 or amount > MAX_LOAN_AMOUNT:
             return Response({'detail': 'Loan request denied'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        loan = Loan.objects.create(user=request.user, amount=amount)
+
+        loan = atomic_with_retry(self.grant, request.user, amount, term)
+        if loan is None:
+            return Response({'detail': 'Loan request denied'}, status=status.HTTP_400_BAD_REQUEST)
+        instruments.loans.inc()
+        instruments.lent.inc(amount=float(amount))
         return Response(LoanSerializer(loan).data, status=status.HTTP_201_CREATED)
 
+    # The funds are taken from the reserve and the loan created in one DB transaction
+    def grant(self, user, amount, term):
+        if not BankReserve.objects.take(amount):
+            return None
+        return Loan.objects.create(user=user, amount=amount, principal=amount, annual_rate=ANNUAL_RATE, term_months=term)
+
 @extend_schema(tags=['Bank'])
 class LoanRepaymentView(generics.UpdateAPIView):
     serializer_class = LoanSerializer
 
     def post(self, request, pk):
-        try:
-            loan = Loan.objects.get(pk=pk, user=request.user)
-        except Loan.DoesNotExist:
-            raise NotFound("Loan not found or you do not have permission to access it.")
-
-        repayment_amount = request.data.get('amount')
+        repayment_amount = get_amount(request)
         if repayment_amount <= 0:
             return Response({'detail': 'Repayment amount must be greater than zero.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if repayment_amount > loan.amount:
+        if not atomic_with_retry(self.repay, pk, request.user, repayment_amount):
+            if not Loan.objects.filter(pk=pk, user=request.user).exists():
+                raise NotFound("Loan not found or you do not have permission to access it.")
             return Response({'detail': 'Repayment amount exceeds loan balance.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        loan.amount -= repayment_amount
-        loan.save()
+        return Response(LoanSerializer(Loan.objects.get(pk=pk)).data)
 
-        return Response(LoanSerializer(loan).data)
+    # The loan is decreased and the repayment returned to the reserve in one DB transaction
+    def repay(self, pk, user, amount):
+        if not Loan.objects.repay(pk, user, amount):
+            return False
+        BankReserve.objects.put_back(amount)
+        return True
 
 @extend_schema(tags=['Bank'])
-class GetCustomerLoansView(generics.ListAPIView):
+class GetCustomerLoansView(ConditionalListMixin, generics.ListAPIView):
     serializer_class = LoanSerializer
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
 
     def get_queryset(self):
-        return Loan.objects.filter(user=self.request.user)
\ No newline at end of file
+        return Loan.objects.filter(user=self.request.user)
+
+    # Read as plain rows and rendered by loan_rows, to the same JSON as LoanSerializer
+    def list(self, request, *args, **kwargs):
+        return Response(loan_rows.to_representation(loan_rows.values(self.get_queryset())))
+
+@extend_schema(tags=['Bank'])
+class LoanScheduleView(generics.RetrieveAPIView):
+    serializer_class = LoanScheduleSerializer
+
+    # The monthly payments that repay the loan's principal over its term at its rate
+    def get(self, request, pk):
+        loan = Loan.objects.filter(pk=pk, user=request.user).first()
+        if loan is None:
+            raise NotFound("Loan not found or you do not have permission to access it.")
+        schedule = amortize([loan.principal], [loan.annual_rate], [loan.term_months]).rows(0)
+        return Response(LoanScheduleSerializer(schedule, many=True).data)
@@ -0,0 +1,82 @@
+import logging
+import re
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Lists of placeholders, as in IN (%s, %s, %s), differ in length between otherwise identical queries
+PLACEHOLDER_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+
+class QueryStats:
+    # Execute wrapper timing every query of one request, grouped by SQL text. Queries are
+    # parameterized, so the text of a query repeated with different values doesn't change.
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.by_sql = {}  # SQL -> [times run, seconds]
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.time += elapsed
+            entry = self.by_sql.get(sql)
+            if entry is None:
+                self.by_sql[sql] = [1, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+
+    # Times run and seconds per query shape, most run first
+    def shapes(self):
+        shapes = {}
+        for sql, (count, elapsed) in self.by_sql.items():
+            entry = shapes.setdefault(PLACEHOLDER_LIST.sub('(...)', sql), [0, 0.0])
+            entry[0] += count
+            entry[1] += elapsed
+        return sorted(shapes.items(), key=lambda item: item[1][0], reverse=True)
+
+class QueryInstrumentationMiddleware:
+    # Counts and times each request's SQL queries and reports them in a Server-Timing header.
+    # Warns when one query shape runs SQL_INSTRUMENTATION_N_PLUS_ONE_THRESHOLD times or more in a
+    # request, the sign of an N+1 loop, and logs requests slower than SQL_INSTRUMENTATION_SLOW_REQUEST
+    # seconds with their slowest queries. With SQL_INSTRUMENTATION off, Django leaves the middleware
+    # out of the chain, so it costs nothing.
+    def __init__(self, get_response):
+        if not settings.SQL_INSTRUMENTATION:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(stats))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        response['Server-Timing'] = (
+            f'db;dur={stats.time * 1000:.2f};desc="{stats.count} queries", total;dur={elapsed * 1000:.2f}'
+        )
+        shapes = stats.shapes()
+        if shapes and shapes[0][1][0] >= settings.SQL_INSTRUMENTATION_N_PLUS_ONE_THRESHOLD:
+            for sql, (count, _) in shapes:
+                if count < settings.SQL_INSTRUMENTATION_N_PLUS_ONE_THRESHOLD:
+                    break
+                logger.warning("Possible N+1 in %s %s: %d x %s", request.method, request.path, count, sql)
+        if elapsed >= settings.SQL_INSTRUMENTATION_SLOW_REQUEST:
+            slowest = sorted(shapes, key=lambda item: item[1][1], reverse=True)[:settings.SQL_INSTRUMENTATION_TOP_QUERIES]
+            logger.warning(
+                "Slow request %s %s: %.0fms, %d queries in %.0fms. Slowest:%s",
+                request.method, request.path, elapsed * 1000, stats.count, stats.time * 1000,
+                ''.join(f'\n  {seconds * 1000:.1f}ms, {count} x {sql}' for sql, (count, seconds) in slowest),
+            )
+        return response
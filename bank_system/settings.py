@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,10 +44,14 @@ INSTALLED_APPS = [
     'drf_spectacular',
     'users',
     'account',
-    'bank'
+    'bank',
+    'benchmarks',
+    'metrics'
 ]
 
 MIDDLEWARE = [
+    'metrics.middleware.MetricsMiddleware',
+    'bank_system.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,9 +89,40 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file-backed test database, so concurrency tests get real SQLite locking
+        # instead of the in-memory shared cache, which fails concurrent writers outright
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Tune every SQLite connection for concurrent writers (WAL, busy timeout, mmap, page cache and
+# BEGIN IMMEDIATE, see account/sqlite.py). The write queue additionally serializes this process's
+# money-moving transactions in arrival order instead of letting them contend for the file lock.
+SQLITE_TUNING = True
+SQLITE_WRITE_QUEUE = False
+
+# Group commit: money-moving writes from concurrent requests are handed to one writer thread per
+# process and committed together, up to BATCH_SIZE writes per commit, waiting at most MAX_WAIT
+# seconds for a batch to fill. Each request is answered only after its batch commits. It only helps
+# when a process serves requests from several threads.
+GROUP_COMMIT = False
+GROUP_COMMIT_BATCH_SIZE = 100
+GROUP_COMMIT_MAX_WAIT = 0.005
+
+# Per-request SQL instrumentation (bank_system/middleware.py): a Server-Timing header with each
+# request's query count and time, a warning for a query run N_PLUS_ONE_THRESHOLD times or more in
+# one request, and a log of requests slower than SLOW_REQUEST seconds with their TOP_QUERIES
+# slowest queries. Logged to the 'bank_system.middleware' logger.
+SQL_INSTRUMENTATION = False
+SQL_INSTRUMENTATION_N_PLUS_ONE_THRESHOLD = 10
+SQL_INSTRUMENTATION_SLOW_REQUEST = 0.5
+SQL_INSTRUMENTATION_TOP_QUERIES = 5
+
+# Each process writes its metrics to a memory-mapped file in METRICS_DIR, and /metrics sums the
+# files of all of them. Every worker of a server must share the directory; run clear_metrics
+# before the server starts. /metrics is unauthenticated, so keep it off the public ingress.
+METRICS_DIR = Path(tempfile.gettempdir()) / 'bank_system_metrics'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -130,10 +166,79 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': "drf_spectacular.openapi.AutoSchema",
-    'DEFAULT_AUTHENTICATION_CLASSES': ('rest_framework_simplejwt.authentication.JWTAuthentication',),
+    'DEFAULT_AUTHENTICATION_CLASSES': ('users.authentication.CachedJWTAuthentication',),
+    # Throttles identify clients by REMOTE_ADDR rather than a spoofable X-Forwarded-For;
+    # set this to the number of proxies in front of the app when there are any
+    'NUM_PROXIES': 0,
+    # Failed logins allowed per client IP and per email, in a sliding window
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': '20/m',
+        'login_email': '5/m',
+    },
 }
 
-SIMPLE_JWT = {'AUTH_HEADER_TYPES': ('Bearer',), 'BLACKLIST_AFTER_ROTATION': True,}
+SIMPLE_JWT = {
+    'AUTH_HEADER_TYPES': ('Bearer',),
+    'BLACKLIST_AFTER_ROTATION': True,
+    'CHECK_REVOKE_TOKEN': True,  # Tokens carry a password fingerprint, so a password change revokes them
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.TokenRefreshSerializer',
+}
 SPECTACULAR_SETTINGS = {'COMPONENT_SPLIT_REQUEST': True}
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
-AUTH_USER_MODEL = 'users.User'
\ No newline at end of file
+DEFAULT_FROM_EMAIL = 'from@example.com'  # Replace with your sender email
+
+# Exchange rates are stored per one unit of FX_BASE_CURRENCY and cached in each process.
+# After FX_CACHE_TTL seconds the cache checks whether another process changed the rates.
+FX_BASE_CURRENCY = 'USD'
+FX_CACHE_TTL = 60
+
+# How long a money-moving request's Idempotency-Key is honoured, and how many of the most
+# recently used keys each process keeps in memory
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_CACHE_SIZE = 10000
+
+# Rendered transaction and loan lists each process keeps, served again until the user's data
+# changes. An entry holds one page of a list.
+RESPONSE_CACHE_SIZE = 1000
+
+# How long each process trusts a user it resolved from an access token, and how many it keeps.
+# Saving or deleting the user clears it at once in the process that made the change.
+AUTH_USER_CACHE_TTL = 30
+AUTH_USER_CACHE_SIZE = 10000
+
+# Bloom filter of blacklisted refresh tokens kept by each process: sized for CAPACITY tokens at
+# ERROR_RATE false positives, and topped up with other processes' logouts every REFRESH seconds.
+# A row can commit after rows with higher ids, so each refresh reads again the rows blacklisted in the
+# last OVERLAP seconds, which must outlast the longest logout transaction and the clock skew between servers.
+TOKEN_BLACKLIST_FILTER_CAPACITY = 1000000
+TOKEN_BLACKLIST_FILTER_ERROR_RATE = 0.001
+TOKEN_BLACKLIST_FILTER_REFRESH = 1
+TOKEN_BLACKLIST_FILTER_OVERLAP = 60
+
+AUTHENTICATION_BACKENDS = ['users.backends.PasswordPoolBackend']
+
+# Login passwords are hashed in a pool of WORKERS processes (None for one per CPU, 0 to hash
+# in the request thread); logins beyond QUEUE in flight per process get a 503
+PASSWORD_HASH_WORKERS = None
+PASSWORD_HASH_QUEUE = 64
+
+# Outgoing email waits in the outbox table for the run_mail_worker command. A failed message is
+# retried after RETRY_DELAY seconds, doubling up to MAX_RETRY_DELAY, and given up after MAX_ATTEMPTS.
+# A worker holds the messages it picked up for LEASE seconds before another may send them.
+MAIL_OUTBOX_RETRY_DELAY = 30
+MAIL_OUTBOX_MAX_RETRY_DELAY = 3600
+MAIL_OUTBOX_MAX_ATTEMPTS = 10
+MAIL_OUTBOX_LEASE = 300
+AUTH_USER_MODEL = 'users.User'
+
+# Tests tagged 'benchmark' are slow load runs, left out unless asked for with
+# `python manage.py test --tag benchmark`
+TEST_RUNNER = 'benchmarks.runner.TestRunner'
+
+# Benchmark tests log their figures as JSON lines through benchmarks.driver.report
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {'benchmarks': {'handlers': ['console'], 'level': 'INFO', 'propagate': False}},
+}
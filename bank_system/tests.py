@@ -0,0 +1,95 @@
+import time
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+from account.models import BankAccount, Transaction
+from benchmarks import driver
+from users.models import User
+from .middleware import QueryInstrumentationMiddleware
+
+@override_settings(SQL_INSTRUMENTATION=True)
+class QueryInstrumentationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='instrumented@example.com', password='testpassword')
+        self.account = BankAccount.objects.create(user=self.user, balance=0, currency='ILS')
+        Transaction.objects.bulk_create([
+            Transaction(account=self.account, amount=1, transaction_type='deposit', currency='ILS') for _ in range(100)
+        ])
+        self.headers = {'Authorization': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    # A request whose view looks users up one at a time
+    def run_lookups(self, lookups):
+        def view(request):
+            for pk in range(lookups):
+                User.objects.filter(pk=pk).exists()
+            return HttpResponse()
+        return QueryInstrumentationMiddleware(view)(RequestFactory().get('/lookups/'))
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = Client(headers=self.headers).get(reverse('user-transactions'))
+        self.assertEqual(response.status_code, 200)
+        db, total = response['Server-Timing'].split(', ')
+        self.assertRegex(db, rf'^db;dur=[\d.]+;desc="{len(queries)} queries"$')
+        self.assertRegex(total, r'^total;dur=[\d.]+$')
+
+    @override_settings(SQL_INSTRUMENTATION=False)
+    def test_disabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            QueryInstrumentationMiddleware(lambda request: HttpResponse())
+        response = Client(headers=self.headers).get(reverse('user-transactions'))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(SQL_INSTRUMENTATION_N_PLUS_ONE_THRESHOLD=10)
+    def test_n_plus_one(self):
+        with self.assertLogs('bank_system.middleware', 'WARNING') as logs:
+            self.run_lookups(10)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('Possible N+1 in GET /lookups/: 10 x SELECT', logs.output[0])
+
+        with self.assertNoLogs('bank_system.middleware'):
+            self.run_lookups(9)
+
+    @override_settings(SQL_INSTRUMENTATION_SLOW_REQUEST=0, SQL_INSTRUMENTATION_TOP_QUERIES=1)
+    def test_slow_request(self):
+        with self.assertLogs('bank_system.middleware', 'WARNING') as logs:
+            response = self.run_lookups(3)
+        self.assertIn('3 queries', response['Server-Timing'])
+        self.assertRegex(logs.output[0], r'Slow request GET /lookups/: \d+ms, 3 queries in [\d.]+ms. Slowest:\n  [\d.]+ms, 3 x SELECT')
+
+    def test_in_lists_share_a_shape(self):
+        def view(request):
+            for size in range(1, 11):
+                list(User.objects.filter(pk__in=range(size)))
+            return HttpResponse()
+        with self.assertLogs('bank_system.middleware', 'WARNING') as logs:
+            QueryInstrumentationMiddleware(view)(RequestFactory().get('/lookups/'))
+        self.assertIn('10 x SELECT', logs.output[0])
+        self.assertIn('IN (...)', logs.output[0])
+
+    @tag('benchmark')
+    def test_benchmark_overhead(self):
+        # Transaction listing, alternating between clients with and without the middleware
+        url = reverse('user-transactions')
+        rounds, requests = 5, 40
+        timings = {True: 0.0, False: 0.0}
+        for _ in range(rounds):
+            for enabled in [False, True]:
+                with override_settings(SQL_INSTRUMENTATION=enabled):
+                    client = Client(headers=self.headers)
+                    expected = client.get(url).content  # Loads the middleware chain
+                    started = time.perf_counter()
+                    responses = [client.get(url) for _ in range(requests)]
+                    timings[enabled] += time.perf_counter() - started
+                for response in responses:
+                    self.assertEqual(response.content, expected)
+                    self.assertEqual(response.has_header('Server-Timing'), enabled)
+        per_request = {enabled: seconds / (rounds * requests) * 1000 for enabled, seconds in timings.items()}
+        driver.report(
+            'sql_instrumentation_overhead', without_ms=round(per_request[False], 3), with_ms=round(per_request[True], 3),
+            overhead_percent=round((per_request[True] / per_request[False] - 1) * 100, 1),
+        )
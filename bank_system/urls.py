@@ -17,7 +17,9 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
-from rest_framework_simplejwt.views import (TokenObtainPairView, TokenRefreshView)
+from rest_framework_simplejwt.views import TokenRefreshView
+from users.views import TokenObtainPairView
+from metrics.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -28,4 +30,5 @@ urlpatterns = [
     path('api/user/', include('users.urls')),
     path('api/account/', include('account.urls')),
     path('api/bank/', include('bank.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -0,0 +1,158 @@
+import asyncio
+import contextvars
+import json
+import logging
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+
+# In-process load driver: requests go straight into Django's WSGI or ASGI handler, with no server
+# or sockets in between, so the numbers measure the application and its database.
+
+logger = logging.getLogger(__name__)
+
+_queries = contextvars.ContextVar('benchmark_queries', default=None)
+
+# Counts the queries of the request being driven in this context. Under ASGI, sync views run in
+# another thread, which gets a copy of the context, so their queries are counted too.
+def count_query(execute, sql, params, many, context):
+    counter = _queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+def install_counter(sender, connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+# Counts queries on every connection, including those opened by the driver's threads meanwhile
+@contextmanager
+def counting_queries():
+    connection_created.connect(install_counter)
+    for conn in connections.all(initialized_only=True):
+        install_counter(None, conn)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(install_counter)
+        for conn in connections.all(initialized_only=True):
+            if count_query in conn.execute_wrappers:
+                conn.execute_wrappers.remove(count_query)
+
+# Sends 'count' requests from each session, the sessions running concurrently. 'next_request'
+# gives the (method, path, body) of a session's n-th request; a session has the 'token' and 'ip'
+# it sends them with. Returns the (status, seconds, queries) of every request, and the wall time.
+def run_wsgi(sessions, next_request, count):
+    def client_session(session):
+        client = Client(REMOTE_ADDR=session.ip, headers={'Authorization': f'Bearer {session.token}'})
+        results = []
+        try:
+            for n in range(count):
+                method, path, body = next_request(session, n)
+                counter = [0]
+                _queries.set(counter)
+                started = time.perf_counter()
+                response = getattr(client, method)(path, body, content_type='application/json')
+                results.append((response.status_code, time.perf_counter() - started, counter[0]))
+        finally:
+            connection.close()
+        return results
+
+    started = time.perf_counter()
+    with counting_queries(), ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+        results = [result for session in executor.map(client_session, sessions) for result in session]
+    return results, time.perf_counter() - started
+
+# As run_wsgi, with the sessions as concurrent tasks on one event loop
+def run_asgi(sessions, next_request, count):
+    application = ASGIHandler()
+
+    async def request(session, method, path, body):
+        payload = json.dumps(body).encode() if body is not None else b''
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+            'method': method.upper(), 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'client': (session.ip, 0), 'server': ('testserver', 80),
+            'headers': [
+                (b'host', b'testserver'),
+                (b'authorization', f'Bearer {session.token}'.encode()),
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(payload)).encode()),
+            ],
+        }
+        messages = [{'type': 'http.request', 'body': payload}]
+        sent = {}
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Future()  # The client never disconnects early
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                sent['status'] = message['status']
+
+        counter = [0]
+        _queries.set(counter)
+        started = time.perf_counter()
+        await application(scope, receive, send)
+        return sent['status'], time.perf_counter() - started, counter[0]
+
+    async def client_session(session):
+        results = []
+        for n in range(count):
+            results.append(await request(session, *next_request(session, n)))
+        return results
+
+    async def run():
+        return await asyncio.gather(*[client_session(session) for session in sessions])
+
+    started = time.perf_counter()
+    with counting_queries():
+        results = [result for session in asyncio.run(run()) for result in session]
+    return results, time.perf_counter() - started
+
+# Throughput, latency percentiles in milliseconds, queries per request, and the requests that
+# didn't get a 2xx response
+def summarize(results, elapsed):
+    latencies = [seconds * 1000 for _, seconds, _ in results]
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'requests': len(results),
+        'errors': sum(1 for status_code, _, _ in results if not 200 <= status_code < 300),
+        'throughput': round(len(results) / elapsed, 1),
+        'p50_ms': round(percentiles[49], 2),
+        'p95_ms': round(percentiles[94], 2),
+        'p99_ms': round(percentiles[98], 2),
+        'queries_per_request': round(sum(queries for _, _, queries in results) / len(results), 2),
+    }
+
+# The ways each endpoint of 'report' got worse than in 'baseline' by more than 'threshold', a
+# fraction: lower throughput, higher p95 latency, more queries per request, or failing requests
+def compare(report, baseline, threshold):
+    regressions = []
+    for name, result in report['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        if result['throughput'] < before['throughput'] * (1 - threshold):
+            regressions.append(f"{name}: throughput {result['throughput']}/s, was {before['throughput']}/s")
+        if result['p95_ms'] > before['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p95 latency {result['p95_ms']}ms, was {before['p95_ms']}ms")
+        if result['queries_per_request'] > before['queries_per_request'] * (1 + threshold):
+            regressions.append(
+                f"{name}: {result['queries_per_request']} queries per request, was {before['queries_per_request']}"
+            )
+        if result['errors'] > before['errors']:
+            regressions.append(f"{name}: {result['errors']} failed requests, was {before['errors']}")
+    return regressions
+
+# Logs the figures of the benchmark 'name' as one line of JSON, for collecting and comparing runs
+def report(name, **figures):
+    logger.info(json.dumps({'benchmark': name, **figures}))
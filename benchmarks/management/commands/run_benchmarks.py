@@ -0,0 +1,90 @@
+import json
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from account.transfers import group_writer
+from benchmarks import driver
+from benchmarks.scenarios import SCENARIOS, seed
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the API hot paths in process. Seeds customers into a throwaway database, drives each "
+        "endpoint from --concurrency simulated clients through Django's WSGI or ASGI handler, and reports "
+        "throughput, p50/p95/p99 latency and SQL queries per request as JSON. With --baseline, fails "
+        "when an endpoint got worse than the saved report by more than --threshold."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), help="Endpoints to drive (default: all)")
+        parser.add_argument('--handler', choices=['wsgi', 'asgi'], default='wsgi')
+        parser.add_argument('--concurrency', type=int, default=8, help="Simulated clients sending requests at once")
+        parser.add_argument('--requests', type=int, default=25, help="Requests each client sends per endpoint")
+        parser.add_argument('--history', type=int, default=200, help="Transactions seeded into each account")
+        parser.add_argument('--output', help="Write the JSON report here instead of standard output")
+        parser.add_argument('--save-baseline', help="Also write the report here, to compare later runs with")
+        parser.add_argument('--baseline', help="Report of an earlier run to compare with")
+        parser.add_argument('--threshold', type=float, default=0.2, help="Tolerated change against the baseline, as a fraction")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1 or options['concurrency'] * options['requests'] < 2:
+            raise CommandError("--concurrency and --requests must be at least 1, and make at least 2 requests.")
+        baseline = None
+        if options['baseline']:
+            try:
+                baseline = json.loads(Path(options['baseline']).read_text())
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can't read the baseline: {e}")
+
+        run = driver.run_asgi if options['handler'] == 'asgi' else driver.run_wsgi
+        report = {
+            'handler': options['handler'],
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'scenarios': {},
+        }
+        old_name = self.create_database()
+        try:
+            sessions = seed(options['concurrency'], options['history'])
+            # The driver's requests come addressed to the host name Django's test client uses
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                for name in options['scenarios'] or SCENARIOS:
+                    results, elapsed = run(sessions, SCENARIOS[name], options['requests'])
+                    report['scenarios'][name] = driver.summarize(results, elapsed)
+                    if options['verbosity'] > 1:
+                        self.stderr.write(f"{name}: {report['scenarios'][name]}")
+        finally:
+            group_writer.stop()  # Its connection is to the database about to be dropped
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(output + '\n')
+        else:
+            self.stdout.write(output)
+        if options['save_baseline']:
+            Path(options['save_baseline']).write_text(output + '\n')
+
+        if baseline is not None:
+            regressions = driver.compare(report, baseline, options['threshold'])
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n  " + '\n  '.join(regressions))
+            self.stderr.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    # A fresh, migrated database beside the configured one, so seeding never touches real data.
+    # Returns the configured name, which destroy_test_db switches back to.
+    def create_database(self):
+        settings_dict = connection.settings_dict
+        name = settings_dict['NAME']
+        if connection.vendor == 'sqlite':
+            benchmark_name = str(Path(name).with_name(f'benchmark_{Path(name).name}'))
+        else:
+            benchmark_name = f'benchmark_{name}'
+        test_settings = settings_dict['TEST']
+        settings_dict['TEST'] = {**test_settings, 'NAME': benchmark_name}
+        try:
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        finally:
+            settings_dict['TEST'] = test_settings
+        return name
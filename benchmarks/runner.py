@@ -0,0 +1,10 @@
+from django.test.runner import DiscoverRunner
+
+BENCHMARK_TAG = 'benchmark' # Tag of the tests that measure load rather than check behaviour
+
+class TestRunner(DiscoverRunner):
+    # Leaves out the tests tagged BENCHMARK_TAG unless they are asked for with --tag benchmark
+    def __init__(self, *args, tags=None, exclude_tags=None, **kwargs):
+        if BENCHMARK_TAG not in (tags or []):
+            exclude_tags = [*(exclude_tags or []), BENCHMARK_TAG]
+        super().__init__(*args, tags=tags, exclude_tags=exclude_tags, **kwargs)
@@ -0,0 +1,84 @@
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+from account.models import BankAccount, Transaction
+from bank.models import Loan
+from users.models import User
+
+PASSWORD = 'benchmark-password'
+OPENING_BALANCE = Decimal('1000000') # Enough for every withdrawal and transfer a run makes
+
+class Session:
+    # One simulated client: a seeded customer with two accounts and a loan
+    def __init__(self, index, user, accounts, loan):
+        self.index = index
+        self.email = user.email
+        self.accounts = accounts
+        self.loan = loan
+        self.token = str(AccessToken.for_user(user))
+        self.ip = f'10.{index // 250}.{index % 250}.1'
+
+# Creates 'users' customers, each with two accounts holding 'history' transactions apiece and an
+# outstanding loan, and returns a Session for each. The customers share one password hash, so
+# seeding doesn't spend its time hashing.
+def seed(users, history):
+    password = make_password(PASSWORD)
+    customers = User.objects.bulk_create([
+        User(email=f'customer{i}@example.com', username=f'customer{i}', password=password) for i in range(users)
+    ])
+    accounts = BankAccount.objects.bulk_create([
+        BankAccount(user=user, balance=OPENING_BALANCE, currency='ILS') for user in customers for _ in range(2)
+    ])
+    Transaction.objects.bulk_create([
+        Transaction(account=account, amount=10, transaction_type='deposit', currency='ILS')
+        for account in accounts for _ in range(history)
+    ], batch_size=1000)
+    loans = Loan.objects.bulk_create([
+        Loan(user=user, amount=100000, principal=100000, annual_rate=Decimal('0.05')) for user in customers
+    ])
+    return [
+        Session(i, user, accounts[2 * i:2 * i + 2], loan)
+        for i, (user, loan) in enumerate(zip(customers, loans))
+    ]
+
+# Each scenario gives the (method, path, body) of a session's n-th request to one endpoint
+
+def login(session, n):
+    return 'post', reverse('user:user-login'), {'email': session.email, 'password': PASSWORD}
+
+def deposit(session, n):
+    return 'post', reverse('account-deposit', args=[session.accounts[0].pk]), {'amount': 10}
+
+def withdraw(session, n):
+    return 'post', reverse('account-withdraw', args=[session.accounts[0].pk]), {'amount': 5}
+
+# Back and forth between the session's two accounts
+def transfer(session, n):
+    source, target = session.accounts if n % 2 == 0 else reversed(session.accounts)
+    return 'post', reverse('account-transfer'), {
+        'from_account_id': source.pk, 'to_account_id': target.pk, 'amount': 5, 'currency': 'ILS'
+    }
+
+def transactions(session, n):
+    return 'get', reverse('user-transactions'), None
+
+def loans(session, n):
+    return 'get', reverse('get-loans'), None
+
+def loan_grant(session, n):
+    return 'post', reverse('grant-loan'), {'amount': 100}
+
+def loan_repay(session, n):
+    return 'post', reverse('repay-loan', args=[session.loan.pk]), {'amount': 1}
+
+SCENARIOS = {
+    'login': login,
+    'deposit': deposit,
+    'withdraw': withdraw,
+    'transfer': transfer,
+    'transactions': transactions,
+    'loans': loans,
+    'loan_grant': loan_grant,
+    'loan_repay': loan_repay,
+}
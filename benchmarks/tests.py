@@ -0,0 +1,76 @@
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from users.models import User
+from . import driver
+from .runner import TestRunner
+
+@override_settings(PASSWORD_HASHERS=['users.tests.FastPBKDF2PasswordHasher'], PASSWORD_HASH_WORKERS=0)
+class RunBenchmarksTests(SimpleTestCase):
+    # SimpleTestCase, so no transaction is held open while the command swaps in its own database
+    databases = {'default'}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def run_benchmarks(self, *args):
+        call_command(
+            'run_benchmarks', '--concurrency', '2', '--requests', '3', '--history', '5', *args,
+            stdout=StringIO(), stderr=StringIO()
+        )
+
+    def test_report_and_baseline(self):
+        test_database = connection.settings_dict['NAME']
+        baseline = self.directory / 'baseline.json'
+        self.run_benchmarks('--save-baseline', baseline)
+
+        report = json.loads(baseline.read_text())
+        self.assertEqual(list(report['scenarios']), ['login', 'deposit', 'withdraw', 'transfer', 'transactions', 'loans', 'loan_grant', 'loan_repay'])
+        for name, result in report['scenarios'].items():
+            self.assertEqual(result['requests'], 6, name)
+            self.assertEqual(result['errors'], 0, name)
+            self.assertGreater(result['queries_per_request'], 0, name)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+            self.assertLessEqual(result['p95_ms'], result['p99_ms'])
+
+        # The seeded data went into a database of its own, dropped afterwards
+        self.assertEqual(connection.settings_dict['NAME'], test_database)
+        self.assertFalse(User.objects.filter(email__startswith='customer').exists())
+
+        # Two runs of the same tree differ only by timing noise, which a wide threshold tolerates
+        self.run_benchmarks('--scenarios', 'deposit', 'loans', '--handler', 'asgi', '--baseline', baseline, '--threshold', '100')
+
+        report['scenarios']['deposit']['queries_per_request'] = 0.01
+        baseline.write_text(json.dumps(report))
+        with self.assertRaisesRegex(CommandError, r'deposit: [\d.]+ queries per request, was 0.01'):
+            self.run_benchmarks('--scenarios', 'deposit', '--baseline', baseline, '--threshold', '100')
+
+    def test_compare(self):
+        before = {'throughput': 100, 'p95_ms': 10, 'queries_per_request': 4, 'errors': 0}
+        baseline = {'scenarios': {'deposit': before}}
+        self.assertEqual(driver.compare({'scenarios': {'deposit': {**before, 'throughput': 85, 'p95_ms': 11.5}}}, baseline, 0.2), [])
+        self.assertEqual(driver.compare({'scenarios': {'loans': {**before, 'throughput': 1}}}, baseline, 0.2), [])
+        regressions = driver.compare(
+            {'scenarios': {'deposit': {'throughput': 70, 'p95_ms': 13, 'queries_per_request': 5, 'errors': 2}}}, baseline, 0.2
+        )
+        self.assertEqual(len(regressions), 4)
+
+    def test_report(self):
+        with self.assertLogs('benchmarks.driver', 'INFO') as logs:
+            driver.report('deposit', requests=6, throughput=12.5)
+        self.assertEqual(json.loads(logs.records[0].getMessage()), {'benchmark': 'deposit', 'requests': 6, 'throughput': 12.5})
+
+
+class TestRunnerTests(SimpleTestCase):
+    def test_benchmarks_only_run_when_asked_for(self):
+        self.assertEqual(TestRunner().exclude_tags, {'benchmark'})
+        self.assertEqual(TestRunner(exclude_tags=['slow']).exclude_tags, {'slow', 'benchmark'})
+        runner = TestRunner(tags=['benchmark'])
+        self.assertEqual((runner.tags, runner.exclude_tags), ({'benchmark'}, set()))
@@ -0,0 +1,15 @@
+from .registry import Counter, Histogram
+
+# Every route is recorded under its URL name, so the label values stay few whatever the paths requested
+requests = Counter('http_requests_total', 'Requests answered, by view, method and status.', ['view', 'method', 'status'])
+errors = Counter('http_request_errors_total', 'Requests answered with a 5xx status.', ['view', 'method'])
+latency = Histogram('http_request_duration_seconds', 'Time to answer a request.', ['view', 'method'])
+
+deposits = Counter('bank_deposits_total', 'Deposits made.', ['currency'])
+deposited = Counter('bank_deposited_amount_total', 'Amount credited by deposits, after fees.', ['currency'])
+withdrawals = Counter('bank_withdrawals_total', 'Withdrawals made.', ['currency'])
+withdrawn = Counter('bank_withdrawn_amount_total', 'Amount debited by withdrawals, fees included.', ['currency'])
+transfers = Counter('bank_transfers_total', 'Transfers made, batch transfers included.', ['currency'])
+transferred = Counter('bank_transfer_volume_total', 'Amount credited by transfers, in the receiving account currency.', ['currency'])
+loans = Counter('bank_loans_granted_total', 'Loans granted.')
+lent = Counter('bank_loan_amount_granted_total', 'Principal of the loans granted.')
@@ -0,0 +1,17 @@
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = (
+        "Delete the metric files of earlier processes from METRICS_DIR. Run it before starting the "
+        "server, for example from gunicorn's on_starting hook: the files of workers that exited still "
+        "count towards /metrics until then, so counters don't go back when a worker is replaced."
+    )
+
+    def handle(self, *args, **options):
+        removed = 0
+        for path in Path(settings.METRICS_DIR).glob('*.db'):
+            path.unlink(missing_ok=True)
+            removed += 1
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} metric files"))
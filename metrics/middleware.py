@@ -0,0 +1,38 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from . import instruments
+
+UNMATCHED = '<unmatched>'  # View label of requests no route matched
+
+class MetricsMiddleware:
+    # Records each request's count, latency and 5xx errors under the name of the route that served it.
+    # Under ASGI it awaits the rest of the chain on the event loop, so async views keep their thread.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, elapsed):
+        match = request.resolver_match
+        view = match.view_name if match is not None else UNMATCHED
+        instruments.requests.inc(view, request.method, str(response.status_code))
+        instruments.latency.observe(elapsed, view, request.method)
+        if response.status_code >= 500:
+            instruments.errors.inc(view, request.method)
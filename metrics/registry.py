@@ -0,0 +1,72 @@
+from bisect import bisect_left
+from .store import collect, store
+
+# Seconds; a request slower than the last bound only counts towards +Inf
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+class Counter:
+    # The name ends in _total, as Prometheus names counters
+    def __init__(self, name, documentation, labelnames=()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        REGISTRY.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        store.add((self.name, '', labelvalues), amount)
+
+    def samples(self, values):
+        for (name, suffix, labelvalues), value in sorted(values.items()):
+            if name == self.name:
+                yield self.name + suffix, dict(zip(self.labelnames, labelvalues)), value
+
+class Histogram:
+    # Each observation adds to the count of the first bucket it fits and to the sum; the buckets are
+    # made cumulative, as Prometheus expects, only when the metrics are read
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.bounds = [format_value(bound) for bound in self.buckets] + ['+Inf']
+        REGISTRY.append(self)
+
+    def observe(self, value, *labelvalues):
+        store.add((self.name, '_bucket', labelvalues + (self.bounds[bisect_left(self.buckets, value)],)), 1)
+        store.add((self.name, '_sum', labelvalues), value)
+
+    def samples(self, values):
+        series = {}
+        for (name, suffix, labelvalues), value in values.items():
+            if name != self.name:
+                continue
+            if suffix == '_bucket':
+                counts = series.setdefault(labelvalues[:-1], {'buckets': {}, 'sum': 0.0})['buckets']
+                counts[labelvalues[-1]] = value
+            else:
+                series.setdefault(labelvalues, {'buckets': {}, 'sum': 0.0})['sum'] = value
+        for labelvalues, data in sorted(series.items()):
+            labels = dict(zip(self.labelnames, labelvalues))
+            count = 0.0
+            for bound in self.bounds:
+                count += data['buckets'].get(bound, 0.0)
+                yield self.name + '_bucket', {**labels, 'le': bound}, count
+            yield self.name + '_sum', labels, data['sum']
+            yield self.name + '_count', labels, count
+
+def format_value(value):
+    return repr(float(value))
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+# Every registered metric, summed over all processes, in the Prometheus text format
+def render():
+    values = collect()
+    lines = []
+    for metric in REGISTRY:
+        kind = 'histogram' if isinstance(metric, Histogram) else 'counter'
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {kind}')
+        for name, labels, value in metric.samples(values):
+            label_text = ','.join(f'{label}="{escape(text)}"' for label, text in labels.items())
+            lines.append(f'{name}{{{label_text}}} {format_value(value)}' if labels else f'{name} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,102 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from pathlib import Path
+from django.conf import settings
+
+# A process's metric values live in METRICS_DIR/<pid>.db, a memory-mapped file of entries appended
+# one after another: the length of a JSON key, the key padded to 8 bytes, then the value as a double.
+# The first 8 bytes hold how far the entries reach. An entry is written in full before that mark is
+# moved past it, so a reader never sees half an entry.
+HEADER = struct.Struct('Q')
+LENGTH = struct.Struct('I')
+VALUE = struct.Struct('d')
+INITIAL_SIZE = 64 * 1024
+
+def encode_key(key):
+    encoded = json.dumps(key).encode()
+    padding = -(LENGTH.size + len(encoded)) % 8
+    return LENGTH.pack(len(encoded)) + encoded + b' ' * padding
+
+# The (key, value) entries of one file, readable while its process keeps writing to it
+def read_entries(data):
+    used = HEADER.unpack_from(data, 0)[0]
+    position = HEADER.size
+    while position < used:
+        length = LENGTH.unpack_from(data, position)[0]
+        key = json.loads(data[position + LENGTH.size:position + LENGTH.size + length])
+        position += LENGTH.size + length + (-(LENGTH.size + length) % 8)
+        yield key, VALUE.unpack_from(data, position)[0]
+        position += VALUE.size
+
+class MmapStore:
+    # This process's metric values. Adding to a value takes one uncontended lock, a dict lookup and
+    # a read and write of 8 mapped bytes; only the first value of a key appends to the file. Nothing
+    # is flushed: the pages are shared, so other processes read the values from memory.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)  # A forked worker writes a file of its own
+
+    def _reset(self):
+        self._mmap = None
+        self._positions = {}  # Key -> offset of its value
+        self._used = HEADER.size
+
+    def add(self, key, amount):
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                position = self._append(key)
+            VALUE.pack_into(self._mmap, position, VALUE.unpack_from(self._mmap, position)[0] + amount)
+
+    def _append(self, key):
+        if self._mmap is None:
+            self._open()
+        entry = encode_key(key)
+        if self._used + len(entry) + VALUE.size > len(self._mmap):
+            self._grow(self._used + len(entry) + VALUE.size)
+        self._mmap[self._used:self._used + len(entry)] = entry
+        position = self._used + len(entry)
+        VALUE.pack_into(self._mmap, position, 0.0)
+        self._used = position + VALUE.size
+        HEADER.pack_into(self._mmap, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    def _open(self):
+        directory = Path(settings.METRICS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory / f'{os.getpid()}.db', 'w+b') as file:
+            file.truncate(INITIAL_SIZE)
+            self._mmap = mmap.mmap(file.fileno(), INITIAL_SIZE)
+        HEADER.pack_into(self._mmap, 0, self._used)
+
+    def _grow(self, needed):
+        size = len(self._mmap)
+        while size < needed:
+            size *= 2
+        self._mmap.resize(size)
+
+    # Forget the values written so far and start a new file, as after a fork. For tests.
+    def reset(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._reset()
+
+store = MmapStore()
+
+# Every key's value summed over the files of all processes, past and present
+def collect(directory=None):
+    totals = {}
+    for path in sorted(Path(directory or settings.METRICS_DIR).glob('*.db')):
+        data = path.read_bytes()
+        if len(data) < HEADER.size:
+            continue
+        for key, value in read_entries(data):
+            key = tuple(key[:-1]) + (tuple(key[-1]),)
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
@@ -0,0 +1,205 @@
+import multiprocessing
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+import django
+from django.conf import settings
+from unittest import mock
+from django.test import AsyncClient, SimpleTestCase, override_settings, tag
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+from account.models import BankAccount
+from bank import async_views
+from bank.models import Loan
+from benchmarks import driver
+from users.models import User
+from . import instruments
+from .registry import REGISTRY, Counter, Histogram, render
+from .store import INITIAL_SIZE, collect, store
+
+# Runs in the spawned processes of StoreTests.test_spawned_workers, standing in for gunicorn workers
+def record_in_worker(directory, count):
+    settings.METRICS_DIR = directory
+    for _ in range(count):
+        instruments.deposits.inc('ILS')
+        instruments.latency.observe(0.02, 'account-deposit', 'POST')
+    return True
+
+class MetricsDirMixin:
+    # Each test writes its metrics to a directory of its own, from a fresh file
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        override = override_settings(METRICS_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        store.reset()
+        self.addCleanup(store.reset)
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return response.content.decode()
+
+    def assertSample(self, text, sample, value):
+        match = re.search(rf'^{re.escape(sample)} (\S+)$', text, re.MULTILINE)
+        self.assertIsNotNone(match, f"{sample} not in:\n{text}")
+        self.assertEqual(float(match.group(1)), value)
+
+class MetricsTests(MetricsDirMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='metrics@example.com', password='testpassword')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+        self.account = BankAccount.objects.create(user=self.user, balance=1000, currency='ILS')
+        self.other = BankAccount.objects.create(user=self.user, balance=0, currency='ILS')
+
+    def test_request_metrics(self):
+        for _ in range(3):
+            self.client.post(reverse('account-deposit', args=[self.account.id]), {'amount': 100}, format='json')
+        self.client.post(reverse('account-withdraw', args=[self.account.id]), {'amount': 100000}, format='json')
+        self.client.get('/no-such-page/')
+
+        text = self.scrape()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertSample(text, 'http_requests_total{view="account-deposit",method="POST",status="200"}', 3)
+        self.assertSample(text, 'http_requests_total{view="account-withdraw",method="POST",status="400"}', 1)
+        self.assertSample(text, 'http_requests_total{view="<unmatched>",method="GET",status="404"}', 1)
+        self.assertSample(text, 'http_request_duration_seconds_bucket{view="account-deposit",method="POST",le="+Inf"}', 3)
+        self.assertSample(text, 'http_request_duration_seconds_count{view="account-deposit",method="POST"}', 3)
+        self.assertNotIn('http_request_errors_total{', text)
+
+    # With metrics first in the chain, neither the middleware nor an async view holds a worker thread:
+    # both run on the event loop's own thread
+    async def test_async_view_keeps_the_event_loop_thread(self):
+        loop_thread = threading.current_thread()
+        threads = []
+        def record_thread(original):
+            def wrapper(*args, **kwargs):
+                threads.append(threading.current_thread())
+                return original(*args, **kwargs)
+            return wrapper
+
+        with mock.patch.object(async_views, 'LoanSerializer', side_effect=record_thread(async_views.LoanSerializer)), \
+                mock.patch.object(instruments.requests, 'inc', side_effect=record_thread(instruments.requests.inc)):
+            response = await AsyncClient().get(reverse('get-loans-async'), headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(threads, [loop_thread, loop_thread])
+        self.assertEqual(collect()[('http_requests_total', '', ('get-loans-async', 'GET', '200'))], 1)
+
+    def test_business_counters(self):
+        self.client.post(reverse('account-deposit', args=[self.account.id]), {'amount': 100}, format='json')
+        self.client.post(reverse('account-withdraw', args=[self.account.id]), {'amount': 100}, format='json')
+        self.client.post(reverse('account-transfer'), {
+            'from_account_id': self.account.id, 'to_account_id': self.other.id, 'amount': 50, 'currency': 'ILS'
+        }, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('account-transfer-batch'), {'transfers': [
+                {'from_account_id': self.account.id, 'to_account_id': self.other.id, 'amount': 20},
+                {'from_account_id': self.account.id, 'to_account_id': 0, 'amount': 20},
+            ]}, format='json')
+        self.client.post(reverse('grant-loan'), {'amount': 5000}, format='json')
+
+        text = self.scrape()
+        self.assertSample(text, 'bank_deposits_total{currency="ILS"}', 1)
+        self.assertSample(text, 'bank_deposited_amount_total{currency="ILS"}', 99)
+        self.assertSample(text, 'bank_withdrawals_total{currency="ILS"}', 1)
+        self.assertSample(text, 'bank_withdrawn_amount_total{currency="ILS"}', 101)
+        self.assertSample(text, 'bank_transfers_total{currency="ILS"}', 2)
+        self.assertSample(text, 'bank_transfer_volume_total{currency="ILS"}', 70)
+        self.assertSample(text, 'bank_loans_granted_total', 1)
+        self.assertSample(text, 'bank_loan_amount_granted_total', 5000)
+        self.assertEqual(Loan.objects.count(), 1)
+
+class StoreTests(MetricsDirMixin, SimpleTestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('test_seconds', 'Test.', ['view'], buckets=[0.1, 1])
+        self.addCleanup(REGISTRY.remove, histogram)
+        for value in [0.05, 0.1, 0.5, 2]:
+            histogram.observe(value, 'a')
+        samples = list(histogram.samples(collect()))
+        self.assertEqual(samples, [
+            ('test_seconds_bucket', {'view': 'a', 'le': '0.1'}, 2.0),
+            ('test_seconds_bucket', {'view': 'a', 'le': '1.0'}, 3.0),
+            ('test_seconds_bucket', {'view': 'a', 'le': '+Inf'}, 4.0),
+            ('test_seconds_sum', {'view': 'a'}, 2.65),
+            ('test_seconds_count', {'view': 'a'}, 4.0),
+        ])
+
+    def test_file_grows(self):
+        counter = Counter('test_grow_total', 'Test.', ['key'])
+        self.addCleanup(REGISTRY.remove, counter)
+        keys = INITIAL_SIZE // 16
+        for key in range(keys):
+            counter.inc(f'{key:020d}', amount=key)
+        values = collect()
+        self.assertEqual(len(values), keys)
+        self.assertEqual(values[('test_grow_total', '', (f'{keys - 1:020d}',))], keys - 1)
+
+    def test_label_values_are_escaped(self):
+        counter = Counter('test_escape_total', 'Test.', ['view'])
+        self.addCleanup(REGISTRY.remove, counter)
+        counter.inc('a"b\\c\nd')
+        self.assertIn('test_escape_total{view="a\\"b\\\\c\\nd"} 1.0', render())
+
+    def test_forked_child_writes_its_own_file(self):
+        instruments.loans.inc()
+        child = multiprocessing.get_context('fork').Process(target=instruments.loans.inc)
+        child.start()
+        child.join()
+        self.assertEqual(child.exitcode, 0)
+        instruments.loans.inc()
+        self.assertEqual(collect()[('bank_loans_granted_total', '', ())], 3)
+        self.assertEqual(len(list(Path(self.directory).glob('*.db'))), 2)
+
+    def test_spawned_workers(self):
+        with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup) as executor:
+            self.assertTrue(all(executor.map(record_in_worker, [self.directory] * 4, [250] * 4)))
+        values = collect()
+        self.assertEqual(values[('bank_deposits_total', '', ('ILS',))], 1000)
+        self.assertEqual(values[('http_request_duration_seconds', '_bucket', ('account-deposit', 'POST', '0.025'))], 1000)
+
+    def test_threads(self):
+        def record(_):
+            for _ in range(2000):
+                instruments.deposits.inc('ILS')
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(record, range(8)))
+        self.assertEqual(collect()[('bank_deposits_total', '', ('ILS',))], 16000)
+
+    @tag('benchmark')
+    def test_benchmark_recording(self):
+        count = 100000
+        nanoseconds = {}
+        for name, record in [
+            ('counter_inc_ns', lambda: instruments.deposits.inc('ILS')),
+            ('counter_inc_with_amount_ns', lambda: instruments.deposited.inc('ILS', amount=99.0)),
+            ('histogram_observe_ns', lambda: instruments.latency.observe(0.012, 'account-deposit', 'POST')),
+        ]:
+            record()  # The first write of a key appends it to the file
+            started = time.perf_counter()
+            for _ in range(count):
+                record()
+            nanoseconds[name] = round((time.perf_counter() - started) / count * 1e9)
+
+        def contend(_):
+            for _ in range(count // 8):
+                instruments.deposits.inc('ILS')
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(contend, range(8)))
+        nanoseconds['counter_inc_8_threads_ns'] = round((time.perf_counter() - started) / count * 1e9)
+
+        values = collect()
+        self.assertEqual(values[('bank_deposits_total', '', ('ILS',))], 2 * count + 1)
+        self.assertEqual(values[('bank_deposited_amount_total', '', ('ILS',))], (count + 1) * 99.0)
+        self.assertEqual(values[('http_request_duration_seconds', '_bucket', ('account-deposit', 'POST', '0.025'))], count + 1)
+        driver.report('metric_recording', operations=count, **nanoseconds)
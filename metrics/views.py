@@ -0,0 +1,6 @@
+from django.http import HttpResponse
+from .registry import render
+
+# Prometheus scrape endpoint: the metrics of every worker process, summed
+def metrics_view(request):
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self) -> None:
+        from . import authentication  # noqa: F401 Connects the authenticated user cache invalidation signals
+        from . import tokens  # noqa: F401 Connects the blacklist filter updates
+        return super().ready()
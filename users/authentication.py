@@ -0,0 +1,124 @@
+import threading
+from copy import copy
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from account.cache import LRUCache
+from .models import User, users_updated
+
+class UserCache:
+    # Users resolved from access tokens, kept for AUTH_USER_CACHE_TTL seconds under their id and
+    # token version, the password fingerprint the token carries. A token issued after a password
+    # change, in any process, misses the entry and reloads the user. Saving, updating or deleting a
+    # user drops its entry in this process; other processes see the change once the TTL runs out.
+    def __init__(self, maxsize, ttl):
+        self._users = LRUCache(maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.generation = 0  # Bumped on every invalidation
+
+    def get(self, user_id, version):
+        entry = self._users.get(user_id)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        return None
+
+    # 'generation' is the value read before the user was loaded. A user loaded while an
+    # invalidation happened may already be stale, so it isn't cached.
+    def set(self, user_id, version, user, generation):
+        with self._lock:
+            if generation == self.generation:
+                self._users.set(user_id, (version, user))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self.generation += 1
+            self._users.delete(user_id)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._users.clear()
+
+users = UserCache(settings.AUTH_USER_CACHE_SIZE, settings.AUTH_USER_CACHE_TTL)
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # JWTAuthentication that resolves the token's user from the in-process cache, so an
+    # authenticated request costs no user query while the entry is fresh. The active flag and the
+    # token's password version are still checked against the cached user on every request.
+    def get_user(self, validated_token):
+        user_id, version = self.get_user_id(validated_token), self.get_token_version(validated_token)
+        user = users.get(user_id, version)
+        if user is None:
+            generation = users.generation
+            try:
+                user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            users.set(user_id, version, user, generation)
+        return self.check_user(user, validated_token)
+
+    # The claim holds the id as a string, which is also how the cache is keyed
+    # The password fingerprint the token was issued with, or None for tokens that carry none
+    def get_token_version(self, validated_token):
+        return validated_token.get(api_settings.REVOKE_TOKEN_CLAIM)
+
+    def get_user_id(self, validated_token):
+        try:
+            return str(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    # Same checks as simplejwt's get_user. Returns a copy, so a request never changes the cached user.
+    def check_user(self, user, validated_token):
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return copy(user)
+
+class AsyncJWTAuthentication(CachedJWTAuthentication):
+    # Authentication for the async views. Reading and validating the token needs no database,
+    # so only the user lookup changes: on a cache miss it goes through the async ORM.
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        user_id, version = self.get_user_id(validated_token), self.get_token_version(validated_token)
+        user = users.get(user_id, version)
+        if user is None:
+            generation = users.generation
+            try:
+                user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            users.set(user_id, version, user, generation)
+        return self.check_user(user, validated_token)
+
+# Updating, deactivating or deleting a user must take effect on this process's next request
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    users.invalidate(str(getattr(instance, api_settings.USER_ID_FIELD)))
+
+# The same for users changed by a queryset update, which sends no post_save
+@receiver(users_updated, sender=User)
+def invalidate_users(sender, user_ids, **kwargs):
+    for user_id in user_ids:
+        users.invalidate(str(user_id))
@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from .passwords import check_password
+
+UserModel = get_user_model()
+
+# ModelBackend with the password checked in the hashing pool, for the token endpoint and the admin
+class PasswordPoolBackend(ModelBackend):
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            user = None
+        if check_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
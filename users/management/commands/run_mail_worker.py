@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from users.outbox import send_batch
+
+class Command(BaseCommand):
+    help = (
+        "Send the emails waiting in the outbox, in batches over one SMTP connection each. "
+        "Failed messages are retried with exponential backoff. Runs until stopped, unless --once is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Messages sent per connection")
+        parser.add_argument('--interval', type=float, default=1, help="Seconds to wait when the outbox is empty")
+        parser.add_argument('--once', action='store_true', help="Exit once no message is due")
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        try:
+            while True:
+                sent, failed = send_batch(options['batch_size'])
+                total_sent += sent
+                total_failed += failed
+                if sent + failed < options['batch_size']:
+                    if options['once']:
+                        break
+                    connection.close()  # Don't hold a connection while idle
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Sent {total_sent} emails, {total_failed} failed attempts"))
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # simplejwt's outstanding token table has no index on expires_at, which purge_expired_tokens
+    # needs to find expired tokens without scanning the whole table. The table belongs to
+    # simplejwt's app, so the index is created with plain SQL.
+
+    dependencies = [
+        ('users', '0001_initial'),
+        ('token_blacklist', '0013_alter_blacklistedtoken_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX outstanding_token_expires_idx ON token_blacklist_outstandingtoken (expires_at)',
+            'DROP INDEX outstanding_token_expires_idx',
+        ),
+    ]
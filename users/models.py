@@ -1,8 +1,21 @@
 from django.db import models
+from django.dispatch import Signal
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.models import BaseUserManager
 
-class CustomUserManager(BaseUserManager):
+# Sent with the ids of the users a queryset update changed, which gets no post_save
+users_updated = Signal()
+
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        user_ids = list(self.values_list('pk', flat=True))
+        updated = super().update(**kwargs)
+        if user_ids:
+            users_updated.send(sender=self.model, user_ids=user_ids)
+        return updated
+
+class CustomUserManager(BaseUserManager.from_queryset(UserQuerySet)):
     # Create and return a 'User' with an email and password.
     def create_user(self, email, password=None, **extra_fields):
         if not email:
@@ -48,4 +61,24 @@ class User(AbstractUser):
     REQUIRED_FIELDS = []  # Required fields when creating a user
 
     def __str__(self):
-        return self.email
\ No newline at end of file
+        return self.email
+
+
+class OutboxMessage(models.Model):
+    # An email waiting to be sent by the run_mail_worker command. Written in the same DB transaction
+    # as the change it reports, so a message exists only if the change does.
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField()  # List of recipient addresses
+    created_at = models.DateTimeField(auto_now_add=True)
+    send_after = models.DateTimeField(default=timezone.now)  # Pushed back while a worker holds it, and after each failure
+    attempts = models.PositiveSmallIntegerField(default=0)  # Failed attempts so far
+    last_error = models.TextField(blank=True)
+    sent_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            # Unsent messages in the order they are due
+            models.Index(fields=['sent_at', 'send_after'], name='outbox_pending_idx'),
+        ]
@@ -0,0 +1,56 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from .models import OutboxMessage
+
+# Store an email for the mail worker to send. Call it inside the transaction that makes
+# the change the email is about, so both commit or neither does.
+def queue_mail(subject, message, from_email, recipient_list):
+    return OutboxMessage.objects.create(subject=subject, body=message, from_email=from_email, to=list(recipient_list))
+
+# Claim up to 'batch_size' due messages and send them over one connection. A claimed message
+# isn't due again for MAIL_OUTBOX_LEASE seconds, so a second worker skips it, and a worker that
+# dies mid-batch only delays it. Returns the number of messages sent and the number that failed.
+def send_batch(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(sent_at=None, send_after__lte=now, attempts__lt=settings.MAIL_OUTBOX_MAX_ATTEMPTS)
+            .order_by('send_after', 'pk')[:batch_size]
+        )
+        if not messages:
+            return 0, 0
+        OutboxMessage.objects.filter(pk__in=[message.pk for message in messages]).update(
+            send_after=now + timedelta(seconds=settings.MAIL_OUTBOX_LEASE)
+        )
+
+    sent, failed = [], []
+    connection = get_connection()
+    try:
+        for message in messages:
+            email = EmailMessage(message.subject, message.body, message.from_email, message.to, connection=connection)
+            try:
+                connection.open()  # Once per batch, or again after a failure closed the connection
+                email.send()
+            except Exception as e:
+                connection.close()
+                message.attempts += 1
+                message.last_error = f'{type(e).__name__}: {e}'
+                message.send_after = timezone.now() + retry_delay(message.attempts)
+                failed.append(message)
+            else:
+                message.sent_at = timezone.now()
+                sent.append(message)
+    finally:
+        connection.close()
+
+    OutboxMessage.objects.bulk_update(sent, ['sent_at'])
+    OutboxMessage.objects.bulk_update(failed, ['attempts', 'last_error', 'send_after'])
+    return len(sent), len(failed)
+
+# MAIL_OUTBOX_RETRY_DELAY seconds after the first failure, doubling with each one after it
+def retry_delay(attempts):
+    return timedelta(seconds=min(settings.MAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), settings.MAIL_OUTBOX_MAX_RETRY_DELAY))
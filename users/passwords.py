@@ -0,0 +1,99 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher, identify_hasher, is_password_usable
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+class HashingUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins in progress, try again shortly.'
+    default_code = 'hashing_unavailable'
+
+def hasher_path(hasher):
+    return f'{type(hasher).__module__}.{type(hasher).__qualname__}'
+
+# The two functions below run in the pool's workers, so they take hashers by import path
+
+# Returns whether the password matches, and the password hashed with 'upgrade_path' if it does
+def verify(password, encoded, path, upgrade_path=None):
+    if not import_string(path)().verify(password, encoded):
+        return False, None
+    if upgrade_path is None:
+        return True, None
+    upgrade = import_string(upgrade_path)()
+    return True, upgrade.encode(password, upgrade.salt())
+
+# Hashes the password and throws the result away, so an unknown email takes as long as a wrong password
+def waste_time(password, path):
+    hasher = import_string(path)()
+    hasher.encode(password, hasher.salt())
+    return False, None
+
+class HashingPool:
+    # Process pool for password hashing. PBKDF2 holds a request worker's CPU for as long as a
+    # login takes; in the pool the request thread only waits, and at most PASSWORD_HASH_WORKERS
+    # hashes run at a time however many logins arrive. Logins beyond PASSWORD_HASH_QUEUE in flight
+    # are turned away with a 503 instead of queueing. PASSWORD_HASH_WORKERS = 0 hashes inline.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+
+    def run(self, func, *args):
+        if settings.PASSWORD_HASH_WORKERS == 0:
+            return func(*args)
+
+        with self._lock:
+            if self._pending >= settings.PASSWORD_HASH_QUEUE:
+                raise HashingUnavailable()
+            self._pending += 1
+            if self._executor is None:
+                # Spawned rather than forked: forking a process that runs threads can deadlock the child
+                self._executor = ProcessPoolExecutor(
+                    max_workers=settings.PASSWORD_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=django.setup,
+                )
+            executor = self._executor
+        try:
+            return executor.submit(func, *args).result()
+        except BrokenProcessPool:
+            self.shutdown(executor)  # A worker died; the next login starts a fresh pool
+            raise HashingUnavailable()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def shutdown(self, executor=None):
+        with self._lock:
+            if self._executor is None or executor not in (None, self._executor):
+                return
+            executor, self._executor = self._executor, None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+hashing_pool = HashingPool()
+
+# Same result as user.check_password, with the hashing done in the pool. A password stored with
+# an outdated hasher or work factor is rehashed there too, and saved once it is known to match.
+def check_password(user, password):
+    preferred = get_hasher('default')
+    if user is None or password is None or not is_password_usable(user.password):
+        return hashing_pool.run(waste_time, password or '', hasher_path(preferred))[0]
+
+    try:
+        hasher = identify_hasher(user.password)
+    except ValueError:
+        return False
+    must_update = hasher.algorithm != preferred.algorithm or preferred.must_update(user.password)
+    valid, encoded = hashing_pool.run(
+        verify, password, user.password, hasher_path(hasher), hasher_path(preferred) if must_update else None
+    )
+    if encoded is not None:
+        user.password = encoded
+        user.save(update_fields=['password'])
+    return valid
@@ -1,5 +1,8 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer as BaseTokenRefreshSerializer
 from .models import User
+from .passwords import check_password
+from .tokens import RefreshToken
 from django.contrib.auth import get_user_model
 
 class UserSerializer(serializers.ModelSerializer):
@@ -29,11 +32,9 @@ class UserLoginSerializer(serializers.Serializer):
         password = attrs.get("password")
         User = get_user_model()
         if email and password:
-            try:
-                user = User.objects.get(email=email)
-                if not user.check_password(password):
-                    user = None
-            except User.DoesNotExist:
+            # An unknown email still costs a hash, so response times don't tell which emails exist
+            user = User.objects.filter(email=email).first()
+            if not check_password(user, password):
                 user = None
 
             if user is None:
@@ -42,4 +43,8 @@ class UserLoginSerializer(serializers.Serializer):
             raise serializers.ValidationError("Must include email and password.")
         
         attrs["user"] = user
-        return attrs
\ No newline at end of file
+        return attrs
+
+# Refresh through the token class that checks the blacklist filter first
+class TokenRefreshSerializer(BaseTokenRefreshSerializer):
+    token_class = RefreshToken
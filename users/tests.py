@@ -1,8 +1,32 @@
+import os
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 from django.urls import reverse
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
 from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import Client, TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
-from .models import User
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from account import conditional
+from account.cache import LRUCache
+from benchmarks import driver
+from . import authentication, passwords, tokens
+from .models import OutboxMessage, User
+from .outbox import queue_mail
 from rest_framework_simplejwt.tokens import RefreshToken
 
 class UserTests(APITestCase):
@@ -47,21 +71,6 @@ class UserTests(APITestCase):
         self.assertTrue(user.check_password(data['password']))
         self.user = User.objects.get(email=data['email'])
 
-    def test_create_user_welcome_email(self):
-        url = reverse('user-create')
-        data = {
-            'password': 'newpassword',
-            'email': 'new@example.com'
-        }
-
-        response = self.client.post(url, data, format='json')
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        
-        # Check that one message has been sent
-        self.assertEqual(len(mail.outbox), 1)
-        self.assertEqual(mail.outbox[0].subject, 'Welcome to Our Bank!')
-        self.assertIn('Welcome, new@example.com!', mail.outbox[0].body)
-
     def test_update_user(self):
         if self.user is None:
             self.test_create_user()  # Create a user if not already created
@@ -150,4 +159,503 @@ class UserTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)  # Expect a 400 error
         self.assertIn('non_field_errors', response.data)  # Check for error key
-        self.assertIn('Invalid email or password.', response.data['non_field_errors'])  # Check for specific error message
\ No newline at end of file
+        self.assertIn('Invalid email or password.', response.data['non_field_errors'])  # Check for specific error message
+
+class AuthenticationCacheTests(APITestCase):
+    def setUp(self):
+        authentication.users.clear()
+        self.addCleanup(authentication.users.clear)
+        self.user = User.objects.create_user(
+            email='cached@example.com',
+            password='testpassword'
+        )
+
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(self.token.access_token))
+        self.url = reverse('user-transactions')
+        # Every request runs the list query, so only the user lookup differs between them
+        responses = mock.patch.object(conditional, '_responses', LRUCache(0))
+        responses.start()
+        self.addCleanup(responses.stop)
+
+    # Returns the number of queries the request ran, and how many of them read the user table
+    def count_queries(self, expected_status=status.HTTP_200_OK):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, expected_status)
+        return len(queries), sum('"users_user"' in query['sql'] for query in queries)
+
+    def test_cached_user_saves_a_query_per_request(self):
+        before = self.count_queries()
+        after = self.count_queries()
+        self.assertEqual(before[1], 1)
+        self.assertEqual(after, (before[0] - 1, 0))
+
+    def test_update_view_invalidates(self):
+        self.count_queries()
+        response = self.client.patch(reverse('user:user-update', args=[self.user.id]), {'first_name': 'New'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.count_queries()[1], 1)
+
+    def test_deactivated_user_is_rejected(self):
+        self.count_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.count_queries(status.HTTP_401_UNAUTHORIZED)
+
+    def test_user_deactivated_by_a_queryset_update_is_rejected_right_away(self):
+        self.count_queries()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.count_queries(status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_version_is_part_of_the_key(self):
+        self.count_queries()
+        # A password change made by another process, which doesn't reach this process's cache
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE users_user SET password = %s WHERE id = %s', [make_password('changed'), self.user.pk])
+        self.user.refresh_from_db()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.user).access_token))
+        self.assertEqual(self.count_queries()[1], 1)  # The new token's version misses the cached entry
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(self.token.access_token))
+        self.count_queries(status.HTTP_401_UNAUTHORIZED)
+
+    def test_delete_view_invalidates(self):
+        self.count_queries()
+        response = self.client.delete(reverse('user:user-delete', args=[self.user.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.count_queries(status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(TOKEN_BLACKLIST_FILTER_REFRESH=60)
+class TokenBlacklistTests(APITestCase):
+    def setUp(self):
+        tokens.blacklist_filter.reset()
+        self.addCleanup(tokens.blacklist_filter.reset)
+        self.user = User.objects.create_user(
+            email='blacklist@example.com',
+            password='testpassword'
+        )
+        self.refresh = str(tokens.RefreshToken.for_user(self.user))
+        tokens.blacklist_filter.load()  # Synchronously: a background load's connection can't see this test's rows
+
+    def post(self, url_name, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse(url_name), data, format='json')
+        return response, [query['sql'] for query in queries]
+
+    def test_refresh_skips_the_blacklist_table(self):
+        response, queries = self.post('token_refresh', {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any('blacklistedtoken' in sql for sql in queries))
+
+    def test_logout_blacklists_by_jti(self):
+        response, queries = self.post('user:user-logout', {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_205_RESET_CONTENT)
+        self.assertFalse(any('"token_blacklist_outstandingtoken"."token" =' in sql for sql in queries))
+
+        response, _ = self.post('token_refresh', {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_repeat_logout_succeeds(self):
+        for _ in range(2):
+            response, _ = self.post('user:user-logout', {'refresh': self.refresh})
+            self.assertEqual(response.status_code, status.HTTP_205_RESET_CONTENT)
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+
+    def test_logout_with_invalid_token(self):
+        for data in [{}, {'refresh': 'not-a-token'}]:
+            response, _ = self.post('user:user-logout', data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(TOKEN_BLACKLIST_FILTER_REFRESH=0)
+    def test_filter_picks_up_other_processes_logouts(self):
+        # Written without signals, the way a logout in another process looks to this one
+        jti = tokens.RefreshToken(self.refresh)['jti']
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=OutstandingToken.objects.get(jti=jti))])
+
+        response, _ = self.post('token_refresh', {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(TOKEN_BLACKLIST_FILTER_REFRESH=0)
+    def test_filter_picks_up_rows_committed_out_of_id_order(self):
+        # On PostgreSQL a logout can commit after another one that got a higher id
+        late, early = [tokens.RefreshToken.for_user(self.user) for _ in range(2)]
+        outstanding = {token['jti']: OutstandingToken.objects.get(jti=token['jti']) for token in [late, early]}
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(pk=100, token=outstanding[early['jti']])])
+        tokens.blacklist_filter.refresh()
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(pk=50, token=outstanding[late['jti']])])
+
+        response, _ = self.post('token_refresh', {'refresh': str(late)})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(TOKEN_BLACKLIST_FILTER_REFRESH=0)
+    def test_floor_moves_past_settled_rows_only(self):
+        old, recent = [tokens.RefreshToken.for_user(self.user) for _ in range(2)]
+        BlacklistedToken.objects.bulk_create([
+            BlacklistedToken(token=OutstandingToken.objects.get(jti=token['jti'])) for token in [old, recent]
+        ])
+        first, second = BlacklistedToken.objects.order_by('pk')
+        BlacklistedToken.objects.filter(pk=first.pk).update(blacklisted_at=timezone.now() - timedelta(hours=1))
+        tokens.blacklist_filter.refresh()
+        self.assertEqual((tokens.blacklist_filter._floor, tokens.blacklist_filter._recent), (first.pk, {second.pk}))
+
+        # Read again while in the overlap window, but added to the filter once
+        count = tokens.blacklist_filter._filter.count
+        tokens.blacklist_filter.refresh()
+        self.assertEqual(tokens.blacklist_filter._filter.count, count)
+
+    def test_purge_expired_tokens(self):
+        expired = tokens.RefreshToken.for_user(self.user)
+        expired.blacklist()
+        OutstandingToken.objects.filter(jti=expired['jti']).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        call_command('purge_expired_tokens', chunk_size=1, stdout=StringIO())
+        self.assertEqual(list(OutstandingToken.objects.values_list('token', flat=True)), [self.refresh])
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+
+@tag('benchmark')
+class TokenBlacklistBenchmarkTests(TestCase):
+    # Refresh and logout against a large outstanding token table, one in ten of them blacklisted.
+    # TOKEN_BENCHMARK_ROWS sets the table size, for example 10000000 for a production-sized run.
+    rows = int(os.environ.get('TOKEN_BENCHMARK_ROWS', 100000))
+    samples = 200
+
+    def setUp(self):
+        tokens.blacklist_filter.reset()
+        self.addCleanup(tokens.blacklist_filter.reset)
+        self.user = User.objects.create_user(
+            email='blacklist-benchmark@example.com',
+            password='testpassword'
+        )
+
+        # Filler rows carry a real token's text, so scanning them costs what it would in production
+        token_text = str(tokens.RefreshToken.for_user(self.user))
+        now = timezone.now()
+        expires = now + timedelta(days=1)
+        with connection.cursor() as cursor:
+            for start in range(0, self.rows, 100000):
+                cursor.executemany(
+                    'INSERT INTO token_blacklist_outstandingtoken (jti, token, created_at, expires_at, user_id) '
+                    'VALUES (%s, %s, %s, %s, %s)',
+                    [(uuid.uuid4().hex, token_text, now, expires, self.user.pk)
+                     for _ in range(min(100000, self.rows - start))]
+                )
+            cursor.execute(
+                'INSERT INTO token_blacklist_blacklistedtoken (token_id, blacklisted_at) '
+                'SELECT id, %s FROM token_blacklist_outstandingtoken WHERE id %% 10 = 0', [now]
+            )
+        self.refresh_tokens = [str(tokens.RefreshToken.for_user(self.user)) for _ in range(self.samples)]
+
+    # Milliseconds per item of running func over items
+    def time_each(self, items, func):
+        started = time.perf_counter()
+        for item in items:
+            func(item)
+        return (time.perf_counter() - started) / len(items) * 1000
+
+    def test_refresh_and_logout(self):
+        started = time.perf_counter()
+        tokens.blacklist_filter.load()
+        filter_load = time.perf_counter() - started
+
+        def refresh(token):
+            response = self.client.post(reverse('token_refresh'), {'refresh': token}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        def logout(token):
+            response = self.client.post(reverse('user:user-logout'), {'refresh': token}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_205_RESET_CONTENT)
+
+        blacklist_by_table = self.time_each(self.refresh_tokens, RefreshToken)
+        blacklist_by_filter = self.time_each(self.refresh_tokens, tokens.RefreshToken)
+        refresh_ms = self.time_each(self.refresh_tokens, refresh)
+        lookup_by_text = self.time_each(self.refresh_tokens[:3], lambda token: OutstandingToken.objects.get(token=token))
+        logout_ms = self.time_each(self.refresh_tokens, logout)
+
+        for token in self.refresh_tokens:
+            with self.assertRaises(TokenError):
+                tokens.RefreshToken(token)
+        self.assertEqual(BlacklistedToken.objects.filter(token__jti__in=[
+            RefreshToken(token, verify=False)['jti'] for token in self.refresh_tokens
+        ]).count(), self.samples)
+        driver.report(
+            'token_blacklist', outstanding_tokens=self.rows, filter_load_ms=round(filter_load * 1000, 1),
+            check_by_table_ms=round(blacklist_by_table, 3), check_by_filter_ms=round(blacklist_by_filter, 3),
+            refresh_ms=round(refresh_ms, 2), lookup_by_text_ms=round(lookup_by_text, 1), logout_ms=round(logout_ms, 2),
+        )
+
+
+# Counts the connections opened, and fails every message to a bounce@ address
+class FlakyEmailBackend(EmailBackend):
+    connections = 0
+    opened = False
+
+    # Like the SMTP backend, opening an open connection does nothing
+    def open(self):
+        if not self.opened:
+            self.opened = True
+            FlakyEmailBackend.connections += 1
+
+    def close(self):
+        self.opened = False
+
+    def send_messages(self, messages):
+        if any(address.startswith('bounce@') for message in messages for address in message.to):
+            raise ConnectionError('Recipient rejected')
+        return super().send_messages(messages)
+
+# Stands in for an SMTP server that can't be reached
+class UnreachableEmailBackend(EmailBackend):
+    def open(self):
+        raise ConnectionRefusedError('SMTP server unreachable')
+
+@override_settings(EMAIL_BACKEND='users.tests.FlakyEmailBackend')
+class OutboxTests(TestCase):
+    def setUp(self):
+        FlakyEmailBackend.connections = 0
+
+    def run_worker(self, **options):
+        out = StringIO()
+        call_command('run_mail_worker', once=True, stdout=out, **options)
+        return out.getvalue()
+
+    def test_signup_queues_welcome_email(self):
+        response = self.client.post(reverse('user:user-create'), {'email': 'new@example.com', 'password': 'newpassword'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(mail.outbox), 0)  # Queued, not sent
+        self.run_worker()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Welcome to Our Bank!')
+        self.assertIn('Welcome, new@example.com!', mail.outbox[0].body)
+
+    @override_settings(EMAIL_BACKEND='users.tests.UnreachableEmailBackend')
+    def test_signup_does_not_wait_for_smtp(self):
+        response = self.client.post(reverse('user:user-create'), {'email': 'outbox@example.com', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.to, message.sent_at), (['outbox@example.com'], None))
+
+        self.assertIn('Sent 0 emails, 1 failed attempts', self.run_worker())
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('SMTP server unreachable', message.last_error)
+
+    def test_message_is_only_queued_if_the_transaction_commits(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            queue_mail('Subject', 'Body', 'from@example.com', ['to@example.com'])
+            raise ValueError()
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_batches_share_a_connection(self):
+        for i in range(5):
+            queue_mail('Subject', f'Body {i}', 'from@example.com', [f'to{i}@example.com'])
+
+        self.assertIn('Sent 5 emails', self.run_worker(batch_size=2))
+        self.assertEqual(FlakyEmailBackend.connections, 3)
+        self.assertEqual([m.body for m in mail.outbox], [f'Body {i}' for i in range(5)])
+        self.assertFalse(OutboxMessage.objects.filter(sent_at=None).exists())
+
+        self.assertIn('Sent 0 emails', self.run_worker())
+        self.assertEqual(len(mail.outbox), 5)
+
+    @override_settings(MAIL_OUTBOX_RETRY_DELAY=30, MAIL_OUTBOX_MAX_RETRY_DELAY=100, MAIL_OUTBOX_MAX_ATTEMPTS=4)
+    def test_failed_message_is_retried_with_backoff(self):
+        bounced = queue_mail('Subject', 'Body', 'from@example.com', ['bounce@example.com'])
+        queue_mail('Subject', 'Body', 'from@example.com', ['to@example.com'])
+
+        delays = []
+        for attempt in range(1, 5):
+            started = timezone.now()
+            self.run_worker()
+            bounced.refresh_from_db()
+            self.assertEqual(bounced.attempts, attempt)
+            delays.append(round((bounced.send_after - started).total_seconds()))
+            self.assertIn('Sent 0 emails', self.run_worker())  # Not due again yet
+            OutboxMessage.objects.filter(pk=bounced.pk).update(send_after=timezone.now())
+
+        self.assertEqual(delays, [30, 60, 100, 100])
+        self.assertIn('Sent 0 emails, 0 failed attempts', self.run_worker())  # Given up after MAIL_OUTBOX_MAX_ATTEMPTS
+        self.assertEqual([m.to for m in mail.outbox], [['to@example.com']])
+
+
+# Cheap enough to keep the login tests fast; the pool's workers import it from here
+class FastPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    iterations = 1000
+
+# A tenth of the default work factor, so the benchmark's hashing still dominates a login
+class BenchmarkPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    iterations = 100000
+
+@override_settings(
+    PASSWORD_HASHERS=['users.tests.FastPBKDF2PasswordHasher', 'django.contrib.auth.hashers.MD5PasswordHasher'],
+    PASSWORD_HASH_WORKERS=1,
+)
+class LoginTests(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.addClassCleanup(passwords.hashing_pool.shutdown)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(
+            email='login@example.com',
+            password='testpassword'
+        )
+
+    def login(self, email, password, url_name='user:user-login', ip='127.0.0.1'):
+        return self.client.post(reverse(url_name), {'email': email, 'password': password}, format='json', REMOTE_ADDR=ip)
+
+    def test_login_and_token_views_hash_in_the_pool(self):
+        with mock.patch.object(passwords.hashing_pool, 'run', wraps=passwords.hashing_pool.run) as run:
+            self.assertEqual(self.login('login@example.com', 'testpassword').status_code, status.HTTP_200_OK)
+            self.assertEqual(self.login('login@example.com', 'testpassword', 'token_obtain_pair').status_code, status.HTTP_200_OK)
+            self.assertEqual(self.login('missing@example.com', 'testpassword').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(run.call_count, 3)
+
+    def test_outdated_hash_is_upgraded(self):
+        self.user.password = make_password('testpassword', hasher='md5')
+        self.user.save()
+
+        self.assertEqual(self.login('login@example.com', 'wrongpassword').status_code, status.HTTP_400_BAD_REQUEST)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('md5$'))
+
+        self.assertEqual(self.login('login@example.com', 'testpassword').status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+        self.assertEqual(self.login('login@example.com', 'testpassword').status_code, status.HTTP_200_OK)
+
+    def test_failed_logins_are_throttled_per_email(self):
+        for i in range(5):
+            response = self.login('login@example.com', 'wrongpassword', ip=f'10.0.0.{i}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Even the right password is turned away now, without being hashed
+        with mock.patch.object(passwords.hashing_pool, 'run') as run:
+            response = self.login('Login@example.com', 'testpassword', ip='10.0.1.0')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        run.assert_not_called()
+
+        response = self.login('login@example.com', 'wrongpassword', 'token_obtain_pair', ip='10.0.1.1')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_failed_logins_are_throttled_per_ip(self):
+        for i in range(20):
+            response = self.login(f'missing{i}@example.com', 'wrongpassword', 'token_obtain_pair', ip='10.0.0.1')
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.login('login@example.com', 'testpassword', ip='10.0.0.1').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        # A forwarded-for header doesn't get the client a fresh window
+        response = self.client.post(
+            reverse('user:user-login'), {'email': 'login@example.com', 'password': 'testpassword'},
+            format='json', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='10.9.9.9'
+        )
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.login('login@example.com', 'testpassword', ip='10.0.0.2').status_code, status.HTTP_200_OK)
+
+    def test_successful_logins_are_not_throttled(self):
+        for _ in range(30):
+            self.assertEqual(self.login('login@example.com', 'testpassword').status_code, status.HTTP_200_OK)
+
+    @override_settings(PASSWORD_HASH_QUEUE=0)
+    def test_full_pool_turns_logins_away(self):
+        response = self.login('login@example.com', 'testpassword')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@override_settings(PASSWORD_HASHERS=['users.tests.BenchmarkPBKDF2PasswordHasher'])
+@tag('benchmark')
+class LoginBenchmarkTests(TransactionTestCase):
+    # Legitimate users, each from their own IP, log in alongside two attacks: credential stuffing
+    # from one IP across many emails, and password guessing on one email from rotating IPs.
+    # Each client logs in back to back for 'duration' seconds.
+    duration = 4
+    legitimate_clients = 4
+    stuffing_clients = 2
+    guessing_clients = 2
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        password = make_password('testpassword')
+        User.objects.bulk_create([
+            User(email=f'bench{i}@example.com', username=f'bench{i}', password=password)
+            for i in range(self.legitimate_clients + 1)
+        ])
+
+    def run_clients(self):
+        deadline = time.perf_counter() + self.duration
+
+        def client_session(kind, n):
+            client = Client()
+            results = []
+            try:
+                for attempt in range(1000000):
+                    if time.perf_counter() >= deadline:
+                        break
+                    if kind == 'legitimate':
+                        ip, email, password = f'10.0.0.{n}', f'bench{n}@example.com', 'testpassword'
+                    elif kind == 'stuffing':
+                        ip, email, password = '10.1.0.1', f'leaked{n}-{attempt}@example.com', 'hunter2'
+                    else:
+                        ip, email = f'10.2.{n}.{attempt % 250}', f'bench{self.legitimate_clients}@example.com'
+                        password = f'guess{attempt}'
+                    started = time.perf_counter()
+                    response = client.post(
+                        reverse('user:user-login'), {'email': email, 'password': password},
+                        content_type='application/json', REMOTE_ADDR=ip
+                    )
+                    results.append((kind, response.status_code, time.perf_counter() - started))
+            finally:
+                connection.close()
+            return results
+
+        sessions = [('legitimate', n) for n in range(self.legitimate_clients)]
+        sessions += [('stuffing', n) for n in range(self.stuffing_clients)]
+        sessions += [('guessing', n) for n in range(self.guessing_clients)]
+        with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+            results = [r for session in executor.map(lambda s: client_session(*s), sessions) for r in session]
+        cache.clear()
+        return results
+
+    # Every legitimate login succeeds. Abusive ones are refused: after hashing with a 400, or once
+    # the limiter's windows are full with a 429 before hashing. Logs the legitimate logins per
+    # second and their median latency.
+    def check(self, name, results, limited):
+        statuses = Counter((kind, status_code) for kind, status_code, _ in results)
+        self.assertTrue(statuses['legitimate', status.HTTP_200_OK])
+        self.assertEqual({code for kind, code in statuses if kind == 'legitimate'}, {status.HTTP_200_OK})
+        abusive = {code for kind, code in statuses if kind != 'legitimate'}
+        attacks = sum(count for (kind, _), count in statuses.items() if kind != 'legitimate')
+        hashed = sum(count for (kind, code), count in statuses.items() if kind != 'legitimate' and code == status.HTTP_400_BAD_REQUEST)
+        if limited:
+            self.assertEqual(abusive, {status.HTTP_400_BAD_REQUEST, status.HTTP_429_TOO_MANY_REQUESTS})
+            # Stuffing shares one IP and guessing one email: 20 and 5 failures a minute, give or take
+            # the attempts already past the check when the window filled
+            self.assertLessEqual(hashed, 20 + 5 + self.stuffing_clients + self.guessing_clients)
+        else:
+            self.assertEqual(abusive, {status.HTTP_400_BAD_REQUEST})
+
+        latencies = sorted(elapsed for kind, _, elapsed in results if kind == 'legitimate')
+        driver.report(
+            name, logins_per_second=round(len(latencies) / self.duration, 1),
+            median_ms=round(latencies[len(latencies) // 2] * 1000, 1),
+            abusive_attempts=attacks, hashed=hashed, rejected=attacks - hashed,
+        )
+
+    def test_mixed_load(self):
+        no_limits = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'login_ip': None, 'login_email': None}}
+        with override_settings(REST_FRAMEWORK=no_limits, PASSWORD_HASH_WORKERS=0):
+            self.check('login_no_limiter', self.run_clients(), limited=False)
+        with override_settings(PASSWORD_HASH_WORKERS=0):
+            self.check('login_limiter_hashing_inline', self.run_clients(), limited=True)
+        passwords.hashing_pool.shutdown()
+        self.addCleanup(passwords.hashing_pool.shutdown)
+        passwords.hashing_pool.run(passwords.waste_time, '', 'users.tests.FastPBKDF2PasswordHasher')  # Start the workers
+        self.check('login_limiter_hashing_pool', self.run_clients(), limited=True)
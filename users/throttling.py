@@ -0,0 +1,59 @@
+import hashlib
+import threading
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+_lock = threading.Lock()
+
+class LoginFailureThrottle(SimpleRateThrottle):
+    # Sliding window over failed logins, kept in Django's default cache: local memory per process,
+    # or shared between processes when CACHES points at a shared backend. allow_request only reads
+    # the window, so once it is full a login is turned away before its password is hashed. Only the
+    # login views' failures are recorded, so users who get their password right are never throttled.
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        self.history = self.recent(self.key)
+        return len(self.history) < self.num_requests
+
+    def record_failure(self, request, view):
+        if self.rate is None:
+            return
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return
+        with _lock:  # Concurrent failures must not overwrite each other's entry
+            history = self.recent(key)
+            history.insert(0, self.timer())
+            self.cache.set(key, history, self.duration)
+
+    def recent(self, key):
+        return [at for at in self.cache.get(key, []) if at > self.timer() - self.duration]
+
+    # Read the rates on each request rather than once at import, so they follow settings changes
+    @property
+    def THROTTLE_RATES(self):
+        return api_settings.DEFAULT_THROTTLE_RATES
+
+class LoginIPThrottle(LoginFailureThrottle):
+    scope = 'login_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+class LoginEmailThrottle(LoginFailureThrottle):
+    scope = 'login_email'
+
+    # The email is hashed, so any address makes a valid cache key
+    def get_cache_key(self, request, view):
+        email = request.data.get('email')
+        if not isinstance(email, str) or not email:
+            return None
+        ident = hashlib.sha256(email.strip().lower().encode()).hexdigest()
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
@@ -0,0 +1,115 @@
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken as BaseRefreshToken
+from account.cache import BloomFilter
+
+class BlacklistFilter:
+    # Bloom filter of blacklisted JTIs. The full load runs in a background thread, because with a
+    # million blacklisted tokens it takes seconds; until it finishes every token is checked in the
+    # table as before. Tokens blacklisted in this process are added right away. Those blacklisted by
+    # other processes are picked up every TOKEN_BLACKLIST_FILTER_REFRESH seconds by reading the rows
+    # above a floor id. On PostgreSQL a row can commit after rows with higher ids, so the floor only
+    # moves past rows blacklisted more than TOKEN_BLACKLIST_FILTER_OVERLAP seconds ago; younger ones
+    # are read again on every refresh, and the ids already in the filter are skipped.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filter = None
+        self._floor = 0  # Every row with an id up to this one is in the filter
+        self._recent = set()  # Ids above the floor that are in the filter too
+        self._refreshed_at = 0
+        self._loading = False
+
+    def might_contain(self, jti):
+        if time.monotonic() - self._refreshed_at >= settings.TOKEN_BLACKLIST_FILTER_REFRESH:
+            self.refresh()
+        bloom = self._filter
+        return bloom is None or jti in bloom
+
+    def add(self, jti):
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+
+    # Catch up with new blacklist rows, or start a full load in the background
+    def refresh(self):
+        if not self._lock.acquire(blocking=False):
+            return  # Another request is already refreshing
+        try:
+            self._refreshed_at = time.monotonic()
+            if self._filter is not None:
+                self._floor, self._recent = self._read_rows(self._filter, self._floor, self._recent)
+            # The first load, or a rebuild once more tokens were added than the filter was sized for
+            full = self._filter is None or self._filter.count > self._filter.capacity
+            if full and not self._loading:
+                self._loading = True
+                threading.Thread(target=self._load_in_background, daemon=True).start()
+        finally:
+            self._lock.release()
+
+    def _load_in_background(self):
+        try:
+            self.load()
+        finally:
+            self._loading = False
+            connection.close()
+
+    # Build the filter from the whole blacklist table, with room for twice as many tokens,
+    # so the error rate holds as the blacklist grows
+    def load(self):
+        capacity = max(settings.TOKEN_BLACKLIST_FILTER_CAPACITY, BlacklistedToken.objects.count() * 2)
+        bloom = BloomFilter(capacity, settings.TOKEN_BLACKLIST_FILTER_ERROR_RATE)
+        floor, recent = self._read_rows(bloom, 0, set())
+        with self._lock:
+            # Rows blacklisted while it was loading
+            self._filter, (self._floor, self._recent) = bloom, self._read_rows(bloom, floor, recent)
+            self._refreshed_at = time.monotonic()
+
+    # Add the rows above 'floor' that aren't in 'recent' to the filter. Returns the new floor, the
+    # last id before the first row still inside the overlap window, and the ids read above it.
+    def _read_rows(self, bloom, floor, recent):
+        settled_before = timezone.now() - timedelta(seconds=settings.TOKEN_BLACKLIST_FILTER_OVERLAP)
+        new_floor, new_recent = floor, set()
+        rows = BlacklistedToken.objects.filter(pk__gt=floor).order_by('pk').values_list('pk', 'token__jti', 'blacklisted_at')
+        for pk, jti, blacklisted_at in rows.iterator(chunk_size=10000):
+            if pk not in recent:
+                bloom.add(jti)
+            if not new_recent and blacklisted_at < settled_before:
+                new_floor = pk
+            else:
+                new_recent.add(pk)
+        return new_floor, new_recent
+
+    def reset(self):
+        with self._lock:
+            self._filter = None
+            self._floor = 0
+            self._recent = set()
+            self._refreshed_at = 0
+
+blacklist_filter = BlacklistFilter()
+
+class RefreshToken(BaseRefreshToken):
+    # Only a token the filter can't rule out is looked up in the blacklist table,
+    # so refreshing with a live token costs no blacklist query
+    def check_blacklist(self):
+        if blacklist_filter.might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
+
+# A refresh token read for a logout. Its signature, expiry and type are verified, but a token
+# that is already blacklisted is accepted, so logging out again still succeeds.
+class LogoutToken(RefreshToken):
+    def check_blacklist(self):
+        pass
+
+@receiver(post_save, sender=BlacklistedToken)
+def add_to_blacklist_filter(sender, instance, created, **kwargs):
+    if created:
+        blacklist_filter.add(instance.token.jti)
@@ -1,11 +1,17 @@
 from rest_framework import generics, status
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.views import TokenObtainPairView as BaseTokenObtainPairView
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
-from django.core.mail import send_mail
+from django.conf import settings
+from django.db import transaction
 from .models import User
+from .outbox import queue_mail
 from .serializers import UserSerializer, UserLoginSerializer
+from .throttling import LoginEmailThrottle, LoginIPThrottle
+from .tokens import LogoutToken, RefreshToken
 from drf_spectacular.utils import extend_schema
 
 @extend_schema(tags=['User'])
@@ -16,16 +22,16 @@ class UserCreateView(generics.CreateAPIView):
         serializer = self.get_serializer(data=request.data)
         try:
             serializer.is_valid(raise_exception=True)
-            user = serializer.save()
+            with transaction.atomic():
+                user = serializer.save()
 
-            # Send a welcome email
-            send_mail(
-                'Welcome to Our Bank!',
-                f'Welcome, {user.email}! Thank you for creating an account.',
-                'from@example.com',  # Replace with your sender email
-                [user.email],
-                fail_silently=False,
-            )
+                # Queue a welcome email, sent by the run_mail_worker command
+                queue_mail(
+                    'Welcome to Our Bank!',
+                    f'Welcome, {user.email}! Thank you for creating an account.',
+                    settings.DEFAULT_FROM_EMAIL,
+                    [user.email],
+                )
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         
@@ -41,8 +47,18 @@ class UserUpdateView(generics.UpdateAPIView):
 class UserDeleteView(generics.DestroyAPIView):
     queryset = User.objects.all()
 
+# Throttles the login views by failed attempts, per client IP and per email
+class LoginThrottleMixin:
+    throttle_classes = [LoginIPThrottle, LoginEmailThrottle]
+
+    def handle_exception(self, exc):
+        if isinstance(exc, (ValidationError, AuthenticationFailed)):
+            for throttle in self.get_throttles():
+                throttle.record_failure(self.request, self)
+        return super().handle_exception(exc)
+
 @extend_schema(tags=['User'])
-class UserLoginView(generics.GenericAPIView):
+class UserLoginView(LoginThrottleMixin, generics.GenericAPIView):
     serializer_class = UserLoginSerializer
 
     def post(self, request, *args, **kwargs):
@@ -59,11 +75,19 @@ class UserLogoutView(generics.GenericAPIView):
         try:
             # Get the refresh token from the request
             refresh_token = request.data.get('refresh')
+            if not refresh_token:
+                raise TokenError()
 
-            # Blacklist the refresh token
-            token = OutstandingToken.objects.get(token=refresh_token)
-            BlacklistedToken.objects.create(token=token)
+            # Decoding the token verifies it and gives its jti, which is indexed, unlike the token text
+            jti = LogoutToken(refresh_token)[api_settings.JTI_CLAIM]
+
+            # Blacklist the refresh token; one blacklisted already is logged out already
+            token = OutstandingToken.objects.get(jti=jti)
+            BlacklistedToken.objects.get_or_create(token=token)
 
             return Response(status=status.HTTP_205_RESET_CONTENT)
-        except OutstandingToken.DoesNotExist:
-            return Response({'detail': 'Token not found'}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        except (TokenError, OutstandingToken.DoesNotExist):
+            return Response({'detail': 'Token not found'}, status=status.HTTP_400_BAD_REQUEST)
+
+class TokenObtainPairView(LoginThrottleMixin, BaseTokenObtainPairView):
+    pass